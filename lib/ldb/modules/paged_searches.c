@@ -240,6 +240,11 @@ static int ps_search(struct ldb_module *module, struct ldb_request *req)
 		return ldb_next_request(module, req);
 	}
 
+	/* the caller pages this search itself */
+	if (ldb_request_get_control(req, LDB_CONTROL_PAGED_RESULTS_OID)) {
+		return ldb_next_request(module, req);
+	}
+
 	ac = talloc_zero(req, struct ps_context);
 	if (ac == NULL) {
 		ldb_oom(ldb);
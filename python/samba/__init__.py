@@ -131,6 +131,39 @@ class Ldb(_Ldb):
         assert len(values) == 1
         return self.schema_format_value(attribute, values.pop())
 
+    def search_pages(self, base=None, scope=ldb.SCOPE_DEFAULT, expression=None,
+                     attrs=None, controls=None, page_size=1000):
+        """Search using the paged_results control.
+
+        This is a generator, yielding each page of results as it is
+        received, so that large result sets need not be held in memory
+        at once nor exceed the server's size limit.
+
+        :param page_size: Number of results to ask for per page.
+        :return: Iterator over ldb.Result objects, one per page.
+        """
+        if controls is None:
+            controls = []
+        cookie = ""
+        while True:
+            paged = "paged_results:1:{0:d}".format(page_size)
+            # the cookie is passed back base64 encoded, as ldb prints it
+            if cookie:
+                paged += ":" + cookie
+            res = self.search(base, scope, expression, attrs,
+                              controls=controls + [paged])
+            yield res
+
+            cookie = ""
+            for control in res.controls or []:
+                if control.oid == "1.2.840.113556.1.4.319":
+                    # "paged_results:<critical>[:<cookie>]"
+                    fields = str(control).split(":", 2)
+                    if len(fields) == 3:
+                        cookie = fields[2]
+            if not cookie:
+                break
+
     def erase_users_computers(self, dn):
         """Erases user and computer objects from our AD.
 
@@ -18,9 +18,13 @@
 #
 
 import ldb
+import multiprocessing
+import os
 import samba
+import tdb
 import time
 from base64 import b64decode
+from collections import deque
 from samba import dsdb
 from samba import common
 from samba.dcerpc import misc
@@ -31,6 +35,152 @@ from samba.common import dsdb_Dn
 from samba.dcerpc import security
 from samba.descriptor import get_wellknown_sds, get_diff_sds
 from samba.auth import system_session, admin_session
+from samba.samdb import SamDB
+
+
+class link_target_cache(object):
+    """a bounded cache of the link target objects loaded by check_dn
+
+    Entries are keyed on the target objectGUID and remember which
+    attributes were loaded, so a lookup needing an attribute that was not
+    loaded is a miss.  The oldest entries are dropped once max_size is
+    reached.
+    """
+
+    def __init__(self, samdb, max_size=100000):
+        self.samdb = samdb
+        self.max_size = max_size
+        self.controls = ["extended_dn:1:1", "show_recycled:1"]
+        self.entries = {}
+        self.order = deque()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, guidstr, msg, attrs):
+        if self.max_size <= 0:
+            return
+        if guidstr not in self.entries:
+            if len(self.order) >= self.max_size:
+                del self.entries[self.order.popleft()]
+            self.order.append(guidstr)
+        self.entries[guidstr] = (msg, set([a.lower() for a in attrs]))
+
+    def lookup(self, guidstr, attrs):
+        '''return the message for a target GUID, searching on a miss
+
+        raises ldb.LdbError if the GUID can not be found
+        '''
+        if guidstr in self.entries:
+            (msg, loaded) = self.entries[guidstr]
+            for a in attrs:
+                if a.lower() not in loaded:
+                    break
+            else:
+                self.hits += 1
+                return msg
+        self.misses += 1
+        res = self.samdb.search(base="<GUID={0!s}>".format(guidstr), scope=ldb.SCOPE_BASE,
+                                attrs=attrs, controls=self.controls)
+        self.add(guidstr, res[0], attrs)
+        return res[0]
+
+    def prefill(self, attrs, base=None, scope=ldb.SCOPE_SUBTREE, controls=None):
+        '''load the given attributes of all objects with one search'''
+        if controls is None:
+            controls = []
+        res = self.samdb.search(base=base, scope=scope, attrs=attrs,
+                                controls=controls + self.controls)
+        for msg in res:
+            guid = msg.dn.get_extended_component("GUID")
+            if guid is None:
+                continue
+            self.add(str(misc.GUID(guid)), msg, attrs)
+        return len(res)
+
+    def clear(self):
+        self.entries = {}
+        self.order = deque()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            rate = 0.0
+        else:
+            rate = 100.0 * self.hits / lookups
+        return "Link target cache: {0:d} lookups, {1:d} hits, {2:d} misses ({3:.1f}% hit rate)".format(
+            lookups, self.hits, self.misses, rate)
+
+
+class schema_index(object):
+    """a per-run index of the schema lookups made for every attribute of
+    every object
+
+    The methods mirror the SamDB ones.  All attributes in the schema are
+    loaded once; a name that is not in the index is looked up in the
+    schema, so unknown attributes still raise as before.
+    """
+
+    def __init__(self, samdb_schema, schema_dn):
+        self.samdb_schema = samdb_schema
+        self.linkids = {}
+        self.backlinks = {}
+        self.syntax_oids = {}
+        self.attids = {}
+        self.system_flags = {}
+        self.names_by_attid = {}
+
+        res = samdb_schema.search(base=schema_dn, scope=ldb.SCOPE_ONELEVEL,
+                                  expression="(objectClass=attributeSchema)",
+                                  attrs=["lDAPDisplayName"])
+        for msg in res:
+            name = str(msg["lDAPDisplayName"][0])
+            try:
+                self.get_linkId_from_lDAPDisplayName(name)
+                self.get_backlink_from_lDAPDisplayName(name)
+                self.get_syntax_oid_from_lDAPDisplayName(name)
+                self.get_systemFlags_from_lDAPDisplayName(name)
+                attid = self.get_attid_from_lDAPDisplayName(name)
+            except Exception:
+                # left to be looked up (and to fail) when it is used
+                continue
+            self.names_by_attid[attid] = name
+
+    def _lookup(self, index, fn, name):
+        key = str(name).lower()
+        try:
+            return index[key]
+        except KeyError:
+            value = fn(str(name))
+            index[key] = value
+            return value
+
+    def get_linkId_from_lDAPDisplayName(self, name):
+        return self._lookup(self.linkids,
+                            self.samdb_schema.get_linkId_from_lDAPDisplayName, name)
+
+    def get_backlink_from_lDAPDisplayName(self, name):
+        return self._lookup(self.backlinks,
+                            self.samdb_schema.get_backlink_from_lDAPDisplayName, name)
+
+    def get_syntax_oid_from_lDAPDisplayName(self, name):
+        return self._lookup(self.syntax_oids,
+                            self.samdb_schema.get_syntax_oid_from_lDAPDisplayName, name)
+
+    def get_attid_from_lDAPDisplayName(self, name):
+        return self._lookup(self.attids,
+                            self.samdb_schema.get_attid_from_lDAPDisplayName, name)
+
+    def get_systemFlags_from_lDAPDisplayName(self, name):
+        return self._lookup(self.system_flags,
+                            self.samdb_schema.get_systemFlags_from_lDAPDisplayName, name)
+
+    def get_lDAPDisplayName_by_attid(self, attid):
+        try:
+            return self.names_by_attid[attid]
+        except KeyError:
+            name = self.samdb_schema.get_lDAPDisplayName_by_attid(attid)
+            self.names_by_attid[attid] = name
+            return name
 
 
 class dbcheck(object):
@@ -38,7 +188,8 @@ class dbcheck(object):
 
     def __init__(self, samdb, samdb_schema=None, verbose=False, fix=False,
                  yes=False, quiet=False, in_transaction=False,
-                 reset_well_known_acls=False):
+                 reset_well_known_acls=False, link_cache_size=100000,
+                 prefill_link_cache=False, usn_state_file=None):
         self.samdb = samdb
         self.dict_oid_name = None
         self.samdb_schema = (samdb_schema or samdb)
@@ -73,16 +224,30 @@ class dbcheck(object):
         self.reset_well_known_acls = reset_well_known_acls
         self.reset_all_well_known_acls = False
         self.in_transaction = in_transaction
+        self.pool = None
         self.infrastructure_dn = ldb.Dn(samdb, "CN=Infrastructure," + samdb.domain_dn())
         self.naming_dn = ldb.Dn(samdb, "CN=Partitions,{0!s}".format(samdb.get_config_basedn()))
         self.schema_dn = samdb.get_schema_basedn()
+        self.schema = schema_index(self.samdb_schema, self.schema_dn)
         self.rid_dn = ldb.Dn(samdb, "CN=RID Manager$,CN=System," + samdb.domain_dn())
         self.ntds_dsa = ldb.Dn(samdb, samdb.get_dsServiceName())
         self.class_schemaIDGUID = {}
+        self.sd_cache = {}
+        self.sd_cache_size = 50000
+        self.sd_count = 0
+        self.sd_parsed = 0
+        self.sd_parse_time = 0.0
         self.wellknown_sds = get_wellknown_sds(self.samdb)
         self.fix_all_missing_objectclass = False
 
         self.dn_set = set()
+        self.changes_written = 0
+        self.error_dns = set()
+        self.link_cache = link_target_cache(samdb, max_size=link_cache_size)
+        self.prefill_link_cache = prefill_link_cache
+        self.usn_state_file = usn_state_file
+        self.highest_usn = {}
+        self.usn_ncs = None
 
         self.name_map = {}
         try:
@@ -127,29 +292,364 @@ class dbcheck(object):
         except IndexError:
             pass
 
-    def check_database(self, DN=None, scope=ldb.SCOPE_SUBTREE, controls=None, attrs=None):
-        '''perform a database check, returning the number of errors found'''
+    def check_database(self, DN=None, scope=ldb.SCOPE_SUBTREE, controls=None,
+                       attrs=None, streaming=False, jobs=1, since_last_run=False):
+        '''perform a database check, returning the number of errors found
+
+        In streaming mode the objects are checked as they come back from a
+        single subtree search, rather than listing the DNs first and then
+        loading each object with its own base search.
+
+        With jobs > 1 the objects are checked by a pool of worker
+        processes, see check_objects_parallel().
+
+        If we have a usn_state_file, the highest uSNChanged checked in
+        each partition is recorded there after a complete check without
+        errors.  With since_last_run only the objects changed since then
+        (and the objects they link to) are checked.
+        '''
         if controls is None:
             controls = []
         if attrs is None:
             attrs = ['*']
-        res = self.samdb.search(base=DN, scope=scope, attrs=['dn'], controls=controls)
-        self.report('Checking {0:d} objects'.format(len(res)))
-        error_count = 0
 
-        for object in res:
-            self.dn_set.add(str(object.dn))
-            error_count += self.check_object(object.dn, attrs=attrs)
+        if self.usn_state_file is not None:
+            self.usn_ncs = self.naming_contexts()
+
+        if self.prefill_link_cache:
+            self.prefill_link_targets(controls)
+
+        state = None
+        if since_last_run:
+            state = self.load_usn_state()
+            if not state:
+                self.report("No previous dbcheck state found, checking all objects")
+
+        if state:
+            (object_count, error_count) = self.check_objects_since(state, controls,
+                                                                   attrs)
+        elif jobs > 1:
+            res = self.samdb.search(base=DN, scope=scope, attrs=['uSNChanged'],
+                                    controls=controls)
+            self.report('Checking {0:d} objects with {1:d} jobs'.format(len(res), jobs))
+            object_count = len(res)
+            for object in res:
+                self.note_usn(object)
+            error_count = self.check_objects_parallel([str(o.dn) for o in res],
+                                                      attrs, jobs)
+        elif streaming:
+            (object_count, error_count) = self.check_objects_streaming(DN, scope,
+                                                                       controls, attrs)
+        else:
+            res = self.samdb.search(base=DN, scope=scope, attrs=['uSNChanged'],
+                                    controls=controls)
+            self.report('Checking {0:d} objects'.format(len(res)))
+            error_count = 0
+            object_count = len(res)
+
+            for object in res:
+                self.dn_set.add(str(object.dn))
+                self.note_usn(object)
+                error_count += self.check_object(object.dn, attrs=attrs)
 
         if DN is None:
             error_count += self.check_rootdse()
 
+        if self.verbose or self.prefill_link_cache:
+            self.report(self.link_cache.report())
+        if self.verbose and self.sd_count != 0:
+            self.report(self.sd_cache_report())
+
+        if (self.usn_state_file is not None and DN is None and '*' in attrs
+            and scope == ldb.SCOPE_SUBTREE and
+            (error_count == 0 or (self.fix and self.errors_fixed()))):
+            self.save_usn_state()
+
         if error_count != 0 and not self.fix:
             self.report("Please use --fix to fix these errors")
 
-        self.report('Checked {0:d} objects ({1:d} errors)'.format(len(res), error_count))
+        self.report('Checked {0:d} objects ({1:d} errors)'.format(object_count, error_count))
+        return error_count
+
+    def check_objects_streaming(self, DN, scope, controls, attrs,
+                                page_size=1000):
+        '''check all objects found by a paged search, page by page,
+        returning a tuple of (object count, error count)
+
+        Only one page of objects is held at a time.  The objects are loaded
+        with the same controls that check_object() uses.  Once we have
+        written a fix to the database the copy we loaded may be stale, so
+        from then on objects are re-read with a base search, just as in the
+        non-streaming mode.
+        '''
+        search_attrs = list(attrs)
+        for a in ["name", "isDeleted", "systemFlags", "replPropertyMetaData",
+                  "uSNChanged"]:
+            if a not in search_attrs:
+                search_attrs.append(a)
+
+        search_controls = [c for c in controls
+                           if c.split(':')[0] != 'paged_results']
+        for c in self.object_controls():
+            if c.split(':')[0] not in [x.split(':')[0] for x in search_controls]:
+                search_controls.append(c)
+
+        self.report('Checking objects, {0:d} at a time'.format(page_size))
+        error_count = 0
+        object_count = 0
+        for res in self.samdb.search_pages(base=DN, scope=scope,
+                                           attrs=search_attrs,
+                                           controls=search_controls,
+                                           page_size=page_size):
+            for obj in res:
+                object_count += 1
+                self.dn_set.add(str(obj.dn))
+                self.note_usn(obj)
+                if self.changes_written:
+                    error_count += self.check_object(obj.dn, attrs=list(attrs))
+                else:
+                    error_count += self.check_object(obj.dn, attrs=list(attrs), obj=obj)
+
+        return (object_count, error_count)
+
+    def naming_contexts(self):
+        '''return the naming contexts as lower case DN strings, longest
+        first, so the configuration and schema partitions are matched
+        before the domain partition'''
+        res = self.samdb.search(base="", scope=ldb.SCOPE_BASE, attrs=['namingContexts'])
+        ncs = [str(nc).lower() for nc in res[0]["namingContexts"]]
+        ncs.sort(key=len, reverse=True)
+        return ncs
+
+    def partition_of(self, dn, ncs):
+        '''return the naming context (from ncs) that a DN string is in'''
+        ldn = dn.lower()
+        for nc in ncs:
+            if ldn == nc or ldn.endswith("," + nc):
+                return nc
+        return ""
+
+    def split_by_partition(self, dns, jobs):
+        '''split a list of DN strings into chunks that do not cross
+        naming context boundaries, with several chunks per job'''
+        ncs = self.naming_contexts()
+        partitions = {}
+        for dn in dns:
+            partitions.setdefault(self.partition_of(dn, ncs), []).append(dn)
+
+        chunk_size = max(1, len(dns) // (jobs * 4))
+        chunks = []
+        for nc in sorted(partitions.keys()):
+            part = partitions[nc]
+            for i in range(0, len(part), chunk_size):
+                chunks.append(part[i:i + chunk_size])
+        return chunks
+
+    def start_workers(self, jobs):
+        '''start the pool of worker processes used by check_database()
+        with jobs > 1
+
+        This has to be called before a transaction is started on our
+        SamDB.  A SamDB opened in a forked worker gets the tdb_context
+        this process has open on the same file, and with it any
+        transaction and locks held here.
+        '''
+        options = {
+            "verbose": self.verbose,
+            "reset_well_known_acls": self.reset_well_known_acls,
+            "link_cache_size": self.link_cache.max_size,
+        }
+        self.pool = multiprocessing.Pool(jobs, _parallel_init,
+                                         (self.samdb.url, self.samdb.lp, options))
+
+    def stop_workers(self):
+        '''stop the pool of worker processes, if it is still running'''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def check_objects_parallel(self, dns, attrs, jobs):
+        '''check the objects with a pool of worker processes, returning
+        the number of errors found
+
+        Each worker opens the database again and only runs the read-only
+        checks.  The pool is the one from start_workers(), or is started
+        here when there is none.  The reports of the workers are printed
+        here, chunk by chunk.  When fixing, the objects the workers found
+        errors on are checked again serially in this process, so fixes
+        are confirmed and applied exactly as in a serial run (and inside
+        our transaction, if there is one).
+        '''
+        if self.pool is None:
+            self.start_workers(jobs)
+        pool = self.pool
+        error_count = 0
+        failed_dns = []
+        try:
+            chunks = self.split_by_partition(dns, jobs)
+            for results in pool.imap(_parallel_check, [(c, attrs) for c in chunks]):
+                for (dn, count, messages) in results:
+                    self.dn_set.add(dn)
+                    if count == 0:
+                        continue
+                    failed_dns.append(dn)
+                    if not self.fix:
+                        error_count += count
+                        for msg in messages:
+                            self.report(msg)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self.pool = None
+
+        if self.fix:
+            for dn in failed_dns:
+                error_count += self.check_object(ldb.Dn(self.samdb, dn),
+                                                 attrs=list(attrs))
+
         return error_count
 
+    def note_usn(self, msg):
+        '''remember the highest uSNChanged seen in each partition'''
+        if self.usn_ncs is None or "uSNChanged" not in msg:
+            return
+        nc = self.partition_of(str(msg.dn), self.usn_ncs)
+        usn = int(msg["uSNChanged"][0])
+        if usn > self.highest_usn.get(nc, 0):
+            self.highest_usn[nc] = usn
+
+    def load_usn_state(self):
+        '''return a dictionary of the highest uSNChanged checked in each
+        partition by earlier runs'''
+        state = {}
+        if not os.path.exists(self.usn_state_file):
+            return state
+        db = tdb.Tdb(self.usn_state_file, flags=os.O_RDONLY)
+        try:
+            for nc in db.iterkeys():
+                state[nc] = int(db[nc])
+        finally:
+            db.close()
+        return state
+
+    def save_usn_state(self):
+        '''record the highest uSNChanged checked in each partition'''
+        db = tdb.Tdb(self.usn_state_file, flags=os.O_RDWR|os.O_CREAT)
+        try:
+            db.transaction_start()
+            try:
+                for (nc, usn) in self.highest_usn.items():
+                    old = db.get(nc)
+                    if old is not None and int(old) >= usn:
+                        continue
+                    db[nc] = str(usn)
+            except:
+                db.transaction_cancel()
+                raise
+            db.transaction_commit()
+        finally:
+            db.close()
+
+    def errors_fixed(self):
+        '''check the objects errors were found on again, without fixing
+        anything, and return True if none of them has errors left'''
+        (fix, quiet) = (self.fix, self.quiet)
+        self.fix = False
+        self.quiet = True
+        try:
+            if self.check_rootdse() != 0:
+                return False
+            for dn in self.error_dns:
+                dn = ldb.Dn(self.samdb, dn)
+                try:
+                    self.samdb.search(base=dn, scope=ldb.SCOPE_BASE, attrs=[],
+                                      controls=self.object_controls())
+                except ldb.LdbError, (enum, estr):
+                    if enum == ldb.ERR_NO_SUCH_OBJECT:
+                        # the fix deleted it
+                        continue
+                    raise
+                if self._check_object(dn, attrs=['*']) != 0:
+                    return False
+        finally:
+            self.fix = fix
+            self.quiet = quiet
+        return True
+
+    def check_objects_since(self, state, controls, attrs):
+        '''check the objects changed since the uSNChanged recorded in
+        state for their partition, and the objects they link to,
+        returning a tuple of (object count, error count)'''
+        linked_attrs = self.linked_attributes().keys()
+        dns = []
+        seen = set()
+        targets = []
+        for nc in self.usn_ncs:
+            expression = "(uSNChanged>={0:d})".format(state.get(nc, 0) + 1)
+            res = self.samdb.search(base=nc, scope=ldb.SCOPE_SUBTREE,
+                                    expression=expression,
+                                    attrs=["uSNChanged"] + linked_attrs,
+                                    controls=controls)
+            for msg in res:
+                dn = str(msg.dn)
+                # a subtree search also finds the objects in partitions
+                # below this one, those are handled with their own NC
+                if self.partition_of(dn, self.usn_ncs) != nc:
+                    continue
+                self.note_usn(msg)
+                if dn.lower() not in seen:
+                    seen.add(dn.lower())
+                    dns.append(dn)
+                for attrname in linked_attrs:
+                    if attrname not in msg:
+                        continue
+                    syntax_oid = self.schema.get_syntax_oid_from_lDAPDisplayName(attrname)
+                    for val in msg[attrname]:
+                        targets.append(str(dsdb_Dn(self.samdb, val, syntax_oid).dn))
+
+        changed_count = len(dns)
+        for dn in targets:
+            if dn.lower() not in seen:
+                seen.add(dn.lower())
+                dns.append(dn)
+
+        self.report('Checking {0:d} objects changed since the last run and {1:d} linked objects'.format(
+                    changed_count, len(dns) - changed_count))
+        error_count = 0
+        for dn in dns:
+            self.dn_set.add(dn)
+            error_count += self.check_object(ldb.Dn(self.samdb, dn), attrs=list(attrs))
+
+        return (len(dns), error_count)
+
+    def linked_attributes(self):
+        '''return a dictionary of the linked attributes in the schema,
+        mapping lDAPDisplayName to linkID'''
+        res = self.samdb_schema.search(base=self.schema_dn, scope=ldb.SCOPE_ONELEVEL,
+                                       expression="(&(objectClass=attributeSchema)(linkID=*))",
+                                       attrs=["lDAPDisplayName", "linkID"])
+        linked = {}
+        for msg in res:
+            linked[str(msg["lDAPDisplayName"][0])] = int(msg["linkID"][0])
+        return linked
+
+    def prefill_link_targets(self, controls):
+        '''load isDeleted, instanceType and all backlinks of every object
+        into the link target cache with one search across all partitions'''
+        attrs = ["isDeleted", "instanceType"]
+        for (name, linkID) in self.linked_attributes().items():
+            if linkID & 1:
+                attrs.append(name)
+
+        controls = [c for c in controls if not c.startswith("search_options:")]
+        controls.append("search_options:1:2")
+        count = self.link_cache.prefill(attrs, controls=controls)
+        self.report("Loaded {0:d} link targets into the cache".format(count))
+
     def report(self, msg):
         '''print a message unless quiet is set'''
         if not self.quiet:
@@ -198,6 +698,8 @@ class dbcheck(object):
         except Exception, err:
             self.report("{0!s} : {1!s}".format(msg, err))
             return False
+        self.changes_written += 1
+        self.link_cache.clear()
         return True
 
     def do_modify(self, m, controls, msg, validate=True):
@@ -210,6 +712,8 @@ class dbcheck(object):
         except Exception, err:
             self.report("{0!s} : {1!s}".format(msg, err))
             return False
+        self.changes_written += 1
+        self.link_cache.clear()
         return True
 
     def do_rename(self, from_dn, to_rdn, to_base, controls, msg):
@@ -227,6 +731,8 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         except Exception, err:
             self.report("{0!s} : {1!s}".format(msg, err))
             return False
+        self.changes_written += 1
+        self.link_cache.clear()
         return True
 
     def err_empty_attribute(self, dn, attrname):
@@ -325,7 +831,7 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
     def err_missing_dn_GUID(self, dn, attrname, val, dsdb_dn):
         """handle a missing target DN (both GUID and DN string form are missing)"""
         # check if its a backlink
-        linkID = self.samdb_schema.get_linkId_from_lDAPDisplayName(attrname)
+        linkID = self.schema.get_linkId_from_lDAPDisplayName(attrname)
         if (linkID & 1 == 0) and str(dsdb_dn).find('\\0ADEL') == -1:
             self.report("Not removing dangling forward link")
             return
@@ -590,7 +1096,7 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         '''return a revealed link in an object'''
         res = self.samdb.search(base=dn, scope=ldb.SCOPE_BASE, attrs=[attrname],
                                 controls=["show_deleted:0", "extended_dn:0", "reveal_internals:0"])
-        syntax_oid = self.samdb_schema.get_syntax_oid_from_lDAPDisplayName(attrname)
+        syntax_oid = self.schema.get_syntax_oid_from_lDAPDisplayName(attrname)
         for val in res[0][attrname]:
             dsdb_dn = dsdb_Dn(self.samdb, val, syntax_oid)
             guid2 = dsdb_dn.dn.get_extended_component("GUID")
@@ -601,6 +1107,8 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
     def check_dn(self, obj, attrname, syntax_oid):
         '''check a DN attribute for correctness'''
         error_count = 0
+        linkID = self.schema.get_linkId_from_lDAPDisplayName(attrname)
+        reverse_link_name = self.schema.get_backlink_from_lDAPDisplayName(attrname)
         for val in obj[attrname]:
             dsdb_dn = dsdb_Dn(self.samdb, val, syntax_oid)
 
@@ -622,15 +1130,12 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
             else:
                 fixing_msDS_HasInstantiatedNCs = False
 
-            linkID = self.samdb_schema.get_linkId_from_lDAPDisplayName(attrname)
-            reverse_link_name = self.samdb_schema.get_backlink_from_lDAPDisplayName(attrname)
             if reverse_link_name is not None:
                 attrs.append(reverse_link_name)
 
             # check its the right GUID
             try:
-                res = self.samdb.search(base="<GUID={0!s}>".format(guidstr), scope=ldb.SCOPE_BASE,
-                                        attrs=attrs, controls=["extended_dn:1:1", "show_recycled:1"])
+                res = [self.link_cache.lookup(guidstr, attrs)]
             except ldb.LdbError, (enum, estr):
                 error_count += 1
                 self.err_incorrect_dn_GUID(obj.dn, attrname, val, dsdb_dn, "incorrect GUID")
@@ -716,7 +1221,7 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         obj = repl.ctr
 
         for o in repl.ctr.array:
-            att = self.samdb_schema.get_lDAPDisplayName_by_attid(o.attid)
+            att = self.schema.get_lDAPDisplayName_by_attid(o.attid)
             set_att.add(att.lower())
             list_attid.append(o.attid)
 
@@ -771,16 +1276,23 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         self.class_schemaIDGUID[cls] = t
         return t
 
-    def process_sd(self, dn, obj):
-        sd_attr = "nTSecurityDescriptor"
-        sd_val = obj[sd_attr]
+    def analyse_sd(self, sd_val):
+        '''parse an nTSecurityDescriptor blob and look at its inherited
+        ACEs, returning a tuple of (sd, sd_clean, broken,
+        last_inherited_type)
 
-        sd = ndr_unpack(security.descriptor, str(sd_val))
+        None of this depends on the object the SD is on, so the result
+        is cached on the blob contents; typically there are only a few
+        thousand distinct SDs in a database.
+        '''
+        self.sd_count += 1
+        try:
+            return self.sd_cache[sd_val]
+        except KeyError:
+            pass
 
-        is_deleted = 'isDeleted' in obj and obj['isDeleted'][0].upper() == 'TRUE'
-        if is_deleted:
-            # we don't fix deleted objects
-            return (sd, None)
+        start = time.time()
+        sd = ndr_unpack(security.descriptor, sd_val)
 
         sd_clean = security.descriptor()
         sd_clean.owner_sid = sd.owner_sid
@@ -843,6 +1355,33 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
 
             last_inherited_type = t
 
+        result = (sd, sd_clean, broken, last_inherited_type)
+        if len(self.sd_cache) < self.sd_cache_size:
+            self.sd_cache[sd_val] = result
+        self.sd_parsed += 1
+        self.sd_parse_time += time.time() - start
+        return result
+
+    def sd_cache_report(self):
+        '''return a line of statistics on the SD cache'''
+        if self.sd_parsed == 0:
+            saved = 0.0
+        else:
+            saved = self.sd_parse_time * (self.sd_count - self.sd_parsed) / self.sd_parsed
+        return "Security descriptors: {0:d} checked, {1:d} distinct (about {2:.1f}s saved)".format(
+            self.sd_count, self.sd_parsed, saved)
+
+    def process_sd(self, dn, obj):
+        sd_attr = "nTSecurityDescriptor"
+        sd_val = obj[sd_attr]
+
+        (sd, sd_clean, broken, last_inherited_type) = self.analyse_sd(str(sd_val))
+
+        is_deleted = 'isDeleted' in obj and obj['isDeleted'][0].upper() == 'TRUE'
+        if is_deleted:
+            # we don't fix deleted objects
+            return (sd, None)
+
         if broken:
             return (sd_clean, sd)
 
@@ -1011,7 +1550,7 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         for o in ctr.array:
             # Search for an invalid attid
             try:
-                att = self.samdb_schema.get_lDAPDisplayName_by_attid(o.attid)
+                att = self.schema.get_lDAPDisplayName_by_attid(o.attid)
             except KeyError:
                 self.report('ERROR: attributeID 0X{0:0X} is not known in our schema, not fixing {1!s} on {2!s}\n'.format(o.attid, attr, dn))
                 return
@@ -1129,8 +1668,31 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
 
         raise KeyError
 
-    def check_object(self, dn, attrs=None):
-        '''check one object'''
+    def object_controls(self):
+        '''return the controls used when loading an object for checking'''
+        sd_flags = 0
+        sd_flags |= security.SECINFO_OWNER
+        sd_flags |= security.SECINFO_GROUP
+        sd_flags |= security.SECINFO_DACL
+        sd_flags |= security.SECINFO_SACL
+
+        return ["extended_dn:1:1",
+                "show_recycled:1",
+                "show_deleted:1",
+                "sd_flags:1:{0:d}".format(sd_flags)]
+
+    def check_object(self, dn, attrs=None, obj=None):
+        '''check one object
+
+        If obj is given it must have been loaded with the controls from
+        object_controls() and is checked without searching for it again.
+        '''
+        error_count = self._check_object(dn, attrs=attrs, obj=obj)
+        if error_count != 0:
+            self.error_dns.add(str(dn))
+        return error_count
+
+    def _check_object(self, dn, attrs=None, obj=None):
         if attrs is None:
             attrs = ['*']
         if self.verbose:
@@ -1148,32 +1710,22 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         if '*' in attrs:
             attrs.append("replPropertyMetaData")
 
-        try:
-            sd_flags = 0
-            sd_flags |= security.SECINFO_OWNER
-            sd_flags |= security.SECINFO_GROUP
-            sd_flags |= security.SECINFO_DACL
-            sd_flags |= security.SECINFO_SACL
-
-            res = self.samdb.search(base=dn, scope=ldb.SCOPE_BASE,
-                                    controls=[
-                                        "extended_dn:1:1",
-                                        "show_recycled:1",
-                                        "show_deleted:1",
-                                        "sd_flags:1:{0:d}".format(sd_flags),
-                                    ],
-                                    attrs=attrs)
-        except ldb.LdbError, (enum, estr):
-            if enum == ldb.ERR_NO_SUCH_OBJECT:
-                if self.in_transaction:
-                    self.report("ERROR: Object {0!s} disappeared during check".format(dn))
-                    return 1
-                return 0
-            raise
-        if len(res) != 1:
-            self.report("ERROR: Object {0!s} failed to load during check".format(dn))
-            return 1
-        obj = res[0]
+        if obj is None:
+            try:
+                res = self.samdb.search(base=dn, scope=ldb.SCOPE_BASE,
+                                        controls=self.object_controls(),
+                                        attrs=attrs)
+            except ldb.LdbError, (enum, estr):
+                if enum == ldb.ERR_NO_SUCH_OBJECT:
+                    if self.in_transaction:
+                        self.report("ERROR: Object {0!s} disappeared during check".format(dn))
+                        return 1
+                    return 0
+                raise
+            if len(res) != 1:
+                self.report("ERROR: Object {0!s} failed to load during check".format(dn))
+                return 1
+            obj = res[0]
         error_count = 0
         set_attrs_from_md = set()
         set_attrs_seen = set()
@@ -1243,7 +1795,7 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
                     # Here we check that the first attid is 0
                     # (objectClass) and that the last on is the RDN
                     # from the DN.
-                    rdn_attid = self.samdb_schema.get_attid_from_lDAPDisplayName(dn.get_rdn_name())
+                    rdn_attid = self.schema.get_attid_from_lDAPDisplayName(dn.get_rdn_name())
                     if list_attid_from_md[-1] != rdn_attid:
                         error_count += 1
                         self.report("ERROR: Not fixing incorrect final attributeID in '{0!s}' on '{1!s}', it should match the RDN {2!s}".format(attrname, str(dn), dn.get_rdn_name()))
@@ -1273,12 +1825,11 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
                     except KeyError:
                         continue
 
-                    current_sd = ndr_unpack(security.descriptor,
-                                            str(obj[attrname][0]))
-
-                    diff = get_diff_sds(well_known_sd, current_sd, security.dom_sid(self.samdb.get_domain_sid()))
+                    # sd is the parsed (and cached) copy of the
+                    # current value, as process_sd() found it OK
+                    diff = get_diff_sds(well_known_sd, sd, security.dom_sid(self.samdb.get_domain_sid()))
                     if diff != "":
-                        self.err_wrong_default_sd(dn, well_known_sd, current_sd, diff)
+                        self.err_wrong_default_sd(dn, well_known_sd, sd, diff)
                         error_count += 1
                         continue
                 continue
@@ -1334,16 +1885,16 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
             # get the syntax oid for the attribute, so we can can have
             # special handling for some specific attribute types
             try:
-                syntax_oid = self.samdb_schema.get_syntax_oid_from_lDAPDisplayName(attrname)
+                syntax_oid = self.schema.get_syntax_oid_from_lDAPDisplayName(attrname)
             except Exception, msg:
                 self.err_unknown_attribute(obj, attrname)
                 error_count += 1
                 continue
 
-            flag = self.samdb_schema.get_systemFlags_from_lDAPDisplayName(attrname)
+            flag = self.schema.get_systemFlags_from_lDAPDisplayName(attrname)
             if (not flag & dsdb.DS_FLAG_ATTR_NOT_REPLICATED
                 and not flag & dsdb.DS_FLAG_ATTR_IS_CONSTRUCTED
-                and not self.samdb_schema.get_linkId_from_lDAPDisplayName(attrname)):
+                and not self.schema.get_linkId_from_lDAPDisplayName(attrname)):
                 set_attrs_seen.add(str(attrname).lower())
 
             if syntax_oid in [ dsdb.DSDB_SYNTAX_BINARY_DN, dsdb.DSDB_SYNTAX_OR_NAME,
@@ -1412,6 +1963,8 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
                         nmsg["isDeleted"] = ldb.MessageElement("TRUE", ldb.FLAG_MOD_REPLACE, "isDeleted")
                         error_count += 1
                         self.samdb.modify(nmsg, controls=["provision:0"])
+                        self.changes_written += 1
+                        self.link_cache.clear()
 
                     else:
                         self.report("Not fixing isDeleted originating_change_time on '{0!s}'".format(str(dn)))
@@ -1504,3 +2057,40 @@ newSuperior: {2!s}""".format(str(from_dn), str(to_rdn), str(to_base)))
         m.dn = ldb.Dn(self.samdb, "@MODULES")
         m['@LIST'] = ldb.MessageElement('samba_dsdb', ldb.FLAG_MOD_REPLACE, '@LIST')
         return self.do_modify(m, [], 'reset @MODULES on database', validate=False)
+
+
+class _buffered_dbcheck(dbcheck):
+    """a read-only dbcheck for worker processes, collecting the reports
+    instead of printing them"""
+
+    def __init__(self, *args, **kwargs):
+        super(_buffered_dbcheck, self).__init__(*args, **kwargs)
+        self.messages = []
+
+    def report(self, msg):
+        self.messages.append(msg)
+
+
+_parallel_chk = None
+
+
+def _parallel_init(url, lp, options):
+    '''initialise a dbcheck worker process'''
+    global _parallel_chk
+    samdb = SamDB(session_info=system_session(), url=url, lp=lp)
+    _parallel_chk = _buffered_dbcheck(samdb, samdb_schema=samdb, **options)
+
+
+def _parallel_check(args):
+    '''check a chunk of DNs in a worker process, returning a list of
+    (dn, error count, messages) tuples'''
+    (dns, attrs) = args
+    # the parents of the other objects of the chunk need no search
+    _parallel_chk.dn_set.update(dns)
+    results = []
+    for dn in dns:
+        _parallel_chk.messages = []
+        count = _parallel_chk.check_object(ldb.Dn(_parallel_chk.samdb, dn),
+                                           attrs=list(attrs))
+        results.append((dn, count, _parallel_chk.messages))
+    return results
@@ -19,22 +19,28 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import random
+import time
 import uuid
+import hashlib
+import json
 
 import itertools
+import tdb
 from samba import unix2nttime, nttime2unix
 from samba import ldb, dsdb, drs_utils
 from samba.auth import system_session
 from samba.samdb import SamDB
-from samba.dcerpc import drsuapi, misc
+from samba.dcerpc import drsuapi, drsblobs, misc
 
 from samba.kcc.kcc_utils import Site, Partition, Transport, SiteLink
 from samba.kcc.kcc_utils import NCReplica, NCType, nctype_lut, GraphNode
 from samba.kcc.kcc_utils import RepsFromTo, KCCError, KCCFailedObject
+from samba.kcc.kcc_utils import DirectoryServiceAgent, NTDSConnection
 from samba.kcc.graph import convert_schedule_to_repltimes
 
-from samba.ndr import ndr_pack
+from samba.ndr import ndr_pack, ndr_unpack
 
 from samba.kcc.graph_utils import verify_and_dot
 
@@ -45,6 +51,10 @@ from samba.kcc.graph import Vertex
 from samba.kcc.debug import DEBUG, DEBUG_FN, logger
 from samba.kcc import debug
 
+# A cached topology is trusted for at most this many seconds, so that
+# time dependent decisions (ISTG failover, stale links) are revisited
+# even when nothing in the configuration partition changes.
+CACHE_MAX_AGE = 60 * 60
 
 def sort_replica_by_dsa_guid(rep1, rep2):
     """Helper to sort NCReplicas by their DSA guids
@@ -86,6 +96,38 @@ def is_smtp_replication_available():
     return False
 
 
+def load_topology(filename):
+    """Read a topology written by KCC.export_topology()
+
+    :param filename: the JSON file to read
+    :return: the topology, as a dict
+    """
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def diff_topology(old, new):
+    """Compare two topologies from KCC.get_topology()
+
+    :param old: the earlier topology (an empty dict if there is none)
+    :param new: the later topology
+    :return: a sorted list of (kind, change, edge) tuples, where kind is
+        "connections" or "repsFrom", change is '+' for an edge that was
+        added or '-' for one that was removed, and edge is a tuple
+    """
+    changes = []
+    for kind in ("connections", "repsFrom"):
+        old_edges = set(tuple(e) for e in old.get(kind, ()))
+        new_edges = set(tuple(e) for e in new.get(kind, ()))
+        changes.extend((kind, '+', e) for e in new_edges - old_edges)
+        changes.extend((kind, '-', e) for e in old_edges - new_edges)
+    changes.sort()
+    return changes
+
+
 class KCC(object):
     """The Knowledge Consistency Checker class.
 
@@ -98,9 +140,12 @@ class KCC(object):
     :param verify: Check topological invariants for the generated graphs
     :param debug: Write verbosely to stderr.
     "param dot_file_dir: write diagnostic Graphviz files in this directory
+    :param cache_file: skip the run when the inputs recorded in this tdb
+           by the last full run haven't changed
+    :param topology_file: write the resulting topology to this JSON file
     """
     def __init__(self, unix_now, readonly=False, verify=False, debug=False,
-                 dot_file_dir=None):
+                 dot_file_dir=None, cache_file=None, topology_file=None):
         """Initializes the partitions class which can hold
         our local DCs partitions or all the partitions in
         the forest
@@ -140,6 +185,11 @@ class KCC(object):
         self.verify = verify
         self.debug = debug
         self.dot_file_dir = dot_file_dir
+        self.cache_file = cache_file
+        self.dburl = None
+        self.topology_file = topology_file
+        # the topology computed by the last full run()
+        self.topology = None
 
     def load_ip_transport(self):
         """Loads the inter-site transport objects for Sites
@@ -215,6 +265,14 @@ class KCC(object):
         site = Site(dn_str, self.unix_now)
         site.load_site(self.samdb)
 
+        return self.add_site(site)
+
+    def add_site(self, site):
+        """Put a loaded site and its DSAs into the KCC indices.
+
+        :param site: a Site object
+        :return: the Site object now indexed under the site's guid
+        """
         # We avoid replacing the site with an identical copy in case
         # somewhere else has a reference to the old one, which would
         # lead to all manner of confusion and chaos.
@@ -241,20 +299,86 @@ class KCC(object):
     def load_all_sites(self):
         """Discover all sites and create Site objects.
 
+        The whole Sites subtree is fetched in one search, and the
+        sites, their DSAs, NC replicas and connections are built from
+        that result set rather than with searches per object.
+
         :return: None
         :raise: KCCError if sites can't be found
         """
+        attrs = set(["objectClass", "objectGUID"])
+        attrs.update(Site.settings_attrs)
+        attrs.update(DirectoryServiceAgent.attrs)
+        attrs.update(DirectoryServiceAgent.nc_attrs)
+        attrs.update(NTDSConnection.attrs)
+        expression = ("(|(objectClass=site)(objectClass=nTDSSiteSettings)"
+                      "(objectClass=nTDSDSA)(objectClass=nTDSConnection)"
+                      "(objectClass=interSiteTransport))")
         try:
             res = self.samdb.search("CN=Sites,{0!s}".format(
                                     self.samdb.get_config_basedn()),
                                     scope=ldb.SCOPE_SUBTREE,
-                                    expression="(objectClass=site)")
+                                    expression=expression,
+                                    attrs=list(attrs))
         except ldb.LdbError, (enum, estr):
             raise KCCError("Unable to find sites - ({0!s})".format(estr))
 
+        site_msgs = {}
+        settings_msgs = {}
+        dsa_msgs = []
+        connection_msgs = {}
+        transports = {}
         for msg in res:
+            classes = set(str(x).lower() for x in msg["objectClass"])
+            if "ntdsconnection" in classes:
+                parent = str(msg.dn.parent())
+                connection_msgs.setdefault(parent, []).append(msg)
+            elif "ntdsdsa" in classes:
+                dsa_msgs.append(msg)
+            elif "ntdssitesettings" in classes:
+                settings_msgs[str(msg.dn.parent()).lower()] = msg
+            elif "site" in classes:
+                site_msgs[str(msg.dn).lower()] = msg
+            elif "intersitetransport" in classes:
+                transports[str(msg.dn)] = misc.GUID(
+                    self.samdb.schema_format_value("objectGUID",
+                                                   msg["objectGUID"][0]))
+
+        sites = {}
+        for key, msg in site_msgs.items():
             sitestr = str(msg.dn)
-            self.load_site(sitestr)
+            if key not in settings_msgs:
+                raise KCCError("Unable to find site settings for ({0!s})".format(
+                               sitestr))
+            site = Site(sitestr, self.unix_now)
+            site.load_site_from_msg(self.samdb, settings_msgs[key], msg)
+
+            # already loaded
+            if str(site.site_guid) in self.site_table:
+                continue
+            sites[key] = site
+
+        nc_ids = {}
+        for msg in dsa_msgs:
+            dn = msg.dn.parent()
+            while str(dn).lower() not in sites and dn.get_comp_num() > 1:
+                dn = dn.parent()
+            site = sites.get(str(dn).lower())
+            if site is None:
+                continue
+
+            dsa = DirectoryServiceAgent(str(msg.dn))
+            dsa.load_dsa_from_msg(self.samdb, msg)
+            dsa.load_replica_table_from_msg(self.samdb, msg, nc_ids)
+            for conn_msg in connection_msgs.get(dsa.dsa_dnstr, []):
+                connect = NTDSConnection(str(conn_msg.dn))
+                connect.load_connection_from_msg(self.samdb, conn_msg,
+                                                 transports)
+                dsa.connect_table[connect.dnstr] = connect
+            site.add_dsa(dsa)
+
+        for site in sites.values():
+            self.add_site(site)
 
     def load_my_dsa(self):
         """Discover my nTDSDSA dn thru the rootDSE entry
@@ -408,15 +532,7 @@ class KCC(object):
         if failed_link:
             # failure_count should be > 0, but check anyways
             if failed_link.failure_count > 0:
-                unix_first_failure = \
-                    nttime2unix(failed_link.time_first_failure)
-                # TODO guard against future
-                if unix_first_failure > self.unix_now:
-                    logger.error("The last success time attribute for \
-                                 repsFrom is in the future!")
-
-                # Perform calculation in seconds
-                if (self.unix_now - unix_first_failure) > 60 * 60 * 2:
+                if self.is_stale_failure(failed_link.time_first_failure):
                     return True
 
         # TODO connections.
@@ -425,6 +541,21 @@ class KCC(object):
 
         return False
 
+    def is_stale_failure(self, time_first_failure):
+        """Check whether a failure has lasted long enough to be stale
+
+        :param time_first_failure: NT time of the first failure
+        :return: True if the failure started at least two hours ago
+        """
+        unix_first_failure = nttime2unix(time_first_failure)
+        # TODO guard against future
+        if unix_first_failure > self.unix_now:
+            logger.error("The last success time attribute for \
+                         repsFrom is in the future!")
+
+        # Perform calculation in seconds
+        return (self.unix_now - unix_first_failure) > 60 * 60 * 2
+
     # TODO: This should be backed by some form of local database
     def remove_unneeded_failed_links_connections(self):
         # Remove all tuples in kcc_failed_links where failure count = 0
@@ -2362,6 +2493,146 @@ class KCC(object):
             except ldb.LdbError, (num, msg):
                 raise KCCError("Unable to open sam database {0!s} : {1!s}".format(dburl, msg))
 
+    def highest_committed_usn(self):
+        """Return the highest USN committed to the database so far"""
+        res = self.samdb.search(base="", scope=ldb.SCOPE_BASE,
+                                attrs=["highestCommittedUSN"])
+        return int(res[0]["highestCommittedUSN"][0])
+
+    def config_changed_since(self, usn):
+        """Check for configuration changes made after a given USN
+
+        The configuration and schema NC heads are ignored: their
+        uSNChanged moves with every update of their repsFrom, which is
+        followed by local_replication_digests() instead.
+
+        :param usn: a USN returned by highest_committed_usn()
+        :return: True if anything in the configuration partition changed
+        """
+        expression = ("(&(uSNChanged>={0:d})"
+                      "(!(objectClass=configuration))"
+                      "(!(objectClass=dMD)))".format(usn + 1))
+        try:
+            res = self.samdb.search(self.samdb.get_config_basedn(),
+                                    scope=ldb.SCOPE_SUBTREE,
+                                    expression=expression,
+                                    attrs=["uSNChanged"],
+                                    controls=["show_deleted:1",
+                                              "show_recycled:1"])
+        except ldb.LdbError, (enum, estr):
+            raise KCCError("Unable to search for configuration changes "
+                           "- ({0!s})".format(estr))
+        return len(res) > 0
+
+    def local_replication_digests(self):
+        """Summarise the local DSA's repsFrom as a pair of digests
+
+        The first covers the sources of links that have been failing
+        for long enough to be stale, the second the (NC, source,
+        transport) triples of all links, which is what a run produces.
+
+        :return: a tuple of two hex digest strings
+        """
+        failed = set()
+        links = []
+        for nc_dnstr in self.my_dsa.current_rep_table:
+            try:
+                res = self.samdb.search(base=nc_dnstr, scope=ldb.SCOPE_BASE,
+                                        attrs=["repsFrom"])
+            except ldb.LdbError, (enum, estr):
+                if enum == ldb.ERR_NO_SUCH_OBJECT:
+                    continue
+                raise KCCError("Unable to find NC for ({0!s}) - ({1!s})".format(
+                               nc_dnstr, estr))
+            if "repsFrom" not in res[0]:
+                continue
+            for value in res[0]["repsFrom"]:
+                reps_from = RepsFromTo(nc_dnstr,
+                                       ndr_unpack(drsblobs.repsFromToBlob,
+                                                  value))
+                guid_str = str(reps_from.source_dsa_obj_guid)
+                links.append("{0!s} {1!s} {2!s}".format(
+                             nc_dnstr.lower(), guid_str,
+                             reps_from.transport_guid))
+                if (reps_from.consecutive_sync_failures > 0 and
+                    self.is_stale_failure(reps_from.last_success)):
+                    failed.add(guid_str)
+
+        return (hashlib.sha1("\n".join(sorted(failed))).hexdigest(),
+                hashlib.sha1("\n".join(sorted(links))).hexdigest())
+
+    def cache_key(self):
+        """The key of the local DSA's state in the cache file
+
+        Databases with the same DSA (copies of a sam.ldb, say) must not
+        share state, so the key is the database URL and the DSA DN.
+        """
+        return "{0!s}\n{1!s}".format(self.dburl, self.my_dsa_dnstr.lower())
+
+    def load_cache_state(self):
+        """Read what the last full run recorded for the local DSA
+
+        :return: a tuple of (USN, run time, failed link digest, link
+                 digest), or None if there is nothing usable
+        """
+        if not os.path.exists(self.cache_file):
+            return None
+        db = tdb.Tdb(self.cache_file, flags=os.O_RDONLY)
+        try:
+            value = db.get(self.cache_key())
+        finally:
+            db.close()
+        if value is None:
+            return None
+        try:
+            usn, unix_then, failed, links = value.split()
+            return int(usn), int(unix_then), failed, links
+        except ValueError:
+            return None
+
+    def save_cache_state(self, usn):
+        """Record the inputs and the result of a full run
+
+        :param usn: the highest committed USN from before the run started
+        """
+        failed, links = self.local_replication_digests()
+        value = "{0:d} {1:d} {2!s} {3!s}".format(usn, self.unix_now,
+                                                 failed, links)
+        db = tdb.Tdb(self.cache_file, flags=os.O_RDWR | os.O_CREAT)
+        try:
+            db[self.cache_key()] = value
+        finally:
+            db.close()
+
+    def topology_is_current(self):
+        """Check whether the last full run's topology still stands
+
+        That is the case when nothing in the configuration partition
+        has changed since, the same links are failing, and the local
+        repsFrom still match what that run left behind.
+
+        :return: True if the run can be skipped, otherwise False
+        """
+        state = self.load_cache_state()
+        if state is None:
+            DEBUG_FN("no cached topology for {0!s}".format(self.my_dsa_dnstr))
+            return False
+
+        usn, unix_then, failed, links = state
+        if not 0 <= self.unix_now - unix_then <= CACHE_MAX_AGE:
+            DEBUG_FN("cached topology is too old")
+            return False
+
+        if self.config_changed_since(usn):
+            DEBUG_FN("configuration changed since USN {0:d}".format(usn))
+            return False
+
+        if self.local_replication_digests() != (failed, links):
+            DEBUG_FN("failed links or repsFrom changed since the last run")
+            return False
+
+        return True
+
     def plot_all_connections(self, basename, verify_properties=()):
         """Helper function to plot and verify NTDSConnections
 
@@ -2397,6 +2668,59 @@ class KCC(object):
                        directed=True, edge_colors=edge_colours,
                        vertex_colors=vertex_colours)
 
+    def get_topology(self):
+        """Describe the connection and repsFrom graphs as a dict
+
+        The "connections" are (from DSA, to DSA) pairs, for every
+        nTDSConnection known and not about to be deleted.  "repsFrom" are
+        (NC, source DSA) pairs for the local DSA's needed repsFrom.
+
+        :return: a dict that can be written as JSON
+        """
+        connections = set()
+        for dsa in self.dsa_by_dnstr.values():
+            for con in dsa.connect_table.values():
+                if not con.to_be_deleted:
+                    connections.add((con.from_dnstr, dsa.dsa_dnstr))
+
+        reps_from = set()
+        current_reps, needed_reps = self.my_dsa.get_rep_tables()
+        for nc_dnstr, n_rep in needed_reps.items():
+            for r in n_rep.rep_repsFrom:
+                if r.to_be_deleted:
+                    continue
+                guid_str = str(r.source_dsa_obj_guid)
+                source = self.get_dsa_by_guidstr(guid_str)
+                if source is not None:
+                    source = source.dsa_dnstr
+                else:
+                    source = guid_str
+                reps_from.add((nc_dnstr, source))
+
+        return {
+            "version": 1,
+            "time": self.unix_now,
+            "dsa": self.my_dsa_dnstr,
+            "connections": sorted(connections),
+            "repsFrom": sorted(reps_from),
+            }
+
+    def export_topology(self, filename):
+        """Write the topology from get_topology() to a JSON file
+
+        The file is replaced atomically, so a reader never sees a partly
+        written export.
+
+        :param filename: the file to write
+        """
+        tmpname = filename + ".tmp"
+        f = open(tmpname, 'w')
+        try:
+            json.dump(self.topology, f, separators=(',', ':'))
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+
     def run(self, dburl, lp, creds, forced_local_dsa=None,
             forget_local_links=False, forget_intersite_links=False,
             attempt_live_connections=False):
@@ -2413,7 +2737,13 @@ class KCC(object):
         :param attempt_live_connections: attempt to connect to remote DSAs to
                determine link availability (boolean, default False)
         :return: 1 on error, 0 otherwise
+
+        If the KCC has a cache_file and none of forced_local_dsa,
+        forget_local_links, forget_intersite_links or
+        attempt_live_connections are given, the run stops after loading
+        the local DSA when topology_is_current().
         """
+        self.dburl = dburl
         if self.samdb is None:
             DEBUG_FN("samdb is None; let's load it from {0!s}".format(dburl))
             self.load_samdb(dburl, lp, creds, force=False)
@@ -2422,15 +2752,32 @@ class KCC(object):
             self.samdb.set_ntds_settings_dn("CN=NTDS Settings,{0!s}".format(
                                             forced_local_dsa))
 
+        use_cache = (self.cache_file is not None and not self.readonly and
+                     not forced_local_dsa and not forget_local_links and
+                     not forget_intersite_links and
+                     not attempt_live_connections)
+
+        load_start = time.time()
         try:
+            if use_cache:
+                # read before loading anything, so that changes made
+                # while we run are seen by the next run.
+                usn = self.highest_committed_usn()
+
             # Setup
             self.load_my_site()
             self.load_my_dsa()
 
+            if use_cache and self.topology_is_current():
+                logger.info("Nothing changed since the last KCC run, "
+                            "keeping the current topology")
+                return 0
+
             self.load_all_sites()
             self.load_all_partitions()
             self.load_ip_transport()
             self.load_all_sitelinks()
+            load_time = time.time() - load_start
 
             if self.verify or self.dot_file_dir is not None:
                 guid_to_dnstr = {}
@@ -2512,6 +2859,8 @@ class KCC(object):
             # These are the published steps (in order) for the
             # MS-TECH description of the KCC algorithm ([MS-ADTS] 6.2.2)
 
+            compute_start = time.time()
+
             # Step 1
             self.refresh_failed_links_connections(ping)
 
@@ -2532,6 +2881,19 @@ class KCC(object):
 
             # Step 7
             self.update_rodc_connection()
+            compute_time = time.time() - compute_start
+
+            DEBUG("KCC run took {0:.3f}s loading {1:d} sites and {2:d} DSAs, "
+                  "{3:.3f}s computing and committing the topology".format(
+                  load_time, len(self.site_table), len(self.dsa_by_dnstr),
+                  compute_time))
+
+            if use_cache:
+                self.save_cache_state(usn)
+
+            self.topology = self.get_topology()
+            if self.topology_file is not None:
+                self.export_topology(self.topology_file)
 
             if self.verify or self.dot_file_dir is not None:
                 self.plot_all_connections('dsa_final',
@@ -351,6 +351,7 @@ def setup_vertices(graph):
         v.repl_info.schedule = None
         v.repl_info.duration = 84 * 8
         v.demoted = False
+        v.queue_entry = None
 
 
 def dijkstra(graph, edge_type, include_black):
@@ -363,7 +364,15 @@ def dijkstra(graph, edge_type, include_black):
     """
     queue = setup_dijkstra(graph, edge_type, include_black)
     while len(queue) > 0:
-        cost, guid, vertex = heapq.heappop(queue)
+        entry = heapq.heappop(queue)
+        cost, guid, vertex = entry
+        # Rather than changing the priority of a vertex already in the
+        # heap, try_new_path() pushes a new entry. Any older entries
+        # for the vertex are stale and are skipped here, so each
+        # improvement to a vertex causes one relaxation of its edges.
+        if vertex.queue_entry is not entry:
+            continue
+        vertex.queue_entry = None
         for edge in vertex.edges:
             for v in edge.vertices:
                 if v is not vertex:
@@ -392,7 +401,8 @@ def setup_dijkstra(graph, edge_type, include_black):
             vertex.root = None  # NULL GUID
             vertex.demoted = True  # Demoted appears not to be used
         else:
-            heapq.heappush(queue, (vertex.repl_info.cost, vertex.guid, vertex))
+            vertex.queue_entry = (vertex.repl_info.cost, vertex.guid, vertex)
+            heapq.heappush(queue, vertex.queue_entry)
 
     return queue
 
@@ -416,7 +426,8 @@ def try_new_path(graph, queue, vfrom, edge, vto):
         vto.root = vfrom.root
         vto.component_id = vfrom.component_id
         vto.repl_info = new_repl_info
-        heapq.heappush(queue, (vto.repl_info.cost, vto.guid, vto))
+        vto.queue_entry = (vto.repl_info.cost, vto.guid, vto)
+        heapq.heappush(queue, vto.queue_entry)
 
 
 def check_demote_vertex(vertex, edge_type):
@@ -572,27 +583,33 @@ def kruskal(graph, edges):
     components = set([x for x in graph.vertices if not x.is_white()])
     edges = list(edges)
 
-    # Sorted based on internal comparison function of internal edge
-    edges.sort()
+    # Sorted in the order defined by InternalEdge.__lt__, but using
+    # precomputed keys rather than a Python comparison per step.
+    edges.sort(key=InternalEdge.sort_key)
 
-    #XXX expected_num_tree_edges is never used
-    expected_num_tree_edges = 0  # TODO this value makes little sense
+    # The component_id attributes of the vertices form the union-find
+    # forest. Union by rank keeps its trees shallow; the rank of a root
+    # is an upper bound on the height of its tree.
+    rank = dict.fromkeys(components, 0)
 
-    count_edges = 0
     output_edges = []
-    index = 0
-    while index < len(edges):  # TODO and num_components > 1
-        e = edges[index]
+    for e in edges:
+        if len(components) <= 1:
+            # everything is connected, no further edge can be added
+            break
         parent1 = find_component(e.v1)
         parent2 = find_component(e.v2)
         if parent1 is not parent2:
-            count_edges += 1
             add_out_edge(graph, output_edges, e)
+            rank1 = rank.get(parent1, 0)
+            rank2 = rank.get(parent2, 0)
+            if rank1 > rank2:
+                parent1, parent2 = parent2, parent1
+            elif rank1 == rank2:
+                rank[parent2] = rank2 + 1
             parent1.component_id = parent2
             components.discard(parent1)
 
-        index += 1
-
     return output_edges, len(components)
 
 
@@ -722,6 +739,8 @@ class Vertex(object):
         self.demoted = False
         self.options = 0
         self.interval = 0
+        # the current entry for this vertex in the Dijkstra heap
+        self.queue_entry = None
 
     def color_vertex(self):
         """Color to indicate which kind of NC replica the vertex contains
@@ -820,6 +839,15 @@ class InternalEdge(object):
     def __le__(self, other):
         return not other < self
 
+    def sort_key(self):
+        """A tuple that sorts in the same order as __lt__ defines."""
+        return (not self.red_red,
+                self.repl_info.cost,
+                -self.repl_info.duration,
+                self.v1.ndrpacked_guid,
+                self.v2.ndrpacked_guid,
+                self.e_type)
+
     def __lt__(self, other):
         """Here "less than" means "better".
 
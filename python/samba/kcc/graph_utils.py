@@ -87,23 +87,22 @@ def verify_graph_connected(edges, vertices, edge_vertices):
                          "vertices: %s\n edges: %s" %
                          (sorted(vertices), sorted(edges)))
 
-    remaining_edges = list(edges)
-    reached = set(remaining_edges.pop())
-    while True:
-        doomed = []
-        for i, e in enumerate(remaining_edges):
-            a, b = e
-            if a in reached:
-                reached.add(b)
-                doomed.append(i)
-            elif b in reached:
-                reached.add(a)
-                doomed.append(i)
-        if not doomed:
-            break
-        for i in reversed(doomed):
-            del remaining_edges[i]
-
+    edges = list(edges)
+    adjacency = {}
+    for a, b in edges:
+        adjacency.setdefault(a, []).append(b)
+        adjacency.setdefault(b, []).append(a)
+
+    start = edges[-1][0]
+    reached = set([start])
+    queue = [start]
+    while queue:
+        for w in adjacency[queue.pop()]:
+            if w not in reached:
+                reached.add(w)
+                queue.append(w)
+
+    remaining_edges = [e for e in edges if e[0] not in reached]
     if remaining_edges or reached != set(vertices):
         raise GraphError("graph is not connected:\n vertices: %s\n edges: %s\n"
                          " reached: %s\n remaining edges: %s" %
@@ -111,21 +110,127 @@ def verify_graph_connected(edges, vertices, edge_vertices):
                           sorted(reached), sorted(remaining_edges)))
 
 
-def verify_graph_connected_under_edge_failures(edges, vertices, edge_vertices):
-    """The graph stays connected when any single edge is removed."""
+def find_bridges_and_articulation_points(edges, vertices):
+    """Find the bridges (edges whose removal disconnects the graph) and
+    articulation points (likewise, vertices) of an undirected graph, in
+    linear time, using the low points of a depth first search.
+
+    Parallel edges are counted separately, so an edge that is duplicated
+    is not a bridge.  Self loops are ignored.
+
+    :param edges: sequence of (a, b) pairs
+    :param vertices: all the vertices, including those in edges
+    :return: a list of bridges and a set of articulation points
+    """
+    edges = list(edges)
+    adjacency = dict((v, []) for v in vertices)
+    for i, (a, b) in enumerate(edges):
+        if a != b:
+            adjacency[a].append((b, i))
+            adjacency[b].append((a, i))
+
+    index = {}
+    low = {}
+    bridges = []
+    articulation_points = set()
+    for root in vertices:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        root_children = 0
+        # each entry is (vertex, the edge we arrived by, unvisited edges)
+        stack = [(root, None, iter(adjacency[root]))]
+        while stack:
+            v, arrival, neighbours = stack[-1]
+            for w, i in neighbours:
+                if i == arrival:
+                    continue
+                if w in index:
+                    low[v] = min(low[v], index[w])
+                else:
+                    index[w] = low[w] = len(index)
+                    stack.append((w, i, iter(adjacency[w])))
+                    break
+            else:
+                stack.pop()
+                if not stack:
+                    continue
+                u = stack[-1][0]
+                low[u] = min(low[u], low[v])
+                if low[v] > index[u]:
+                    bridges.append(edges[arrival])
+                if u == root:
+                    root_children += 1
+                elif low[v] >= index[u]:
+                    articulation_points.add(u)
+        if root_children > 1:
+            articulation_points.add(root)
+
+    return bridges, articulation_points
+
+
+def _brute_force_connected_under_edge_failures(edges, vertices,
+                                               edge_vertices):
     for subset in itertools.combinations(edges, len(edges) - 1):
         verify_graph_connected(subset, vertices, edge_vertices)
 
 
-def verify_graph_connected_under_vertex_failures(edges, vertices,
+def _brute_force_connected_under_vertex_failures(edges, vertices,
                                                  edge_vertices):
-    """The graph stays connected when any single vertex is removed."""
     for v in vertices:
-        sub_vertices = [x for x in vertices if x is not v]
+        sub_vertices = [x for x in vertices if x != v]
         sub_edges = [x for x in edges if v not in x]
         verify_graph_connected(sub_edges, sub_vertices, sub_vertices)
 
 
+def _has_unknown_vertices(edges, vertices):
+    vertices = set(vertices)
+    for a, b in edges:
+        if a not in vertices or b not in vertices:
+            return True
+    return False
+
+
+def verify_graph_connected_under_edge_failures(edges, vertices, edge_vertices):
+    """The graph stays connected when any single edge is removed."""
+    edges = list(edges)
+    if not edges:
+        # no edges to remove: a lone vertex is fine, more are not
+        return verify_graph_connected(edges, vertices, edge_vertices)
+    if _has_unknown_vertices(edges, vertices):
+        # removing an edge can remove the unknown vertex, so this odd
+        # case is left to the exhaustive check
+        return _brute_force_connected_under_edge_failures(edges, vertices,
+                                                          edge_vertices)
+
+    verify_graph_connected(edges, vertices, edge_vertices)
+    bridges, articulation_points = \
+        find_bridges_and_articulation_points(edges, vertices)
+    if bridges:
+        raise GraphError("the graph is disconnected by removing any of "
+                         "these edges:\n %s" % sorted(bridges))
+
+
+def verify_graph_connected_under_vertex_failures(edges, vertices,
+                                                 edge_vertices):
+    """The graph stays connected when any single vertex is removed."""
+    edges = list(edges)
+    if _has_unknown_vertices(edges, vertices):
+        return _brute_force_connected_under_vertex_failures(edges, vertices,
+                                                            edge_vertices)
+    # with one vertex removed, a graph of two or fewer is trivially
+    # connected
+    if len(vertices) <= 2:
+        return
+
+    verify_graph_connected(edges, vertices, edge_vertices)
+    bridges, articulation_points = \
+        find_bridges_and_articulation_points(edges, vertices)
+    if articulation_points:
+        raise GraphError("the graph is disconnected by removing any of "
+                         "these vertices:\n %s" % sorted(articulation_points))
+
+
 def verify_graph_forest(edges, vertices, edge_vertices):
     """The graph contains no loops. A forest that is also connected is a
     tree."""
@@ -448,6 +448,27 @@ class NCReplica(NamingContext):
 
 class DirectoryServiceAgent(object):
 
+    attrs = ["objectGUID",
+             "invocationID",
+             "options",
+             "msDS-isRODC",
+             "msDS-Behavior-Version"]
+
+    nc_attrs = [
+        # not RODC - default, config, schema (old style)
+        "hasMasterNCs",
+        # not RODC - default, config, schema, app NCs
+        "msDS-hasMasterNCs",
+        # domain NC partial replicas
+        "hasPartialReplicaNCs",
+        # default domain NC
+        "msDS-HasDomainNCs",
+        # RODC only - default, config, schema, app NCs
+        "msDS-hasFullReplicaNCs",
+        # Identifies if replica is coming, going, or stable
+        "msDS-HasInstantiatedNCs"
+    ]
+
     def __init__(self, dsa_dnstr):
         """Initialize DSA class.
 
@@ -552,19 +573,27 @@ class DirectoryServiceAgent(object):
         load.  This method initializes all other attributes, including loading
         the NC replica table for this DSA.
         """
-        attrs = ["objectGUID",
-                 "invocationID",
-                 "options",
-                 "msDS-isRODC",
-                 "msDS-Behavior-Version"]
         try:
             res = samdb.search(base=self.dsa_dnstr, scope=ldb.SCOPE_BASE,
-                               attrs=attrs)
+                               attrs=self.attrs)
 
         except ldb.LdbError, (enum, estr):
             raise KCCError("Unable to find nTDSDSA for ({0!s}) - ({1!s})".format(self.dsa_dnstr, estr))
 
-        msg = res[0]
+        self.load_dsa_from_msg(samdb, res[0])
+
+        # Load the NC replicas that are enumerated on this dsa
+        self.load_current_replica_table(samdb)
+
+        # Load the nTDSConnection that are enumerated on this dsa
+        self.load_connection_table(samdb)
+
+    def load_dsa_from_msg(self, samdb, msg):
+        """Initialize the DSA's own attributes from a search result.
+
+        :param samdb: database the message came from
+        :param msg: a message holding the DirectoryServiceAgent.attrs
+        """
         self.dsa_guid = misc.GUID(samdb.schema_format_value("objectGUID",
                                   msg["objectGUID"][0]))
 
@@ -585,12 +614,6 @@ class DirectoryServiceAgent(object):
         if "msDS-Behavior-Version" in msg:
             self.dsa_behavior = int(msg['msDS-Behavior-Version'][0])
 
-        # Load the NC replicas that are enumerated on this dsa
-        self.load_current_replica_table(samdb)
-
-        # Load the nTDSConnection that are enumerated on this dsa
-        self.load_connection_table(samdb)
-
     def load_current_replica_table(self, samdb):
         """Method to load the NC replica's listed for DSA object.
 
@@ -603,72 +626,76 @@ class DirectoryServiceAgent(object):
 
         :param samdb: database to query for DSA replica list
         """
-        ncattrs = [
-            # not RODC - default, config, schema (old style)
-            "hasMasterNCs",
-            # not RODC - default, config, schema, app NCs
-            "msDS-hasMasterNCs",
-            # domain NC partial replicas
-            "hasPartialReplicaNCs",
-            # default domain NC
-            "msDS-HasDomainNCs",
-            # RODC only - default, config, schema, app NCs
-            "msDS-hasFullReplicaNCs",
-            # Identifies if replica is coming, going, or stable
-            "msDS-HasInstantiatedNCs"
-        ]
         try:
             res = samdb.search(base=self.dsa_dnstr, scope=ldb.SCOPE_BASE,
-                               attrs=ncattrs)
+                               attrs=self.nc_attrs)
 
         except ldb.LdbError, (enum, estr):
             raise KCCError("Unable to find nTDSDSA NCs for ({0!s}) - ({1!s})".format(self.dsa_dnstr, estr))
 
+        # We should get one response to our query here for
+        # the ntds that we requested
+        self.load_replica_table_from_msg(samdb, res[0])
+
+    def load_replica_table_from_msg(self, samdb, msg, nc_ids=None):
+        """Build the NC replica table from a search result.
+
+        :param samdb: database the message came from
+        :param msg: a message holding the DirectoryServiceAgent.nc_attrs
+        :param nc_ids: optional dict of NC dn strings to (guid, sid)
+               tuples, shared between DSAs so that each NC head is only
+               searched for once.
+        """
         # The table of NCs for the dsa we are searching
         tmp_table = {}
 
-        # We should get one response to our query here for
-        # the ntds that we requested
-        if len(res[0]) > 0:
-
-            # Our response will contain a number of elements including
-            # the dn of the dsa as well as elements for each
-            # attribute (e.g. hasMasterNCs).  Each of these elements
-            # is a dictonary list which we retrieve the keys for and
-            # then iterate over them
-            for k in res[0].keys():
-                if k == "dn":
+        # The message will contain a number of elements including
+        # the dn of the dsa as well as elements for each
+        # attribute (e.g. hasMasterNCs).  Each of these elements
+        # is a dictonary list which we iterate over
+        found = False
+        for k in self.nc_attrs:
+            if k not in msg:
+                continue
+            found = True
+
+            # For each attribute type there will be one or more DNs
+            # listed.  For instance DCs normally have 3 hasMasterNCs
+            # listed.
+            for value in msg[k]:
+                # Turn dn into a dsdb_Dn so we can use
+                # its methods to parse a binary DN
+                dsdn = dsdb_Dn(samdb, value)
+                flags = dsdn.get_binary_integer()
+                dnstr = str(dsdn.dn)
+
+                if not dnstr in tmp_table:
+                    rep = NCReplica(self.dsa_dnstr, self.dsa_guid, dnstr)
+                    if nc_ids is not None and dnstr in nc_ids:
+                        rep.nc_guid, rep.nc_sid = nc_ids[dnstr]
+                    tmp_table[dnstr] = rep
+                else:
+                    rep = tmp_table[dnstr]
+
+                if k == "msDS-HasInstantiatedNCs":
+                    rep.set_instantiated_flags(flags)
                     continue
 
-                # For each attribute type there will be one or more DNs
-                # listed.  For instance DCs normally have 3 hasMasterNCs
-                # listed.
-                for value in res[0][k]:
-                    # Turn dn into a dsdb_Dn so we can use
-                    # its methods to parse a binary DN
-                    dsdn = dsdb_Dn(samdb, value)
-                    flags = dsdn.get_binary_integer()
-                    dnstr = str(dsdn.dn)
-
-                    if not dnstr in tmp_table:
-                        rep = NCReplica(self.dsa_dnstr, self.dsa_guid, dnstr)
-                        tmp_table[dnstr] = rep
-                    else:
-                        rep = tmp_table[dnstr]
-
-                    if k == "msDS-HasInstantiatedNCs":
-                        rep.set_instantiated_flags(flags)
-                        continue
-
-                    rep.identify_by_dsa_attr(samdb, k)
-
-                    # if we've identified the default domain NC
-                    # then save its DN string
-                    if rep.is_default():
-                        self.default_dnstr = dnstr
-        else:
+                rep.identify_by_dsa_attr(samdb, k)
+
+                # if we've identified the default domain NC
+                # then save its DN string
+                if rep.is_default():
+                    self.default_dnstr = dnstr
+
+        if not found:
             raise KCCError("No nTDSDSA NCs for ({0!s})".format(self.dsa_dnstr))
 
+        if nc_ids is not None:
+            for dnstr, rep in tmp_table.items():
+                if rep.nc_guid is not None:
+                    nc_ids.setdefault(dnstr, (rep.nc_guid, rep.nc_sid))
+
         # Assign our newly built NC replica table to this dsa
         self.current_rep_table = tmp_table
 
@@ -700,7 +727,8 @@ class DirectoryServiceAgent(object):
 
             connect = NTDSConnection(dnstr)
 
-            connect.load_connection(samdb)
+            # the subtree search returned every attribute already
+            connect.load_connection_from_msg(samdb, msg)
             self.connect_table[dnstr] = connect
 
     def commit_connections(self, samdb, ro=False):
@@ -794,6 +822,15 @@ class DirectoryServiceAgent(object):
 class NTDSConnection(object):
     """Class defines a nTDSConnection found under a DSA
     """
+    attrs = ["options",
+             "enabledConnection",
+             "schedule",
+             "whenCreated",
+             "objectGUID",
+             "transportType",
+             "fromServer",
+             "systemFlags"]
+
     def __init__(self, dnstr):
         self.dnstr = dnstr
         self.guid = None
@@ -851,23 +888,23 @@ class NTDSConnection(object):
         for the object's DN, search for the DN and load attributes
         from the samdb.
         """
-        attrs = ["options",
-                 "enabledConnection",
-                 "schedule",
-                 "whenCreated",
-                 "objectGUID",
-                 "transportType",
-                 "fromServer",
-                 "systemFlags"]
         try:
             res = samdb.search(base=self.dnstr, scope=ldb.SCOPE_BASE,
-                               attrs=attrs)
+                               attrs=self.attrs)
 
         except ldb.LdbError, (enum, estr):
             raise KCCError("Unable to find nTDSConnection for ({0!s}) - ({1!s})".format(self.dnstr, estr))
 
-        msg = res[0]
+        self.load_connection_from_msg(samdb, res[0])
+
+    def load_connection_from_msg(self, samdb, msg, transports=None):
+        """Initialize the connection from a search result.
 
+        :param samdb: database the message came from
+        :param msg: a message holding the NTDSConnection.attrs
+        :param transports: optional dict of transport dn strings to
+               GUIDs, consulted before searching for the transport
+        """
         if "options" in msg:
             self.options = int(msg["options"][0])
 
@@ -888,7 +925,12 @@ class NTDSConnection(object):
 
         if "transportType" in msg:
             dsdn = dsdb_Dn(samdb, msg["transportType"][0])
-            self.load_connection_transport(samdb, str(dsdn.dn))
+            tdnstr = str(dsdn.dn)
+            if transports is not None and tdnstr in transports:
+                self.transport_dnstr = tdnstr
+                self.transport_guid = transports[tdnstr]
+            else:
+                self.load_connection_transport(samdb, tdnstr)
 
         if "schedule" in msg:
             self.schedule = ndr_unpack(drsblobs.schedule, msg["schedule"][0])
@@ -1338,6 +1380,10 @@ class Site(object):
     """An individual site object discovered thru the configuration
     naming context.  Contains all DSAs that exist within the site
     """
+    settings_attrs = ["options",
+                      "interSiteTopologyFailover",
+                      "interSiteTopologyGenerator"]
+
     def __init__(self, site_dnstr, nt_now):
         self.site_dnstr = site_dnstr
         self.site_guid = None
@@ -1354,18 +1400,26 @@ class Site(object):
         the site.
         """
         ssdn = "CN=NTDS Site Settings,{0!s}".format(self.site_dnstr)
-        attrs = ["options",
-                 "interSiteTopologyFailover",
-                 "interSiteTopologyGenerator"]
         try:
             res = samdb.search(base=ssdn, scope=ldb.SCOPE_BASE,
-                               attrs=attrs)
+                               attrs=self.settings_attrs)
             self_res = samdb.search(base=self.site_dnstr, scope=ldb.SCOPE_BASE,
                                     attrs=['objectGUID'])
         except ldb.LdbError, (enum, estr):
             raise KCCError("Unable to find site settings for ({0!s}) - ({1!s})".format(ssdn, estr))
 
-        msg = res[0]
+        self.load_site_from_msg(samdb, res[0], self_res[0])
+
+        self.load_all_dsa(samdb)
+
+    def load_site_from_msg(self, samdb, settings_msg, site_msg):
+        """Initialize the site from search results, without its DSAs.
+
+        :param samdb: database the messages came from
+        :param settings_msg: the NTDS Site Settings, with settings_attrs
+        :param site_msg: the site object itself, with its objectGUID
+        """
+        msg = settings_msg
         if "options" in msg:
             self.site_options = int(msg["options"][0])
 
@@ -1376,13 +1430,11 @@ class Site(object):
         if "interSiteTopologyFailover" in msg:
             self.site_topo_failover = int(msg["interSiteTopologyFailover"][0])
 
-        msg = self_res[0]
+        msg = site_msg
         if "objectGUID" in msg:
             self.site_guid = misc.GUID(samdb.schema_format_value("objectGUID",
                                        msg["objectGUID"][0]))
 
-        self.load_all_dsa(samdb)
-
     def load_all_dsa(self, samdb):
         """Discover all nTDSDSA thru the sites entry and
         instantiate and load the DSAs.  Each dsa is inserted
@@ -1405,12 +1457,13 @@ class Site(object):
             dsa = DirectoryServiceAgent(dnstr)
 
             dsa.load_dsa(samdb)
+            self.add_dsa(dsa)
 
-            # Assign this dsa to my dsa table
-            # and index by dsa dn
-            self.dsa_table[dnstr] = dsa
-            if not dsa.is_ro():
-                self.rw_dsa_table[dnstr] = dsa
+    def add_dsa(self, dsa):
+        """Assign a loaded DSA to the dsa tables, indexed by dsa dn"""
+        self.dsa_table[dsa.dsa_dnstr] = dsa
+        if not dsa.is_ro():
+            self.rw_dsa_table[dsa.dsa_dnstr] = dsa
 
     def get_dsa_by_guidstr(self, guidstr):  # XXX unused
         for dsa in self.dsa_table.values():
@@ -17,6 +17,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import base64
+import csv
+import json
 import re
 from samba.dcerpc import nbt
 from samba.net import Net
@@ -69,3 +72,56 @@ def netcmd_get_domain_infos_via_cldap(lp, creds, address=None):
     cldap_ret = net.finddc(address=address,
                 flags=nbt.NBT_SERVER_LDAP | nbt.NBT_SERVER_DS)
     return cldap_ret
+
+
+output_format_help = ("Output format: plain, csv or json (one object per line). "
+                      "Values that are not UTF-8 text are base64 encoded: written as "
+                      "'attr:: value' in plain, as {\"base64\": value} in json, "
+                      "and without any mark in csv")
+
+
+def _printable_value(samdb, attr, value):
+    '''format an attribute value for output, returning the text and
+       whether it is base64 encoded, as values that are not UTF-8 text are'''
+    value = samdb.schema_format_value(attr, value)
+    try:
+        value.decode("utf-8")
+    except UnicodeDecodeError:
+        return (base64.b64encode(value), True)
+    return (value, False)
+
+
+def netcmd_write_entries(samdb, outf, entries, attrs, output_format="plain"):
+    '''write search results as they arrive, with the given attributes in
+       "plain" (ldif like), "csv" or "json" (one object per line) format.
+       Multiple values are separated by ";" in csv and listed in json.
+       See output_format_help for the values that are not UTF-8 text'''
+    if output_format == "csv":
+        writer = csv.writer(outf)
+        writer.writerow(["dn"] + attrs)
+    for msg in entries:
+        values = []
+        for attr in attrs:
+            el = msg.get(attr)
+            if el is None:
+                values.append([])
+            else:
+                values.append([_printable_value(samdb, attr, v) for v in el])
+        if output_format == "csv":
+            writer.writerow([str(msg.dn)] + [";".join(v for (v, b64) in vals)
+                                             for vals in values])
+        elif output_format == "json":
+            entry = {}
+            for (attr, vals) in zip(attrs, values):
+                entry[attr] = [{"base64": v} if b64 else v for (v, b64) in vals]
+            entry["dn"] = str(msg.dn)
+            outf.write(json.dumps(entry, sort_keys=True) + "\n")
+        else:
+            outf.write("dn: {0!s}\n".format(msg.dn))
+            for (attr, vals) in zip(attrs, values):
+                for (v, b64) in vals:
+                    if b64:
+                        outf.write("{0!s}:: {1!s}\n".format(attr, v))
+                    else:
+                        outf.write("{0!s}: {1!s}\n".format(attr, v))
+            outf.write("\n")
@@ -16,7 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import ldb, sys
+import ldb, os, sys
 import samba.getopt as options
 from samba.auth import system_session
 from samba.samdb import SamDB
@@ -54,6 +54,16 @@ class cmd_dbcheck(Command):
         Option("--quiet", dest="quiet", action="store_true", default=False,
             help="don't print details of checking"),
         Option("--attrs", dest="attrs", default=None, help="list of attributes to check (space separated)"),
+        Option("--streaming", dest="streaming", default=False, action="store_true",
+               help="check objects as they are returned by a paged search, rather than loading each object separately"),
+        Option("--prefill-link-cache", dest="prefill_link_cache", default=False, action="store_true",
+               help="load all link targets with one search before checking DN links"),
+        Option("--link-cache-size", dest="link_cache_size", type=int, default=100000,
+               help="maximum number of link target objects to cache (default 100000)"),
+        Option("-j", "--jobs", dest="jobs", type=int, default=1,
+               help="number of worker processes to check objects with (local database only)"),
+        Option("--since-last-run", dest="since_last_run", default=False, action="store_true",
+               help="only check objects changed since the last complete check without errors (local database only)"),
         Option("--reindex", dest="reindex", default=False, action="store_true", help="force database re-index"),
         Option("--force-modules", dest="force_modules", default=False, action="store_true", help="force loading of Samba modules and ignore the @MODULES record (for very old databases)"),
         Option("--reset-well-known-acls", dest="reset_well_known_acls", default=False, action="store_true", help="reset ACLs on objects with well known default ACL values to the default"),
@@ -65,7 +75,9 @@ class cmd_dbcheck(Command):
             cross_ncs=False, quiet=False,
             scope="SUB", credopts=None, sambaopts=None, versionopts=None,
             attrs=None, reindex=False, force_modules=False,
-            reset_well_known_acls=False):
+            reset_well_known_acls=False, streaming=False,
+            prefill_link_cache=False, link_cache_size=100000, jobs=1,
+            since_last_run=False):
 
         lp = sambaopts.get_loadparm()
 
@@ -87,12 +99,34 @@ class cmd_dbcheck(Command):
                 raise CommandError("Failed to connect to DB at {0!s}.  If this is a really old sam.ldb (before alpha9), then try again with --force-modules".format(H))
 
 
+        # The uSNChanged high-water marks for --since-last-run are kept
+        # next to the database, so a dbcheck without --fix still never
+        # writes to the database itself.
+        usn_state_file = None
+        if since_last_run and not over_ldap and samdb.url is not None:
+            path = samdb.url
+            if path.startswith("tdb://"):
+                path = path[len("tdb://"):]
+            usn_state_file = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                          "dbcheck_usn.tdb")
+
         if H is None or not over_ldap:
             samdb_schema = samdb
         else:
             samdb_schema = SamDB(session_info=system_session(), url=None,
                                  credentials=creds, lp=lp)
 
+        if since_last_run and over_ldap:
+            raise CommandError("--since-last-run can only be used on a local database")
+        if since_last_run and (DN is not None or scope.upper() != "SUB"):
+            raise CommandError("--since-last-run checks the whole database, it can not be combined with a DN or --scope")
+        if jobs > 1 and over_ldap:
+            raise CommandError("--jobs can only be used on a local database")
+        if jobs > 1 and streaming:
+            raise CommandError("--jobs can not be combined with --streaming")
+        if streaming and attrs:
+            raise CommandError("--streaming can not be combined with --attrs")
+
         scope_map = { "SUB": ldb.SCOPE_SUBTREE, "BASE": ldb.SCOPE_BASE, "ONE":ldb.SCOPE_ONELEVEL }
         scope = scope.upper()
         if not scope in scope_map:
@@ -110,14 +144,23 @@ class cmd_dbcheck(Command):
         else:
             attrs = attrs.split()
 
+        chk = dbcheck(samdb, samdb_schema=samdb_schema, verbose=verbose,
+                      fix=fix, yes=yes, quiet=quiet, in_transaction=yes and fix,
+                      reset_well_known_acls=reset_well_known_acls,
+                      link_cache_size=link_cache_size,
+                      prefill_link_cache=prefill_link_cache,
+                      usn_state_file=usn_state_file)
+
+        # the workers are forked before our transaction starts, so they
+        # do not share it
+        if jobs > 1 and not reindex and not force_modules:
+            chk.start_workers(jobs)
+
         started_transaction = False
-        if yes and fix:
-            samdb.transaction_start()
-            started_transaction = True
         try:
-            chk = dbcheck(samdb, samdb_schema=samdb_schema, verbose=verbose,
-                          fix=fix, yes=yes, quiet=quiet, in_transaction=started_transaction,
-                          reset_well_known_acls=reset_well_known_acls)
+            if yes and fix:
+                samdb.transaction_start()
+                started_transaction = True
 
             if reindex:
                 self.outf.write("Re-indexing...\n")
@@ -133,11 +176,14 @@ class cmd_dbcheck(Command):
 
             else:
                 error_count = chk.check_database(DN=DN, scope=search_scope,
-                        controls=controls, attrs=attrs)
+                        controls=controls, attrs=attrs, streaming=streaming,
+                        jobs=jobs, since_last_run=since_last_run)
         except:
             if started_transaction:
                 samdb.transaction_cancel()
             raise
+        finally:
+            chk.stop_workers()
 
         if started_transaction:
             samdb.transaction_commit()
@@ -1463,7 +1463,9 @@ class cmd_domain_classicupgrade(Command):
                    "BIND9_FLATFILE uses bind9 text database to store zone information, "
                    "BIND9_DLZ uses samba4 AD to store zone information, "
                    "NONE skips the DNS setup entirely (this DC will not be a DNS server)",
-               default="SAMBA_INTERNAL")
+               default="SAMBA_INTERNAL"),
+        Option("-j", "--jobs", type=int, default=1, metavar="N",
+               help="Number of import phases to run at once, in separate processes for the WINS and idmap imports, which may then overlap with the SAM database import; also the number of processes setting the sysvol ACLs (default = 1)")
     ]
 
     ntvfs_options = [
@@ -1477,7 +1479,7 @@ class cmd_domain_classicupgrade(Command):
 
     def run(self, smbconf=None, targetdir=None, dbdir=None, testparm=None,
             quiet=False, verbose=False, use_xattrs=None, sambaopts=None, versionopts=None,
-            dns_backend=None, use_ntvfs=False):
+            dns_backend=None, use_ntvfs=False, jobs=1):
 
         if not os.path.exists(smbconf):
             raise CommandError("File {0!s} does not exist".format(smbconf))
@@ -1491,6 +1493,9 @@ class cmd_domain_classicupgrade(Command):
         if not dbdir and not testparm:
             raise CommandError("Please specify either dbdir or testparm")
 
+        if jobs < 1:
+            raise CommandError("--jobs must be at least 1")
+
         logger = self.get_logger()
         if verbose:
             logger.setLevel(logging.DEBUG)
@@ -1561,7 +1566,8 @@ class cmd_domain_classicupgrade(Command):
 
         logger.info("Provisioning")
         upgrade_from_samba3(samba3, logger, targetdir, session_info=system_session(),
-                            useeadb=eadb, dns_backend=dns_backend, use_ntvfs=use_ntvfs)
+                            useeadb=eadb, dns_backend=dns_backend, use_ntvfs=use_ntvfs,
+                            jobs=jobs)
 
 
 class cmd_domain_samba3upgrade(cmd_domain_classicupgrade):
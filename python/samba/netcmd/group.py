@@ -16,8 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
+import itertools
 import samba.getopt as options
 from samba.netcmd import Command, SuperCommand, CommandError, Option
+from samba.netcmd.common import netcmd_write_entries, output_format_help
 import ldb
 from samba.ndr import ndr_unpack
 from samba.dcerpc import security
@@ -196,9 +199,14 @@ Example2:
 sudo samba-tool group addmembers supergroup User2
 
 Example2 shows how to add a single user account, User2, to the supergroup AD group.  It uses the sudo command to run as root when issuing the command.
+
+Example3:
+samba-tool group addmembers supergroup --member-file=members.txt
+
+Example3 shows how to add the accounts listed in members.txt, one name per line, to the supergroup AD group.  Use --member-file=- to read the names from standard input.
 """
 
-    synopsis = "%prog <groupname> <listofmembers> [options]"
+    synopsis = "%prog <groupname> [<listofmembers>] [options]"
 
     takes_optiongroups = {
         "sambaopts": options.SambaOptions,
@@ -209,12 +217,33 @@ Example2 shows how to add a single user account, User2, to the supergroup AD gro
     takes_options = [
         Option("-H", "--URL", help="LDB URL for database or target server", type=str,
                metavar="URL", dest="H"),
+        Option("--member-file", type=str, metavar="FILE", dest="member_file",
+               help="Read member names from FILE, one per line ('-' for standard input)"),
     ]
 
-    takes_args = ["groupname", "listofmembers"]
-
-    def run(self, groupname, listofmembers, credopts=None, sambaopts=None,
-            versionopts=None, H=None):
+    takes_args = ["groupname", "listofmembers?"]
+
+    def run(self, groupname, listofmembers=None, credopts=None, sambaopts=None,
+            versionopts=None, H=None, member_file=None):
+
+        groupmembers = []
+        if listofmembers is not None:
+            groupmembers.extend(listofmembers.split(','))
+        if member_file is not None:
+            if member_file == "-":
+                f = sys.stdin
+            else:
+                try:
+                    f = open(member_file, "r")
+                except IOError, e:
+                    raise CommandError('Unable to read "{0!s}"'.format(member_file), e)
+            try:
+                groupmembers.extend(x.strip() for x in f if x.strip())
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        if not groupmembers:
+            raise CommandError("Either a list of members or --member-file is required")
 
         lp = sambaopts.get_loadparm()
         creds = credopts.get_credentials(lp, fallback_machine=True)
@@ -222,13 +251,12 @@ Example2 shows how to add a single user account, User2, to the supergroup AD gro
         try:
             samdb = SamDB(url=H, session_info=system_session(),
                           credentials=creds, lp=lp)
-            groupmembers = listofmembers.split(',')
             samdb.add_remove_group_members(groupname, groupmembers,
                     add_members_operation=True)
         except Exception, e:
             # FIXME: catch more specific exception
             raise CommandError('Failed to add members "{0!s}" to group "{1!s}"'.format(
-                listofmembers, groupname), e)
+                listofmembers or member_file, groupname), e)
         self.outf.write("Added members to group {0!s}\n".format(groupname))
 
 
@@ -293,7 +321,12 @@ class cmd_group_list(Command):
         Option("-v", "--verbose",
                help="Verbose output, showing group type and group scope.",
                action="store_true"),
-
+        Option("--attributes",
+               help="Comma separated list of attributes to show for each group",
+               type=str),
+        Option("--output-format", type="choice",
+               choices=["plain", "csv", "json"], default="plain",
+               help=output_format_help),
         ]
 
     takes_optiongroups = {
@@ -303,25 +336,41 @@ class cmd_group_list(Command):
         }
 
     def run(self, sambaopts=None, credopts=None, versionopts=None, H=None,
-            verbose=False):
+            verbose=False, attributes=None, output_format="plain"):
         lp = sambaopts.get_loadparm()
         creds = credopts.get_credentials(lp, fallback_machine=True)
 
         samdb = SamDB(url=H, session_info=system_session(),
             credentials=creds, lp=lp)
 
+        if attributes is not None:
+            attrs = [a.strip() for a in attributes.split(",") if a.strip()]
+        else:
+            attrs = ["sAMAccountName"]
+
         domain_dn = samdb.domain_dn()
-        res = samdb.search(domain_dn, scope=ldb.SCOPE_SUBTREE,
+        if attributes is not None or output_format != "plain":
+            pages = samdb.search_pages(domain_dn, scope=ldb.SCOPE_SUBTREE,
+                        expression=("(objectClass=group)"),
+                        attrs=attrs)
+            netcmd_write_entries(samdb, self.outf,
+                                 itertools.chain.from_iterable(pages), attrs,
+                                 output_format=output_format)
+            return
+
+        pages = samdb.search_pages(domain_dn, scope=ldb.SCOPE_SUBTREE,
                     expression=("(objectClass=group)"),
                     attrs=["samaccountname", "grouptype"])
-        if (len(res) == 0):
-            return
+        res = itertools.chain.from_iterable(pages)
 
         if verbose:
-            self.outf.write("Group Name                                  Group Type      Group Scope\n")
-            self.outf.write("-----------------------------------------------------------------------------\n")
-
+            header_written = False
             for msg in res:
+                if not header_written:
+                    self.outf.write("Group Name                                  Group Type      Group Scope\n")
+                    self.outf.write("-----------------------------------------------------------------------------\n")
+                    header_written = True
+
                 self.outf.write("{0:<44!s}".format(msg.get("samaccountname", idx=0)))
                 hgtype = hex(int("{0!s}".format(msg["grouptype"])) & 0x00000000FFFFFFFF)
                 if (hgtype == hex(int(security_group.get("Builtin")))):
@@ -358,6 +407,12 @@ samba-tool group listmembers \"Domain Users\" -H ldap://samba.samdom.example.com
     takes_options = [
         Option("-H", "--URL", help="LDB URL for database or target server", type=str,
                metavar="URL", dest="H"),
+        Option("--attributes",
+               help="Comma separated list of attributes to show for each member",
+               type=str),
+        Option("--output-format", type="choice",
+               choices=["plain", "csv", "json"], default="plain",
+               help=output_format_help),
         ]
 
     takes_optiongroups = {
@@ -368,7 +423,8 @@ samba-tool group listmembers \"Domain Users\" -H ldap://samba.samdom.example.com
 
     takes_args = ["groupname"]
 
-    def run(self, groupname, credopts=None, sambaopts=None, versionopts=None, H=None):
+    def run(self, groupname, credopts=None, sambaopts=None, versionopts=None,
+            H=None, attributes=None, output_format="plain"):
         lp = sambaopts.get_loadparm()
         creds = credopts.get_credentials(lp, fallback_machine=True)
 
@@ -390,15 +446,27 @@ samba-tool group listmembers \"Domain Users\" -H ldap://samba.samdom.example.com
             object_sid = ndr_unpack(security.dom_sid, object_sid)
             (group_dom_sid, rid) = object_sid.split()
 
-            search_filter = "(|(primaryGroupID={0!s})(memberOf={1!s}))".format(rid, group_dn)
-            res = samdb.search(samdb.domain_dn(), scope=ldb.SCOPE_SUBTREE,
-                               expression=(search_filter),
-                               attrs=["samAccountName", "cn"])
+            if attributes is not None:
+                attrs = [a.strip() for a in attributes.split(",") if a.strip()]
+            else:
+                attrs = ["sAMAccountName"]
 
-            if (len(res) == 0):
+            search_filter = "(|(primaryGroupID={0!s})(memberOf={1!s}))".format(rid, group_dn)
+            if attributes is not None or output_format != "plain":
+                pages = samdb.search_pages(samdb.domain_dn(),
+                                           scope=ldb.SCOPE_SUBTREE,
+                                           expression=(search_filter),
+                                           attrs=attrs)
+                netcmd_write_entries(samdb, self.outf,
+                                     itertools.chain.from_iterable(pages),
+                                     attrs, output_format=output_format)
                 return
 
-            for msg in res:
+            pages = samdb.search_pages(samdb.domain_dn(), scope=ldb.SCOPE_SUBTREE,
+                                       expression=(search_filter),
+                                       attrs=["samAccountName", "cn"])
+
+            for msg in itertools.chain.from_iterable(pages):
                 member_name = msg.get("samAccountName", idx=0)
                 if member_name is None:
                     member_name = msg.get("cn", idx=0)
@@ -21,6 +21,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 import sys
@@ -29,7 +32,7 @@ import samba
 import samba.getopt as options
 from samba import Ldb
 from samba.ndr import ndr_unpack
-from samba.dcerpc import security
+from samba.dcerpc import drsblobs, security
 from ldb import SCOPE_SUBTREE, SCOPE_ONELEVEL, SCOPE_BASE, ERR_NO_SUCH_OBJECT, LdbError
 from samba.netcmd import (
     Command,
@@ -45,7 +48,8 @@ class LDAPBase(object):
     def __init__(self, host, creds, lp,
                  two=False, quiet=False, descriptor=False, sort_aces=False, verbose=False,
                  view="section", base="", scope="SUB",
-                 outf=sys.stdout, errf=sys.stderr, skip_missing_dn=True):
+                 outf=sys.stdout, errf=sys.stderr, skip_missing_dn=True,
+                 metadata_digest=False):
         ldb_options = []
         samdb_url = host
         if not "://" in host:
@@ -72,6 +76,8 @@ class LDAPBase(object):
         self.verbose = verbose
         self.host = host
         self.skip_missing_dn = skip_missing_dn
+        self.metadata_digest = metadata_digest
+        self.forward_links = None
         self.base_dn = str(self.ldb.get_default_basedn())
         self.root_dn = str(self.ldb.get_root_basedn())
         self.config_dn = str(self.ldb.get_config_basedn())
@@ -80,7 +86,10 @@ class LDAPBase(object):
         self.server_names = self.find_servers()
         self.domain_name = re.sub("[Dd][Cc]=", "", self.base_dn).replace(",", ".")
         self.domain_sid = self.find_domain_sid()
-        self.get_sid_map()
+        # the SID map is only used to make ACEs comparable
+        self.sid_map = {}
+        if self.descriptor:
+            self.get_sid_map()
         #
         # Log some domain controller specific place-holers that are being used
         # when compare content of two DCs. Uncomment for DEBUG purposes.
@@ -206,7 +215,12 @@ class LDAPBase(object):
         """
         res = self.ldb.search(base=object_dn, scope=SCOPE_BASE, attrs=["*"])
         assert len(res) == 1
-        res = dict(res[0])
+        return self.get_attributes_from_msg(object_dn, res[0])
+
+    def get_attributes_from_msg(self, object_dn, msg):
+        """ Returns dict with the attributes of a search result message
+        """
+        res = dict(msg)
         # 'Dn' element is not iterable and we have it as 'distinguishedName'
         del res["dn"]
         for key in res.keys():
@@ -217,9 +231,42 @@ class LDAPBase(object):
 
         return res
 
+    def get_forward_links(self):
+        """ Returns the names of the forward linked attributes, whose values
+            replicate with their own metadata rather than replPropertyMetaData
+        """
+        if self.forward_links is None:
+            res = self.ldb.search(base=self.schema_dn, scope=SCOPE_ONELEVEL,
+                                  expression="(&(objectClass=attributeSchema)(linkID=*))",
+                                  attrs=["lDAPDisplayName", "linkID"])
+            self.forward_links = [x["lDAPDisplayName"][0] for x in res
+                                  if int(x["linkID"][0]) % 2 == 0]
+        return self.forward_links
+
+    def get_metadata_digest(self, object_dn, msg):
+        """ Returns a digest of the replication state of an object: the
+            attid, version, originating invocationID and USN of each
+            attribute in replPropertyMetaData, and the forward link values
+        """
+        items = []
+        attributes = self.get_attributes_from_msg(object_dn, msg)
+        for (name, vals) in attributes.items():
+            if name.upper() == "REPLPROPERTYMETADATA":
+                md = ndr_unpack(drsblobs.replPropertyMetaDataBlob, vals[0])
+                for o in md.ctr.array:
+                    items.append("{0:d}:{1:d}:{2!s}:{3:d}".format(
+                        o.attid, o.version, o.originating_invocation_id,
+                        o.originating_usn))
+            else:
+                vals = sorted([str(v).upper() for v in vals])
+                items.append("{0!s}:{1!s}".format(name.upper(), ";".join(vals)))
+        return hashlib.sha1("\n".join(sorted(items))).hexdigest()
+
     def get_descriptor_sddl(self, object_dn):
         res = self.ldb.search(base=object_dn, scope=SCOPE_BASE, attrs=["nTSecurityDescriptor"])
-        desc = res[0]["nTSecurityDescriptor"][0]
+        return self.get_descriptor_sddl_from_blob(res[0]["nTSecurityDescriptor"][0])
+
+    def get_descriptor_sddl_from_blob(self, desc):
         desc = ndr_unpack(security.descriptor, desc)
         return desc.as_sddl(self.domain_sid)
 
@@ -262,12 +309,14 @@ class LDAPBase(object):
                 pass
 
 class Descriptor(object):
-    def __init__(self, connection, dn, outf=sys.stdout, errf=sys.stderr):
+    def __init__(self, connection, dn, sddl=None, outf=sys.stdout, errf=sys.stderr):
         self.outf = outf
         self.errf = errf
         self.con = connection
         self.dn = dn
-        self.sddl = self.con.get_descriptor_sddl(self.dn)
+        if sddl is None:
+            sddl = self.con.get_descriptor_sddl(self.dn)
+        self.sddl = sddl
         self.dacl_list = self.extract_dacl()
         if self.con.sort_aces:
             self.dacl_list.sort()
@@ -381,6 +430,7 @@ class Descriptor(object):
 
 class LDAPObject(object):
     def __init__(self, connection, dn, summary, filter_list,
+                 attributes=None, sddl=None,
                  outf=sys.stdout, errf=sys.stderr):
         self.outf = outf
         self.errf = errf
@@ -393,7 +443,10 @@ class LDAPObject(object):
         self.dn = self.dn.replace("CN=${DOMAIN_NETBIOS}", "CN={0!s}".format(self.con.domain_netbios))
         for x in self.con.server_names:
             self.dn = self.dn.replace("CN=${SERVER_NAME}", "CN={0!s}".format(x))
-        self.attributes = self.con.get_attributes(self.dn)
+        if attributes is None:
+            attributes = self.con.get_attributes(self.dn)
+        self.attributes = attributes
+        self.sddl = sddl
         # One domain - two domain controllers
         #
         # Some attributes are defined as FLAG_ATTR_NOT_REPLICATED
@@ -541,8 +594,8 @@ class LDAPObject(object):
         return self.cmp_attrs(other)
 
     def cmp_desc(self, other):
-        d1 = Descriptor(self.con, self.dn, outf=self.outf, errf=self.errf)
-        d2 = Descriptor(other.con, other.dn, outf=self.outf, errf=self.errf)
+        d1 = Descriptor(self.con, self.dn, sddl=self.sddl, outf=self.outf, errf=self.errf)
+        d2 = Descriptor(other.con, other.dn, sddl=other.sddl, outf=self.outf, errf=self.errf)
         if self.con.view == "section":
             res = d1.diff_2(d2)
         elif self.con.view == "collision":
@@ -691,6 +744,12 @@ class LDAPBundel(object):
         self.summary["known_ignored_dn"] = []
         self.summary["abnormal_ignored_dn"] = []
         self.filter_list = filter_list
+        # the replication metadata digests, indexed by the upper case
+        # alias of their DN
+        self.digests = {}
+        # objects of a searched context are compared from a second paged
+        # search, those of an explicit DN list one by one
+        self.searched = not dn_list
         if dn_list:
             self.dn_list = dn_list
         elif context.upper() in ["DOMAIN", "CONFIGURATION", "SCHEMA", "DNSDOMAIN", "DNSFOREST"]:
@@ -698,21 +757,25 @@ class LDAPBundel(object):
             self.dn_list = self.get_dn_list(context)
         else:
             raise Exception("Unknown initialization data for LDAPBundel().")
-        counter = 0
-        while counter < len(self.dn_list) and self.two_domains:
-            # Use alias reference
-            tmp = self.dn_list[counter]
-            tmp = tmp[:len(tmp)-len(self.con.base_dn)] + "${DOMAIN_DN}"
-            tmp = tmp.replace("CN={0!s}".format(self.con.domain_netbios), "CN=${DOMAIN_NETBIOS}")
-            if len(self.con.server_names) == 1:
-                for x in self.con.server_names:
-                    tmp = tmp.replace("CN={0!s}".format(x), "CN=${SERVER_NAME}")
-            self.dn_list[counter] = tmp
-            counter += 1
+        if self.two_domains:
+            self.dn_list = [self.alias_dn(x) for x in self.dn_list]
+            self.digests = dict((self.alias_dn(x), d) for (x, d) in self.digests.items())
+        self.digests = dict((x.upper(), d) for (x, d) in self.digests.items())
         self.dn_list = list(set(self.dn_list))
         self.dn_list = sorted(self.dn_list)
         self.size = len(self.dn_list)
 
+    def alias_dn(self, dn):
+        """
+        Use alias reference for the parts of a DN that differ between domains
+        """
+        tmp = dn[:len(dn)-len(self.con.base_dn)] + "${DOMAIN_DN}"
+        tmp = tmp.replace("CN={0!s}".format(self.con.domain_netbios), "CN=${DOMAIN_NETBIOS}")
+        if len(self.con.server_names) == 1:
+            for x in self.con.server_names:
+                tmp = tmp.replace("CN={0!s}".format(x), "CN=${SERVER_NAME}")
+        return tmp
+
     def log(self, msg):
         """
         Log on the screen if there is no --quiet option set
@@ -735,27 +798,27 @@ class LDAPBundel(object):
         # It does not matter if they are in the same DC, in two DC in one domain or in two
         # different domains.
         if self.search_scope != SCOPE_BASE:
+            self_dns = set([x.upper() for x in self.dn_list])
+            other_dns = set([x.upper() for x in other.dn_list])
             title= "\n* DNs found only in {0!s}:".format(self.con.host)
             for x in self.dn_list:
-                if not x.upper() in [q.upper() for q in other.dn_list]:
+                if not x.upper() in other_dns:
                     if title and not self.skip_missing_dn:
                         self.log( title )
                         title = None
                         res = False
                     self.log( 4*" " + x )
-                    self.dn_list[self.dn_list.index(x)] = ""
-            self.dn_list = [x for x in self.dn_list if x]
+            self.dn_list = [x for x in self.dn_list if x.upper() in other_dns]
             #
             title= "\n* DNs found only in {0!s}:".format(other.con.host)
             for x in other.dn_list:
-                if not x.upper() in [q.upper() for q in self.dn_list]:
+                if not x.upper() in self_dns:
                     if title and not self.skip_missing_dn:
                         self.log( title )
                         title = None
                         res = False
                     self.log( 4*" " + x )
-                    other.dn_list[other.dn_list.index(x)] = ""
-            other.dn_list = [x for x in other.dn_list if x]
+            other.dn_list = [x for x in other.dn_list if x.upper() in self_dns]
             #
             self.update_size()
             other.update_size()
@@ -763,34 +826,13 @@ class LDAPBundel(object):
             assert sorted([x.upper() for x in self.dn_list]) == sorted([x.upper() for x in other.dn_list])
         self.log( "\n* Objects to be compared: {0!s}".format(self.size) )
 
-        index = 0
-        while index < self.size:
-            skip = False
-            try:
-                object1 = LDAPObject(connection=self.con,
-                                     dn=self.dn_list[index],
-                                     summary=self.summary,
-                                     filter_list=self.filter_list,
-                                     outf=self.outf, errf=self.errf)
-            except LdbError, (enum, estr):
-                if enum == ERR_NO_SUCH_OBJECT:
-                    self.log( "\n!!! Object not found: {0!s}".format(self.dn_list[index]) )
-                    skip = True
-                raise
-            try:
-                object2 = LDAPObject(connection=other.con,
-                        dn=other.dn_list[index],
-                        summary=other.summary,
-                        filter_list=self.filter_list,
-                        outf=self.outf, errf=self.errf)
-            except LdbError, (enum, estr):
-                if enum == ERR_NO_SUCH_OBJECT:
-                    self.log( "\n!!! Object not found: {0!s}".format(other.dn_list[index]) )
-                    skip = True
-                raise
-            if skip:
-                index += 1
-                continue
+        self.same_metadata = 0
+        if self.searched and other.searched and self.search_scope != SCOPE_BASE \
+           and not self.con.metadata_digest:
+            pairs = self.walk_objects(other)
+        else:
+            pairs = self.search_objects(other)
+        for (object1, object2) in pairs:
             if object1 == object2:
                 if self.con.verbose:
                     self.log( "\nComparing:" )
@@ -806,10 +848,138 @@ class LDAPBundel(object):
                 res = False
             self.summary = object1.summary
             other.summary = object2.summary
-            index += 1
         #
+        if self.con.metadata_digest:
+            self.log( "\n* Objects with the same replication metadata: {0!s}".format(self.same_metadata) )
         return res
 
+    def search_objects(self, other):
+        """ Yields the pairs of objects to compare, with a search for each
+            object on both servers.  Used for explicit DN lists, base scope
+            and the objects whose replication metadata digests differ.
+        """
+        index = 0
+        while index < self.size:
+            digest = self.digests.get(self.dn_list[index].upper())
+            if digest is not None and digest == other.digests.get(other.dn_list[index].upper()):
+                if self.con.verbose:
+                    self.log( "\nComparing:" )
+                    self.log( "'{0!s}' [{1!s}]".format(self.dn_list[index], self.con.host) )
+                    self.log( "'{0!s}' [{1!s}]".format(other.dn_list[index], other.con.host) )
+                    self.log( 4*" " + "OK (same replication metadata)" )
+                self.same_metadata += 1
+                index += 1
+                continue
+            try:
+                object1 = self.get_object(self.dn_list[index])
+            except LdbError, (enum, estr):
+                if enum == ERR_NO_SUCH_OBJECT:
+                    self.log( "\n!!! Object not found: {0!s}".format(self.dn_list[index]) )
+                raise
+            try:
+                object2 = other.get_object(other.dn_list[index],
+                                           filter_list=self.filter_list)
+            except LdbError, (enum, estr):
+                if enum == ERR_NO_SUCH_OBJECT:
+                    self.log( "\n!!! Object not found: {0!s}".format(other.dn_list[index]) )
+                raise
+            yield (object1, object2)
+            index += 1
+
+    def walk_objects(self, other):
+        """ Yields the pairs of objects to compare, from a paged search of
+            the context on each server.
+
+            The servers return the objects in an order of their own, so
+            the two result streams are read a page at a time in turn and
+            each object is matched with its counterpart by DN.  Only the
+            objects whose counterpart has not been returned yet are kept.
+        """
+        wanted = set([x.upper() for x in self.dn_list])
+        streams = [[self, self.search_pages(self.object_attrs()), {}],
+                   [other, other.search_pages(other.object_attrs()), {}]]
+        while streams[0][1] is not None or streams[1][1] is not None:
+            for (i, stream) in enumerate(streams):
+                (bundel, pages, pending) = stream
+                if pages is None:
+                    continue
+                try:
+                    page = pages.next()
+                except StopIteration:
+                    stream[1] = None
+                    continue
+                counterparts = streams[1 - i][2]
+                for msg in page:
+                    dn = bundel.msg_dn(msg)
+                    key = dn.upper()
+                    if key not in wanted:
+                        # added since the DN lists were searched
+                        continue
+                    if key not in counterparts:
+                        pending[key] = (dn, msg)
+                        continue
+                    wanted.discard(key)
+                    (dn2, msg2) = counterparts.pop(key)
+                    if i == 0:
+                        yield (self.get_object(dn, msg),
+                               other.get_object(dn2, msg2, filter_list=self.filter_list))
+                    else:
+                        yield (self.get_object(dn2, msg2),
+                               other.get_object(dn, msg, filter_list=self.filter_list))
+        # deleted since the DN lists were searched
+        for x in self.dn_list:
+            if x.upper() in wanted:
+                self.log( "\n!!! Object not found: {0!s}".format(x) )
+
+    def msg_dn(self, msg):
+        """ Returns the DN of a search result as it is in the DN list
+        """
+        dn = msg.dn.get_linearized()
+        if self.two_domains:
+            dn = self.alias_dn(dn)
+        return dn
+
+    def object_attrs(self):
+        """ Returns the attributes to search for to compare the objects
+        """
+        if self.con.descriptor:
+            return ["nTSecurityDescriptor"]
+        return ["*"]
+
+    def get_object(self, dn, msg=None, filter_list=None):
+        """ Returns the LDAPObject for a DN of the list, built from its search
+            result when there is one.
+        """
+        if filter_list is None:
+            filter_list = self.filter_list
+        attributes = None
+        sddl = None
+        if msg is not None:
+            object_dn = msg.dn.get_linearized()
+            if self.con.descriptor:
+                attributes = {}
+                sddl = self.con.get_descriptor_sddl_from_blob(msg["nTSecurityDescriptor"][0])
+            else:
+                attributes = self.con.get_attributes_from_msg(object_dn, msg)
+        return LDAPObject(connection=self.con,
+                          dn=dn,
+                          summary=self.summary,
+                          filter_list=filter_list,
+                          attributes=attributes, sddl=sddl,
+                          outf=self.outf, errf=self.errf)
+
+    def search_pages(self, attrs):
+        """ Yields the pages of a paged search of the context
+        """
+        try:
+            for res in self.con.ldb.search_pages(base=self.search_base,
+                                                 scope=self.search_scope,
+                                                 attrs=attrs):
+                yield res
+        except LdbError, (enum, estr):
+            self.outf.write("Failed search of base={0!s}\n".format(self.search_base))
+            raise
+
     def get_dn_list(self, context):
         """ Query LDAP server about the DNs of certain naming self.con.ext Domain (or Default), Configuration, Schema.
             Parse all DNs and filter those that are 'strange' or abnormal.
@@ -837,13 +1007,18 @@ class LDAPBundel(object):
             self.search_scope = SCOPE_ONELEVEL
         else:
             raise StandardError("Wrong 'scope' given. Choose from: SUB, ONE, BASE")
-        try:
-            res = self.con.ldb.search(base=self.search_base, scope=self.search_scope, attrs=["dn"])
-        except LdbError, (enum, estr):
-            self.outf.write("Failed search of base={0!s}\n".format(self.search_base))
-            raise
-        for x in res:
-           dn_list.append(x["dn"].get_linearized())
+        # Only the DNs, or the replication metadata digests, are kept.
+        # The objects themselves are searched again when compared.
+        if self.con.metadata_digest:
+            attrs = ["replPropertyMetaData"] + self.con.get_forward_links()
+        else:
+            attrs = ["dn"]
+        for res in self.search_pages(attrs):
+            for x in res:
+                dn = x["dn"].get_linearized()
+                dn_list.append(dn)
+                if self.con.metadata_digest:
+                    self.digests[dn] = self.con.get_metadata_digest(dn, x)
         #
         global summary
         #
@@ -863,6 +1038,64 @@ class LDAPBundel(object):
             self.summary["df_value_attrs"] = []
 
 
+_multi_cons = None
+
+
+def _multi_init(urls, creds_list, lp, con_options):
+    """ Connect a worker process to every server
+    """
+    global _multi_cons
+    _multi_cons = [LDAPBase(url, creds, lp, **con_options)
+                   for (url, creds) in zip(urls, creds_list)]
+
+
+def _multi_compare(args):
+    """ Compare a chunk of DNs of a context between the first server and
+        each of the others in a worker process, returning a list of
+        result dicts
+    """
+    (context, dn_list, filter_list, verbose) = args
+    records = []
+    for dn in dn_list:
+        summary = {"unique_attrs": [], "df_value_attrs": [],
+                   "known_ignored_dn": [], "abnormal_ignored_dn": []}
+        objects = []
+        for con in _multi_cons:
+            try:
+                objects.append(LDAPObject(connection=con, dn=dn,
+                                          summary=summary,
+                                          filter_list=filter_list))
+            except LdbError, (enum, estr):
+                if enum != ERR_NO_SUCH_OBJECT:
+                    raise
+                objects.append(None)
+
+        missing = [con.host for (con, obj) in zip(_multi_cons, objects) if obj is None]
+        if missing:
+            # deleted while we were comparing
+            records.append({"context": context, "dn": dn,
+                            "result": "missing", "hosts": missing})
+            continue
+
+        first = objects[0]
+        for obj in objects[1:]:
+            if first == obj:
+                if verbose:
+                    records.append({"context": context, "dn": dn,
+                                    "result": "ok",
+                                    "hosts": [first.con.host, obj.con.host]})
+                continue
+            record = {"context": context, "dn": dn, "result": "different",
+                      "hosts": [first.con.host, obj.con.host],
+                      "diff": first.screen_output}
+            if not first.con.descriptor:
+                record["unique_attrs"] = {first.con.host: first.unique_attrs,
+                                          obj.con.host: obj.unique_attrs}
+                record["different_attrs"] = first.df_value_attrs
+            records.append(record)
+    return records
+
+
 class cmd_ldapcmp(Command):
     """Compare two ldap databases."""
     synopsis = "%prog <URL1> <URL2> (domain|configuration|schema|dnsdomain|dnsforest) [options]"
@@ -904,13 +1137,23 @@ class cmd_ldapcmp(Command):
             help="List of comma separated attributes to ignore in the comparision"),
         Option("--skip-missing-dn", dest="skip_missing_dn", action="store_true", default=False,
             help="Skip report and failure due to missing DNs in one server or another"),
+        Option("--url", dest="urls", action="append", metavar="URL",
+            help="Compare with this server as well, using the second set of credentials. May be given more than once"),
+        Option("-j", "--jobs", dest="jobs", type=int, default=1,
+            help="Compare the objects in this many worker processes"),
+        Option("--json", dest="json_output", action="store_true", default=False,
+            help="Print a JSON object per DN that differs, one per line"),
+        Option("--metadata-digest", dest="metadata_digest", action="store_true", default=False,
+            help="Compare a digest of the replication metadata of each object first, and "
+                 "the attributes only of the objects where it differs. Not with --two"),
         ]
 
     def run(self, URL1, URL2,
             context1=None, context2=None, context3=None, context4=None, context5=None,
             two=False, quiet=False, verbose=False, descriptor=False, sort_aces=False,
             view="section", base="", base2="", scope="SUB", filter="",
-            credopts=None, sambaopts=None, versionopts=None, skip_missing_dn=False):
+            credopts=None, sambaopts=None, versionopts=None, skip_missing_dn=False,
+            urls=None, jobs=1, json_output=False, metadata_digest=False):
 
         lp = sambaopts.get_loadparm()
 
@@ -955,21 +1198,44 @@ class cmd_ldapcmp(Command):
             raise CommandError("Invalid --view value. Choose from: section or collision")
         if not scope.upper() in ["SUB", "ONE", "BASE"]:
             raise CommandError("Invalid --scope value. Choose from: SUB, ONE, BASE")
+        if jobs < 1:
+            raise CommandError("--jobs must be at least 1")
+        if metadata_digest and two:
+            raise CommandError("--metadata-digest can't be used with --two, "
+                               "the replication metadata of two domains never matches")
+
+        filter_list = filter.split(",")
+
+        if urls or jobs > 1 or json_output:
+            if base or base2:
+                raise CommandError("--base and --base2 can only be used when comparing two servers "
+                                   "without --url, --jobs or --json")
+            all_urls = [URL1, URL2] + (urls or [])
+            creds_list = [creds] + [creds2] * (len(all_urls) - 1)
+            con_options = dict(two=two, quiet=True, descriptor=descriptor,
+                               sort_aces=sort_aces, verbose=verbose, view=view,
+                               scope=scope, skip_missing_dn=skip_missing_dn,
+                               metadata_digest=metadata_digest)
+            status = self.run_parallel(all_urls, creds_list, lp, contexts, filter_list,
+                                       con_options, jobs, quiet, verbose, json_output)
+            if status != 0:
+                raise CommandError("Compare failed: {0:d}".format(status))
+            return
 
         con1 = LDAPBase(URL1, creds, lp,
                         two=two, quiet=quiet, descriptor=descriptor, sort_aces=sort_aces,
                         verbose=verbose,view=view, base=base, scope=scope,
+                        metadata_digest=metadata_digest,
                         outf=self.outf, errf=self.errf)
         assert len(con1.base_dn) > 0
 
         con2 = LDAPBase(URL2, creds2, lp,
                         two=two, quiet=quiet, descriptor=descriptor, sort_aces=sort_aces,
                         verbose=verbose, view=view, base=base2, scope=scope,
+                        metadata_digest=metadata_digest,
                         outf=self.outf, errf=self.errf)
         assert len(con2.base_dn) > 0
 
-        filter_list = filter.split(",")
-
         status = 0
         for context in contexts:
             if not quiet:
@@ -998,3 +1264,97 @@ class cmd_ldapcmp(Command):
                 status = -1
         if status != 0:
             raise CommandError("Compare failed: {0:d}".format(status))
+
+    def run_parallel(self, urls, creds_list, lp, contexts, filter_list,
+                     con_options, jobs, quiet, verbose, json_output):
+        """ Compare every context between the first server and each of the
+            others, with the objects compared by a pool of worker processes
+        """
+        cons = [LDAPBase(url, creds, lp, outf=self.outf, errf=self.errf, **con_options)
+                for (url, creds) in zip(urls, creds_list)]
+        skip_missing_dn = con_options["skip_missing_dn"]
+
+        def write(record):
+            if json_output:
+                self.outf.write(json.dumps(record, sort_keys=True) + "\n")
+            elif quiet:
+                pass
+            elif record["result"] == "missing":
+                self.outf.write("\n* DN found only in some servers: {0!s}\n".format(record["dn"]))
+                self.outf.write(4*" " + "missing from: {0!s}\n".format(", ".join(record["hosts"])))
+            else:
+                self.outf.write("\nComparing [{0!s}]:\n".format(record["context"]))
+                for host in record["hosts"]:
+                    self.outf.write("'{0!s}' [{1!s}]\n".format(record["dn"], host))
+                if record["result"] == "ok":
+                    self.outf.write(4*" " + "OK\n")
+                else:
+                    self.outf.write(record["diff"] + "\n")
+                    self.outf.write(4*" " + "FAILED\n")
+
+        failed = set()
+        tasks = []
+        for context in contexts:
+            dn_lists = []
+            digests = []
+            for con in cons:
+                b = LDAPBundel(con, context=context, filter_list=filter_list,
+                               outf=self.outf, errf=self.errf)
+                dn_lists.append(dict((x.upper(), x) for x in b.dn_list))
+                digests.append(b.digests)
+
+            common = set(dn_lists[0])
+            for dns in dn_lists[1:]:
+                common.intersection_update(dns)
+            every = set()
+            for dns in dn_lists:
+                every.update(dns)
+
+            for key in sorted(every - common):
+                dn = [dns[key] for dns in dn_lists if key in dns][0]
+                missing = [con.host for (con, dns) in zip(cons, dn_lists) if key not in dns]
+                write({"context": context, "dn": dn, "result": "missing", "hosts": missing})
+                if not skip_missing_dn:
+                    failed.add(context)
+
+            if con_options["metadata_digest"]:
+                same = set(key for key in common
+                           if digests[0].get(key) is not None and
+                           all(d.get(key) == digests[0][key] for d in digests[1:]))
+                if not quiet and not json_output:
+                    self.outf.write("\n* Objects with the same replication metadata in [{0!s}]: {1:d}\n".format(
+                        context, len(same)))
+                common.difference_update(same)
+
+            dn_list = sorted(dn_lists[0][key] for key in common)
+            if not quiet and not json_output:
+                self.outf.write("\n* Objects to be compared in [{0!s}]: {1:d}\n".format(
+                    context, len(dn_list)))
+            for i in range(0, len(dn_list), 100):
+                tasks.append((context, dn_list[i:i+100], filter_list, verbose))
+
+        pool = multiprocessing.Pool(jobs, _multi_init,
+                                    (urls, creds_list, lp, con_options))
+        try:
+            for records in pool.imap(_multi_compare, tasks):
+                for record in records:
+                    write(record)
+                    if record["result"] == "different" or \
+                       (record["result"] == "missing" and not skip_missing_dn):
+                        failed.add(record["context"])
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if not quiet and not json_output:
+            for context in contexts:
+                if context in failed:
+                    self.outf.write("\n* Result for [{0!s}]: FAILURE\n".format(context))
+                else:
+                    self.outf.write("\n* Result for [{0!s}]: SUCCESS\n".format(context))
+        if failed:
+            return -1
+        return 0
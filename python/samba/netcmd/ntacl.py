@@ -27,6 +27,7 @@ from samba.samba3 import param as s3param, passdb, smbd
 from samba import provision
 
 from ldb import SCOPE_BASE
+import logging
 import os
 
 from samba.auth import system_session
@@ -183,16 +184,24 @@ class cmd_ntacl_sysvolreset(Command):
 
     takes_options = [
         Option("--use-ntvfs", help="Set the ACLs for use with the ntvfs file server", action="store_true"),
-        Option("--use-s3fs", help="Set the ACLs for use with the default s3fs file server", action="store_true")
+        Option("--use-s3fs", help="Set the ACLs for use with the default s3fs file server", action="store_true"),
+        Option("-j", "--jobs", type=int, default=1, metavar="N",
+               help="Share the sysvol tree between N processes"),
+        Option("--checkpoint", type=str, metavar="FILE",
+               help="Record finished parts of the tree in FILE.<pid> files, and skip those recorded by an interrupted run"),
         ]
 
-    def run(self, use_ntvfs=False, use_s3fs=False,
+    def run(self, use_ntvfs=False, use_s3fs=False, jobs=1, checkpoint=None,
             credopts=None, sambaopts=None, versionopts=None):
         lp = sambaopts.get_loadparm()
         path = lp.private_path("secrets.ldb")
         creds = credopts.get_credentials(lp)
         creds.set_kerberos_state(DONT_USE_KERBEROS)
         logger = self.get_logger()
+        logger.setLevel(logging.INFO)
+
+        if jobs < 1:
+            raise CommandError("--jobs must be at least 1")
 
         netlogon = lp.get("path", "netlogon")
         sysvol = lp.get("path", "sysvol")
@@ -236,7 +245,8 @@ class cmd_ntacl_sysvolreset(Command):
         provision.setsysvolacl(samdb, netlogon, sysvol,
                                LA_uid, BA_gid, domain_sid,
                                lp.get("realm").lower(), samdb.domain_dn(),
-                               lp, use_ntvfs=use_ntvfs)
+                               lp, use_ntvfs=use_ntvfs, jobs=jobs,
+                               checkpoint=checkpoint, logger=logger)
 
 class cmd_ntacl_sysvolcheck(Command):
     """Check sysvol ACLs match defaults (including correct ACLs on GPOs)."""
@@ -248,12 +258,24 @@ class cmd_ntacl_sysvolcheck(Command):
         "versionopts": options.VersionOptions,
         }
 
-    def run(self, credopts=None, sambaopts=None, versionopts=None):
+    takes_options = [
+        Option("-j", "--jobs", type=int, default=1, metavar="N",
+               help="Share the sysvol tree between N processes"),
+        Option("--checkpoint", type=str, metavar="FILE",
+               help="Record finished parts of the tree in FILE.<pid> files, and skip those recorded by an interrupted run"),
+        ]
+
+    def run(self, jobs=1, checkpoint=None, credopts=None, sambaopts=None,
+            versionopts=None):
         lp = sambaopts.get_loadparm()
         path = lp.private_path("secrets.ldb")
         creds = credopts.get_credentials(lp)
         creds.set_kerberos_state(DONT_USE_KERBEROS)
         logger = self.get_logger()
+        logger.setLevel(logging.INFO)
+
+        if jobs < 1:
+            raise CommandError("--jobs must be at least 1")
 
         netlogon = lp.get("path", "netlogon")
         sysvol = lp.get("path", "sysvol")
@@ -267,7 +289,8 @@ class cmd_ntacl_sysvolcheck(Command):
         provision.checksysvolacl(samdb, netlogon, sysvol,
                                  domain_sid,
                                  lp.get("realm").lower(), samdb.domain_dn(),
-                                 lp)
+                                 lp, jobs=jobs, checkpoint=checkpoint,
+                                 logger=logger)
 
 
 class cmd_ntacl(SuperCommand):
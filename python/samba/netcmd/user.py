@@ -18,8 +18,12 @@
 #
 
 import samba.getopt as options
+import csv
+import itertools
 import ldb
 import pwd
+import sys
+import time
 from getpass import getpass
 from samba.auth import system_session
 from samba.samdb import SamDB
@@ -36,6 +40,7 @@ from samba.netcmd import (
     SuperCommand,
     Option,
     )
+from samba.netcmd.common import netcmd_write_entries, output_format_help
 
 
 class cmd_user_create(Command):
@@ -214,6 +219,191 @@ class cmd_user_add(cmd_user_create):
         return super(self, cmd_user_add).run(*args, **kwargs)
 
 
+class cmd_user_import(Command):
+    """Create many users from a CSV or LDIF file.
+
+This command creates user accounts in bulk, reusing a single database connection and adding many users in each transaction.  Passwords are set as part of adding each user rather than in a separate pass.
+
+A CSV file must have a header row.  The columns are named after the options of 'samba-tool user create', without the leading dashes, together with 'username' (required) and 'password'.  For example:
+
+username,password,given-name,surname,userou,must-change-at-next-login
+jdoe,passw0rd,John,Doe,OU=Staff,yes
+
+Rows with an empty password are created disabled, unless --random-password is given.
+
+An LDIF file holds complete user entries, which are added as given.  Passwords may be given as unicodePwd values.
+
+Users that fail to be created are listed at the end, with their line or record number, and the other users in the same batch are still created.
+
+Example1:
+samba-tool user import users.csv -H ldap://samba.samdom.example.com -Uadministrator%passw1rd
+
+Example2:
+samba-tool user import --format=ldif --batch-size=500 users.ldif
+"""
+
+    synopsis = "%prog <file> [options]"
+
+    takes_options = [
+        Option("-H", "--URL", help="LDB URL for database or target server", type=str,
+               metavar="URL", dest="H"),
+        Option("--format", type="choice", choices=["csv", "ldif"],
+               help="Input format (default: guessed from the file name, else csv)"),
+        Option("--batch-size", type=int, default=100,
+               help="Number of users to add per transaction (default 100)"),
+        Option("--random-password",
+               help="Generate random passwords for CSV rows without one",
+               action="store_true"),
+        ]
+
+    takes_args = ["file"]
+
+    takes_optiongroups = {
+        "sambaopts": options.SambaOptions,
+        "credopts": options.CredentialsOptions,
+        "versionopts": options.VersionOptions,
+        }
+
+    # CSV column -> SamDB.newuser_messages() parameter
+    csv_columns = {
+        "username": "username",
+        "password": "password",
+        "must-change-at-next-login": "force_password_change_at_next_login_req",
+        "use-username-as-cn": "useusernameascn",
+        "userou": "userou",
+        "surname": "surname",
+        "given-name": "givenname",
+        "initials": "initials",
+        "profile-path": "profilepath",
+        "script-path": "scriptpath",
+        "home-drive": "homedrive",
+        "home-directory": "homedirectory",
+        "job-title": "jobtitle",
+        "department": "department",
+        "company": "company",
+        "description": "description",
+        "mail-address": "mailaddress",
+        "internet-address": "internetaddress",
+        "telephone-number": "telephonenumber",
+        "physical-delivery-office": "physicaldeliveryoffice",
+        "nis-domain": "nisdomain",
+        "unix-home": "unixhome",
+        "uid": "uid",
+        "uid-number": "uidnumber",
+        "gid-number": "gidnumber",
+        "gecos": "gecos",
+        "login-shell": "loginshell",
+        }
+
+    csv_flags = ("must-change-at-next-login", "use-username-as-cn")
+    csv_ints = ("uid-number", "gid-number")
+
+    def csv_users(self, samdb, f, random_password, rows, errors):
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None:
+            return
+        unknown = [c for c in reader.fieldnames if c not in self.csv_columns]
+        if unknown:
+            raise CommandError("Unknown CSV column(s): {0!s}".format(
+                ", ".join(unknown)))
+        if "username" not in reader.fieldnames:
+            raise CommandError("The CSV file has no 'username' column")
+
+        for row in reader:
+            line = reader.line_num
+            username = row.get("username")
+            try:
+                kwargs = {}
+                for (column, value) in row.items():
+                    if column is None or value is None or value == "":
+                        continue
+                    if column in self.csv_flags:
+                        value = value.lower() in ("1", "y", "yes", "true")
+                    elif column in self.csv_ints:
+                        value = int(value)
+                    kwargs[self.csv_columns[column]] = value
+                if not username:
+                    raise Exception("no username given")
+                if "password" not in kwargs and random_password:
+                    kwargs["password"] = generate_random_password(128, 255)
+                (add_msg, modify_msg) = samdb.newuser_messages(**kwargs)
+            except Exception, e:
+                errors.append((line, username, e))
+                continue
+            rows.append(line)
+            yield (username, add_msg, modify_msg)
+
+    def ldif_users(self, samdb, f, rows, errors):
+        record = 0
+        for (changetype, msg) in samdb.parse_ldif(f.read()):
+            record += 1
+            name = msg.get("sAMAccountName", idx=0) or str(msg.dn)
+            if changetype not in (ldb.CHANGETYPE_NONE, ldb.CHANGETYPE_ADD):
+                errors.append((record, name,
+                               Exception("only add records can be imported")))
+                continue
+            rows.append(record)
+            yield (name, msg, None)
+
+    def run(self, file, credopts=None, sambaopts=None, versionopts=None,
+            H=None, format=None, batch_size=100, random_password=False):
+        lp = sambaopts.get_loadparm()
+        creds = credopts.get_credentials(lp)
+
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        if format is None:
+            if file.lower().endswith(".ldif"):
+                format = "ldif"
+            else:
+                format = "csv"
+
+        samdb = SamDB(url=H, session_info=system_session(),
+                      credentials=creds, lp=lp)
+
+        if file == "-":
+            f = sys.stdin
+        else:
+            try:
+                f = open(file, "r")
+            except IOError, e:
+                raise CommandError("Unable to read '{0!s}'".format(file), e)
+
+        # line (CSV) or record (LDIF) numbers of the users handed to
+        # add_users(), by index, and the rows that failed
+        rows = []
+        errors = []
+        if format == "ldif":
+            users = self.ldif_users(samdb, f, rows, errors)
+        else:
+            users = self.csv_users(samdb, f, random_password, rows, errors)
+
+        start = time.time()
+        try:
+            failed = samdb.add_users(users, batch_size=batch_size)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        elapsed = time.time() - start
+
+        errors.extend((rows[i], name, e) for (i, name, e) in failed)
+        errors.sort()
+
+        created = len(rows) - len(failed)
+        rate = created / elapsed if elapsed > 0 else 0.0
+        self.outf.write("Created {0:d} users in {1:.1f} seconds "
+                        "({2:.1f} users/second)\n".format(created, elapsed,
+                                                          rate))
+        if errors:
+            what = "record" if format == "ldif" else "line"
+            for (row, name, e) in errors:
+                self.errf.write("{0!s} {1:d} ({2!s}): {3!s}\n".format(
+                    what, row, name, e))
+            raise CommandError("Failed to create {0:d} users".format(
+                len(errors)))
+
+
 class cmd_user_delete(Command):
     """Delete a user.
 
@@ -270,6 +460,12 @@ class cmd_user_list(Command):
     takes_options = [
         Option("-H", "--URL", help="LDB URL for database or target server", type=str,
                metavar="URL", dest="H"),
+        Option("--attributes",
+               help="Comma separated list of attributes to show for each user",
+               type=str),
+        Option("--output-format", type="choice",
+               choices=["plain", "csv", "json"], default="plain",
+               help=output_format_help),
         ]
 
     takes_optiongroups = {
@@ -278,18 +474,28 @@ class cmd_user_list(Command):
         "versionopts": options.VersionOptions,
         }
 
-    def run(self, sambaopts=None, credopts=None, versionopts=None, H=None):
+    def run(self, sambaopts=None, credopts=None, versionopts=None, H=None,
+            attributes=None, output_format="plain"):
         lp = sambaopts.get_loadparm()
         creds = credopts.get_credentials(lp, fallback_machine=True)
 
         samdb = SamDB(url=H, session_info=system_session(),
             credentials=creds, lp=lp)
 
+        if attributes is not None:
+            attrs = [a.strip() for a in attributes.split(",") if a.strip()]
+        else:
+            attrs = ["sAMAccountName"]
+
         domain_dn = samdb.domain_dn()
-        res = samdb.search(domain_dn, scope=ldb.SCOPE_SUBTREE,
+        pages = samdb.search_pages(domain_dn, scope=ldb.SCOPE_SUBTREE,
                     expression=("(&(objectClass=user)(userAccountControl:{0!s}:={1:d}))".format(ldb.OID_COMPARATOR_AND, dsdb.UF_NORMAL_ACCOUNT)),
-                    attrs=["samaccountname"])
-        if (len(res) == 0):
+                    attrs=attrs)
+        res = itertools.chain.from_iterable(pages)
+
+        if attributes is not None or output_format != "plain":
+            netcmd_write_entries(samdb, self.outf, res, attrs,
+                                 output_format=output_format)
             return
 
         for msg in res:
@@ -619,6 +825,7 @@ class cmd_user(SuperCommand):
     subcommands["delete"] = cmd_user_delete()
     subcommands["disable"] = cmd_user_disable()
     subcommands["enable"] = cmd_user_enable()
+    subcommands["import"] = cmd_user_import()
     subcommands["list"] = cmd_user_list()
     subcommands["setexpiry"] = cmd_user_setexpiry()
     subcommands["password"] = cmd_user_password()
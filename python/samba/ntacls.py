@@ -63,31 +63,50 @@ def getdosinfo(lp, file):
 
     return ndr_unpack(xattr.DOSATTRIB, attribute)
 
+def _get_ntacl_blob(backend_obj, dbname, file):
+    if dbname is not None:
+        try:
+            return backend_obj.wrap_getxattr(dbname, file,
+                                             xattr.XATTR_NTACL_NAME)
+        except Exception:
+            # FIXME: Don't catch all exceptions, just those related to opening
+            # xattrdb
+            print "Fail to open {0!s}".format(dbname)
+    return samba.xattr_native.wrap_getxattr(file, xattr.XATTR_NTACL_NAME)
+
+def _set_ntacl_blob(backend_obj, dbname, file, blob):
+    if dbname is not None:
+        try:
+            backend_obj.wrap_setxattr(dbname,
+                                      file, xattr.XATTR_NTACL_NAME, blob)
+            return
+        except Exception:
+            # FIXME: Don't catch all exceptions, just those related to opening
+            # xattrdb
+            print "Fail to open {0!s}".format(dbname)
+    samba.xattr_native.wrap_setxattr(file, xattr.XATTR_NTACL_NAME, blob)
+
+def _ntacl_to_sd(attribute):
+    ntacl = ndr_unpack(xattr.NTACL, attribute)
+    if ntacl.version == 1:
+        return ntacl.info
+    elif ntacl.version == 2:
+        return ntacl.info.sd
+    elif ntacl.version == 3:
+        return ntacl.info.sd
+    elif ntacl.version == 4:
+        return ntacl.info.sd
+
+def _pack_ntacl(sd):
+    ntacl = xattr.NTACL()
+    ntacl.version = 1
+    ntacl.info = sd
+    return ndr_pack(ntacl)
+
 def getntacl(lp, file, backend=None, eadbfile=None, direct_db_access=True, service=None):
     if direct_db_access:
         (backend_obj, dbname) = checkset_backend(lp, backend, eadbfile)
-        if dbname is not None:
-            try:
-                attribute = backend_obj.wrap_getxattr(dbname, file,
-                                                      xattr.XATTR_NTACL_NAME)
-            except Exception:
-                # FIXME: Don't catch all exceptions, just those related to opening
-                # xattrdb
-                print "Fail to open {0!s}".format(dbname)
-                attribute = samba.xattr_native.wrap_getxattr(file,
-                                                             xattr.XATTR_NTACL_NAME)
-        else:
-            attribute = samba.xattr_native.wrap_getxattr(file,
-                                                         xattr.XATTR_NTACL_NAME)
-        ntacl = ndr_unpack(xattr.NTACL, attribute)
-        if ntacl.version == 1:
-            return ntacl.info
-        elif ntacl.version == 2:
-            return ntacl.info.sd
-        elif ntacl.version == 3:
-            return ntacl.info.sd
-        elif ntacl.version == 4:
-            return ntacl.info.sd
+        return _ntacl_to_sd(_get_ntacl_blob(backend_obj, dbname, file))
     else:
         return smbd.get_nt_acl(file, security.SECINFO_OWNER | security.SECINFO_GROUP | security.SECINFO_DACL | security.SECINFO_SACL, service=service)
 
@@ -122,7 +141,7 @@ def setntacl(lp, file, sddl, domsid, backend=None, eadbfile=None, use_ntvfs=True
                 if ((admin_type == idmap.ID_TYPE_UID) or (admin_type == idmap.ID_TYPE_BOTH)):
 
                     # Set it, changing the owner to 'administrator' rather than domain admins
-                    sd2 = sd
+                    sd2 = ndr_unpack(security.descriptor, ndr_pack(sd))
                     sd2.owner_sid = administrator
 
                     smbd.set_nt_acl(file, security.SECINFO_OWNER |security.SECINFO_GROUP | security.SECINFO_DACL | security.SECINFO_SACL, sd2, service=service)
@@ -142,24 +161,70 @@ def setntacl(lp, file, sddl, domsid, backend=None, eadbfile=None, use_ntvfs=True
 
     if use_ntvfs:
         (backend_obj, dbname) = checkset_backend(lp, backend, eadbfile)
-        ntacl = xattr.NTACL()
-        ntacl.version = 1
-        ntacl.info = sd
-        if dbname is not None:
+        _set_ntacl_blob(backend_obj, dbname, file, _pack_ntacl(sd))
+    else:
+        smbd.set_nt_acl(file, security.SECINFO_OWNER | security.SECINFO_GROUP | security.SECINFO_DACL | security.SECINFO_SACL, sd, service=service)
+
+
+class NtaclContext(object):
+    """State shared by the setntacl()/getntacl() calls of a walk over
+    many files.
+
+    Each SDDL string is parsed, and its NTACL blob packed, only once, and
+    the xattr_tdb or posix:eadb database is held open until close().
+    """
+
+    def __init__(self, lp, domsid, backend=None, eadbfile=None,
+                 use_ntvfs=True, skip_invalid_chown=False, passdb=None,
+                 service=None, direct_db_access=True):
+        self.lp = lp
+        self.domsid = str(domsid)
+        self.sid = security.dom_sid(self.domsid)
+        self.use_ntvfs = use_ntvfs
+        self.skip_invalid_chown = skip_invalid_chown
+        self.passdb = passdb
+        self.service = service
+        self.direct_db_access = direct_db_access
+        self.descriptors = {}
+
+        (self.backend_obj, self.dbname) = checkset_backend(lp, backend,
+                                                           eadbfile)
+        self.held = False
+        if self.dbname is not None:
             try:
-                backend_obj.wrap_setxattr(dbname,
-                                          file, xattr.XATTR_NTACL_NAME, ndr_pack(ntacl))
+                self.backend_obj.hold_db(self.dbname)
+                self.held = True
             except Exception:
-                # FIXME: Don't catch all exceptions, just those related to opening
-                # xattrdb
-                print "Fail to open {0!s}".format(dbname)
-                samba.xattr_native.wrap_setxattr(file, xattr.XATTR_NTACL_NAME,
-                                                 ndr_pack(ntacl))
+                # each call falls back as setntacl()/getntacl() do
+                pass
+
+    def close(self):
+        if self.held:
+            self.backend_obj.release_db()
+            self.held = False
+
+    def descriptor(self, sddl):
+        """Return the security descriptor and the packed NTACL for sddl"""
+        if sddl not in self.descriptors:
+            sd = security.descriptor.from_sddl(sddl, self.sid)
+            self.descriptors[sddl] = (sd, _pack_ntacl(sd))
+        return self.descriptors[sddl]
+
+    def setntacl(self, file, sddl):
+        (sd, blob) = self.descriptor(sddl)
+        if self.use_ntvfs:
+            _set_ntacl_blob(self.backend_obj, self.dbname, file, blob)
         else:
-            samba.xattr_native.wrap_setxattr(file, xattr.XATTR_NTACL_NAME,
-                                             ndr_pack(ntacl))
-    else:
-        smbd.set_nt_acl(file, security.SECINFO_OWNER | security.SECINFO_GROUP | security.SECINFO_DACL | security.SECINFO_SACL, sd, service=service)
+            setntacl(self.lp, file, sd, self.domsid, use_ntvfs=False,
+                     skip_invalid_chown=self.skip_invalid_chown,
+                     passdb=self.passdb, service=self.service)
+
+    def getntacl(self, file):
+        if self.direct_db_access:
+            return _ntacl_to_sd(_get_ntacl_blob(self.backend_obj,
+                                                self.dbname, file))
+        return getntacl(self.lp, file, direct_db_access=False,
+                        service=self.service)
 
 
 def ldapmask2filemask(ldm):
@@ -68,7 +68,8 @@ from samba.dsdb import (
     )
 from samba.idmap import IDmapDB
 from samba.ms_display_specifiers import read_ms_ldif
-from samba.ntacls import setntacl, getntacl, dsacl2fsacl
+from samba.ntacls import getntacl, dsacl2fsacl, NtaclContext
+from samba.provision.sysvol import SysvolAclMap, run_units, remove_checkpoint
 from samba.ndr import ndr_pack, ndr_unpack
 from samba.provision.backend import (
     ExistingBackend,
@@ -1481,18 +1482,29 @@ SYSVOL_ACL = "O:LAG:BAD:P(A;OICI;0x001f01ff;;;BA)(A;OICI;0x001200a9;;;SO)(A;OICI
 POLICIES_ACL = "O:LAG:BAD:P(A;OICI;0x001f01ff;;;BA)(A;OICI;0x001200a9;;;SO)(A;OICI;0x001f01ff;;;SY)(A;OICI;0x001200a9;;;AU)(A;OICI;0x001301bf;;;PA)"
 SYSVOL_SERVICE="sysvol"
 
-def set_dir_acl(path, acl, lp, domsid, use_ntvfs, passdb, service=SYSVOL_SERVICE):
-    setntacl(lp, path, acl, domsid, use_ntvfs=use_ntvfs, skip_invalid_chown=True, passdb=passdb, service=service)
+def set_dir_acl(path, acl, lp, domsid, use_ntvfs, passdb, service=SYSVOL_SERVICE,
+                ntacl_ctx=None):
+    if ntacl_ctx is None:
+        ntacl_ctx = NtaclContext(lp, domsid, use_ntvfs=use_ntvfs,
+                                 skip_invalid_chown=True, passdb=passdb,
+                                 service=service)
+        try:
+            set_dir_acl(path, acl, lp, domsid, use_ntvfs, passdb,
+                        service=service, ntacl_ctx=ntacl_ctx)
+        finally:
+            ntacl_ctx.close()
+        return
+
+    ntacl_ctx.setntacl(path, acl)
     for root, dirs, files in os.walk(path, topdown=False):
         for name in files:
-            setntacl(lp, os.path.join(root, name), acl, domsid,
-                    use_ntvfs=use_ntvfs, skip_invalid_chown=True, passdb=passdb, service=service)
+            ntacl_ctx.setntacl(os.path.join(root, name), acl)
         for name in dirs:
-            setntacl(lp, os.path.join(root, name), acl, domsid,
-                    use_ntvfs=use_ntvfs, skip_invalid_chown=True, passdb=passdb, service=service)
+            ntacl_ctx.setntacl(os.path.join(root, name), acl)
 
 
-def set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp, use_ntvfs, passdb):
+def set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp, use_ntvfs, passdb,
+        ntacl_ctx=None):
     """Set ACL on the sysvol/<dnsname>/Policies folder and the policy
     folders beneath.
 
@@ -1502,12 +1514,22 @@ def set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp, use_ntvfs, p
     :param domaindn: The DN of the domain (ie. DC=...)
     :param samdb: An LDB object on the SAM db
     :param lp: an LP object
+    :param ntacl_ctx: an NtaclContext to reuse, or None
     """
+    if ntacl_ctx is None:
+        ntacl_ctx = NtaclContext(lp, domainsid, use_ntvfs=use_ntvfs,
+                                 skip_invalid_chown=True, passdb=passdb,
+                                 service=SYSVOL_SERVICE)
+        try:
+            set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
+                         use_ntvfs, passdb, ntacl_ctx=ntacl_ctx)
+        finally:
+            ntacl_ctx.close()
+        return
 
     # Set ACL for GPO root folder
     root_policy_path = os.path.join(sysvol, dnsdomain, "Policies")
-    setntacl(lp, root_policy_path, POLICIES_ACL, str(domainsid),
-            use_ntvfs=use_ntvfs, skip_invalid_chown=True, passdb=passdb, service=SYSVOL_SERVICE)
+    ntacl_ctx.setntacl(root_policy_path, POLICIES_ACL)
 
     res = samdb.search(base="CN=Policies,CN=System,{0!s}".format((domaindn)),
                         attrs=["cn", "nTSecurityDescriptor"],
@@ -1519,11 +1541,34 @@ def set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp, use_ntvfs, p
         policy_path = getpolicypath(sysvol, dnsdomain, str(policy["cn"]))
         set_dir_acl(policy_path, dsacl2fsacl(acl, domainsid), lp,
                     str(domainsid), use_ntvfs,
-                    passdb=passdb)
+                    passdb=passdb, ntacl_ctx=ntacl_ctx)
+
+
+def sysvol_acl_map(sysvol, dnsdomain, domainsid, domaindn, samdb, default):
+    """Return the ACLs that setsysvolacl sets, as a SysvolAclMap
+
+    :param default: The ACL for paths outside the policy folders, or None
+    """
+    root_policy_path = os.path.join(sysvol, dnsdomain, "Policies")
+    res = samdb.search(base="CN=Policies,CN=System,{0!s}".format((domaindn)),
+                        attrs=["cn", "nTSecurityDescriptor"],
+                        expression="", scope=ldb.SCOPE_ONELEVEL)
+
+    subtrees = {}
+    for policy in res:
+        acl = ndr_unpack(security.descriptor,
+                         str(policy["nTSecurityDescriptor"])).as_sddl()
+        policy_path = getpolicypath(sysvol, dnsdomain, str(policy["cn"]))
+        if not os.path.isdir(policy_path):
+            raise ProvisioningError('GPO directory {0!s} not found!'.format(policy_path))
+        subtrees[policy_path] = dsacl2fsacl(acl, domainsid)
+
+    return SysvolAclMap(default, exact={root_policy_path: POLICIES_ACL},
+                        subtrees=subtrees)
 
 
 def setsysvolacl(samdb, netlogon, sysvol, uid, gid, domainsid, dnsdomain,
-        domaindn, lp, use_ntvfs):
+        domaindn, lp, use_ntvfs, jobs=1, checkpoint=None, logger=None):
     """Set the ACL for the sysvol share and the subfolders
 
     :param samdb: An LDB object on the SAM db
@@ -1534,6 +1579,10 @@ def setsysvolacl(samdb, netlogon, sysvol, uid, gid, domainsid, dnsdomain,
     :param domainsid: The SID of the domain
     :param dnsdomain: The DNS name of the domain
     :param domaindn: The DN of the domain (ie. DC=...)
+    :param jobs: Number of processes to share the tree between
+    :param checkpoint: Prefix of checkpoint files to resume from and
+        record progress in, or None
+    :param logger: Logger for progress reports, or None
     """
     s4_passdb = None
 
@@ -1595,26 +1644,46 @@ def setsysvolacl(samdb, netlogon, sysvol, uid, gid, domainsid, dnsdomain,
     else:
         canchown = True
 
-    # Set the SYSVOL_ACL on the sysvol folder and subfolder (first level)
-    setntacl(lp,sysvol, SYSVOL_ACL, str(domainsid), use_ntvfs=use_ntvfs,
-             skip_invalid_chown=True, passdb=s4_passdb,
-             service=SYSVOL_SERVICE)
-    for root, dirs, files in os.walk(sysvol, topdown=False):
-        for name in files:
-            if use_ntvfs and canchown:
-                os.chown(os.path.join(root, name), -1, gid)
-            setntacl(lp, os.path.join(root, name), SYSVOL_ACL, str(domainsid),
-                     use_ntvfs=use_ntvfs, skip_invalid_chown=True,
-                     passdb=s4_passdb, service=SYSVOL_SERVICE)
-        for name in dirs:
-            if use_ntvfs and canchown:
-                os.chown(os.path.join(root, name), -1, gid)
-            setntacl(lp, os.path.join(root, name), SYSVOL_ACL, str(domainsid),
-                     use_ntvfs=use_ntvfs, skip_invalid_chown=True,
-                     passdb=s4_passdb, service=SYSVOL_SERVICE)
-
-    # Set acls on Policy folder and policies folders
-    set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp, use_ntvfs, passdb=s4_passdb)
+    if jobs > 1 or checkpoint is not None:
+        # Each path is set once, to its final ACL, by a pool of workers
+        acl_map = sysvol_acl_map(sysvol, dnsdomain, domainsid, domaindn,
+                                 samdb, SYSVOL_ACL)
+        if use_ntvfs and canchown:
+            chown_gid = gid
+        else:
+            chown_gid = None
+        run_units("set", "set", sysvol, acl_map, (lp, domainsid),
+                  dict(use_ntvfs=use_ntvfs, skip_invalid_chown=True,
+                       passdb=s4_passdb, service=SYSVOL_SERVICE),
+                  jobs=jobs, chown_gid=chown_gid, checkpoint=checkpoint,
+                  logger=logger)
+        if checkpoint is not None:
+            remove_checkpoint(checkpoint)
+        return
+
+    # One context for the whole walk: the SDDL is parsed once and the
+    # xattr database kept open
+    ntacl_ctx = NtaclContext(lp, domainsid, use_ntvfs=use_ntvfs,
+                             skip_invalid_chown=True, passdb=s4_passdb,
+                             service=SYSVOL_SERVICE)
+    try:
+        # Set the SYSVOL_ACL on the sysvol folder and subfolder (first level)
+        ntacl_ctx.setntacl(sysvol, SYSVOL_ACL)
+        for root, dirs, files in os.walk(sysvol, topdown=False):
+            for name in files:
+                if use_ntvfs and canchown:
+                    os.chown(os.path.join(root, name), -1, gid)
+                ntacl_ctx.setntacl(os.path.join(root, name), SYSVOL_ACL)
+            for name in dirs:
+                if use_ntvfs and canchown:
+                    os.chown(os.path.join(root, name), -1, gid)
+                ntacl_ctx.setntacl(os.path.join(root, name), SYSVOL_ACL)
+
+        # Set acls on Policy folder and policies folders
+        set_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
+                     use_ntvfs, passdb=s4_passdb, ntacl_ctx=ntacl_ctx)
+    finally:
+        ntacl_ctx.close()
 
 def acl_type(direct_db_access):
     if direct_db_access:
@@ -1622,16 +1691,25 @@ def acl_type(direct_db_access):
     else:
         return "VFS"
 
-def check_dir_acl(path, acl, lp, domainsid, direct_db_access):
-    fsacl = getntacl(lp, path, direct_db_access=direct_db_access, service=SYSVOL_SERVICE)
+def check_dir_acl(path, acl, lp, domainsid, direct_db_access, ntacl_ctx=None):
+    if ntacl_ctx is None:
+        ntacl_ctx = NtaclContext(lp, domainsid, service=SYSVOL_SERVICE,
+                                 direct_db_access=direct_db_access)
+        try:
+            check_dir_acl(path, acl, lp, domainsid, direct_db_access,
+                          ntacl_ctx=ntacl_ctx)
+        finally:
+            ntacl_ctx.close()
+        return
+
+    fsacl = ntacl_ctx.getntacl(path)
     fsacl_sddl = fsacl.as_sddl(domainsid)
     if fsacl_sddl != acl:
         raise ProvisioningError('{0!s} ACL on GPO directory {1!s} {2!s} does not match expected value {3!s} from GPO object'.format(acl_type(direct_db_access), path, fsacl_sddl, acl))
 
     for root, dirs, files in os.walk(path, topdown=False):
         for name in files:
-            fsacl = getntacl(lp, os.path.join(root, name),
-                             direct_db_access=direct_db_access, service=SYSVOL_SERVICE)
+            fsacl = ntacl_ctx.getntacl(os.path.join(root, name))
             if fsacl is None:
                 raise ProvisioningError('{0!s} ACL on GPO file {1!s} {2!s} not found!'.format(acl_type(direct_db_access), os.path.join(root, name)))
             fsacl_sddl = fsacl.as_sddl(domainsid)
@@ -1639,8 +1717,7 @@ def check_dir_acl(path, acl, lp, domainsid, direct_db_access):
                 raise ProvisioningError('{0!s} ACL on GPO file {1!s} {2!s} does not match expected value {3!s} from GPO object'.format(acl_type(direct_db_access), os.path.join(root, name), fsacl_sddl, acl))
 
         for name in dirs:
-            fsacl = getntacl(lp, os.path.join(root, name),
-                             direct_db_access=direct_db_access, service=SYSVOL_SERVICE)
+            fsacl = ntacl_ctx.getntacl(os.path.join(root, name))
             if fsacl is None:
                 raise ProvisioningError('{0!s} ACL on GPO directory {1!s} {2!s} not found!'.format(acl_type(direct_db_access), os.path.join(root, name)))
             fsacl_sddl = fsacl.as_sddl(domainsid)
@@ -1649,7 +1726,7 @@ def check_dir_acl(path, acl, lp, domainsid, direct_db_access):
 
 
 def check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
-        direct_db_access):
+        direct_db_access, ntacl_ctx=None):
     """Set ACL on the sysvol/<dnsname>/Policies folder and the policy
     folders beneath.
 
@@ -1659,12 +1736,21 @@ def check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
     :param domaindn: The DN of the domain (ie. DC=...)
     :param samdb: An LDB object on the SAM db
     :param lp: an LP object
+    :param ntacl_ctx: an NtaclContext to reuse, or None
     """
+    if ntacl_ctx is None:
+        ntacl_ctx = NtaclContext(lp, domainsid, service=SYSVOL_SERVICE,
+                                 direct_db_access=direct_db_access)
+        try:
+            check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
+                           direct_db_access, ntacl_ctx=ntacl_ctx)
+        finally:
+            ntacl_ctx.close()
+        return
 
     # Set ACL for GPO root folder
     root_policy_path = os.path.join(sysvol, dnsdomain, "Policies")
-    fsacl = getntacl(lp, root_policy_path,
-                     direct_db_access=direct_db_access, service=SYSVOL_SERVICE)
+    fsacl = ntacl_ctx.getntacl(root_policy_path)
     if fsacl is None:
         raise ProvisioningError('DB ACL on policy root {0!s} {1!s} not found!'.format(acl_type(direct_db_access), root_policy_path))
     fsacl_sddl = fsacl.as_sddl(domainsid)
@@ -1679,11 +1765,11 @@ def check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
                          str(policy["nTSecurityDescriptor"])).as_sddl()
         policy_path = getpolicypath(sysvol, dnsdomain, str(policy["cn"]))
         check_dir_acl(policy_path, dsacl2fsacl(acl, domainsid), lp,
-                      domainsid, direct_db_access)
+                      domainsid, direct_db_access, ntacl_ctx=ntacl_ctx)
 
 
 def checksysvolacl(samdb, netlogon, sysvol, domainsid, dnsdomain, domaindn,
-    lp):
+    lp, jobs=1, checkpoint=None, logger=None):
     """Set the ACL for the sysvol share and the subfolders
 
     :param samdb: An LDB object on the SAM db
@@ -1694,6 +1780,10 @@ def checksysvolacl(samdb, netlogon, sysvol, domainsid, dnsdomain, domaindn,
     :param domainsid: The SID of the domain
     :param dnsdomain: The DNS name of the domain
     :param domaindn: The DN of the domain (ie. DC=...)
+    :param jobs: Number of processes to share the tree between
+    :param checkpoint: Prefix of checkpoint files to resume from and
+        record progress in, or None
+    :param logger: Logger for progress reports, or None
     """
 
     # This will ensure that the smbd code we are running when setting ACLs is initialised with the smb.conf
@@ -1727,8 +1817,28 @@ def checksysvolacl(samdb, netlogon, sysvol, domainsid, dnsdomain, domaindn,
                 raise ProvisioningError('{0!s} ACL on sysvol directory {1!s} {2!s} does not match expected value {3!s} from provision'.format(acl_type(direct_db_access), dir_path, fsacl_sddl, SYSVOL_ACL))
 
         # Check acls on Policy folder and policies folders
-        check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
-                direct_db_access)
+        if jobs > 1 or checkpoint is not None:
+            acl_map = sysvol_acl_map(sysvol, dnsdomain, domainsid, domaindn,
+                                     samdb, None)
+            mismatches = run_units("check-{0!s}".format(acl_type(direct_db_access)),
+                                   "check",
+                                   os.path.join(sysvol, dnsdomain, "Policies"),
+                                   acl_map, (lp, domainsid),
+                                   dict(service=SYSVOL_SERVICE,
+                                        direct_db_access=direct_db_access),
+                                   jobs=jobs, checkpoint=checkpoint,
+                                   logger=logger)
+            if mismatches:
+                (path, acl, fsacl_sddl) = sorted(mismatches)[0]
+                if fsacl_sddl is None:
+                    raise ProvisioningError('{0!s} ACL on {1!s} not found! ({2:d} paths with wrong ACLs)'.format(acl_type(direct_db_access), path, len(mismatches)))
+                raise ProvisioningError('{0!s} ACL on {1!s} {2!s} does not match expected value {3!s} ({4:d} paths with wrong ACLs)'.format(acl_type(direct_db_access), path, fsacl_sddl, acl, len(mismatches)))
+        else:
+            check_gpos_acl(sysvol, dnsdomain, domainsid, domaindn, samdb, lp,
+                    direct_db_access)
+
+    if checkpoint is not None:
+        remove_checkpoint(checkpoint)
 
 
 def interface_ips_v4(lp):
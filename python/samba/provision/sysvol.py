@@ -0,0 +1,291 @@
+# Unix SMB/CIFS implementation.
+# Parallel, resumable setting and checking of sysvol ACLs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Parallel, resumable setting and checking of sysvol ACLs.
+
+The tree is split into units: directories near the top are handled on
+their own (the directory and the files in it), and the subtrees below them
+as a whole.  Units are shared between a pool of worker processes, each
+with its own NtaclContext.  When a checkpoint is given, each worker
+appends the units it has finished to its own checkpoint file, and a later
+run with the same checkpoint skips them.
+"""
+
+__docformat__ = "restructuredText"
+
+import glob
+import multiprocessing
+import os
+import time
+
+from samba.ntacls import NtaclContext
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def scan_dir(path):
+    """List a directory.
+
+    :return: tuple of the subdirectories to descend into, and the other
+        entries (including symlinks to directories, which are not followed)
+    """
+    dirs = []
+    others = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            else:
+                others.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            fullname = os.path.join(path, name)
+            if os.path.isdir(fullname) and not os.path.islink(fullname):
+                dirs.append(name)
+            else:
+                others.append(name)
+    return (dirs, others)
+
+
+def unit_paths(path, recursive):
+    """Yield the paths of a unit, bottom up: for a recursive unit the
+    whole subtree, otherwise the directory and the entries that are not
+    subdirectories.  The directory itself comes last."""
+    (dirs, others) = scan_dir(path)
+    if recursive:
+        for name in dirs:
+            for p in unit_paths(os.path.join(path, name), True):
+                yield p
+    for name in others:
+        yield os.path.join(path, name)
+    yield path
+
+
+def split_tree(top, min_units, max_depth=4):
+    """Split the tree below top into units of work.
+
+    Directories are expanded breadth first until there are at least
+    min_units subtrees or max_depth is reached.
+
+    :return: list of (path, recursive) tuples
+    """
+    units = []
+    frontier = [top]
+    depth = 0
+    while frontier and len(frontier) < min_units and depth < max_depth:
+        expanded = []
+        for path in frontier:
+            units.append((path, False))
+            (dirs, others) = scan_dir(path)
+            expanded.extend(os.path.join(path, name) for name in sorted(dirs))
+        frontier = expanded
+        depth += 1
+    units.extend((path, True) for path in frontier)
+    return units
+
+
+class SysvolAclMap(object):
+    """The ACL each path in sysvol should have.
+
+    :param default: SDDL for paths not otherwise listed, or None if they
+        are not to be touched
+    :param exact: dict of path to SDDL, for that path alone
+    :param subtrees: dict of directory to SDDL, for the directory and
+        everything below it
+    """
+
+    def __init__(self, default, exact=None, subtrees=None):
+        self.default = default
+        self.exact = dict((os.path.normpath(p), sddl)
+                          for (p, sddl) in (exact or {}).items())
+        self.subtrees = dict((os.path.normpath(p), sddl)
+                             for (p, sddl) in (subtrees or {}).items())
+
+    def acl_for(self, path):
+        if path in self.exact:
+            return self.exact[path]
+        p = path
+        while True:
+            if p in self.subtrees:
+                return self.subtrees[p]
+            parent = os.path.dirname(p)
+            if parent == p:
+                return self.default
+            p = parent
+
+
+def checkpoint_key(tag, unit):
+    (path, recursive) = unit
+    return "{0!s} {1!s} {2!s}".format(tag, recursive and "R" or "D", path)
+
+
+def read_checkpoint(checkpoint):
+    """Return the set of unit keys recorded in the checkpoint files"""
+    done = set()
+    for name in glob.glob(checkpoint + ".*"):
+        f = open(name, "r")
+        try:
+            for line in f:
+                if line.endswith("\n"):
+                    done.add(line[:-1])
+        finally:
+            f.close()
+    return done
+
+
+def remove_checkpoint(checkpoint):
+    for name in glob.glob(checkpoint + ".*"):
+        os.unlink(name)
+
+
+# State of a worker process, set up by _worker_init()
+_worker = {}
+
+
+def _worker_init(tag, mode, acl_map, ctx_args, ctx_kwargs, chown_gid,
+                 checkpoint):
+    _worker["tag"] = tag
+    _worker["mode"] = mode
+    _worker["acl_map"] = acl_map
+    _worker["ctx"] = NtaclContext(*ctx_args, **ctx_kwargs)
+    _worker["chown_gid"] = chown_gid
+    if checkpoint is not None:
+        _worker["checkpoint"] = open("{0!s}.{1:d}".format(checkpoint,
+                                                         os.getpid()), "a")
+    else:
+        _worker["checkpoint"] = None
+
+
+def _worker_close():
+    _worker["ctx"].close()
+    if _worker["checkpoint"] is not None:
+        _worker["checkpoint"].close()
+
+
+def _worker_unit(unit):
+    """Set or check the ACLs of one unit.
+
+    :return: tuple of the unit, the number of paths handled and a list of
+        (path, expected SDDL, found SDDL or None) mismatches
+    """
+    ctx = _worker["ctx"]
+    acl_map = _worker["acl_map"]
+    chown_gid = _worker["chown_gid"]
+    count = 0
+    mismatches = []
+    for path in unit_paths(*unit):
+        sddl = acl_map.acl_for(path)
+        if sddl is None:
+            continue
+        if _worker["mode"] == "set":
+            if chown_gid is not None:
+                os.chown(path, -1, chown_gid)
+            ctx.setntacl(path, sddl)
+        else:
+            fsacl = ctx.getntacl(path)
+            if fsacl is not None:
+                fsacl = fsacl.as_sddl(ctx.sid)
+            if fsacl != sddl:
+                mismatches.append((path, sddl, fsacl))
+        count += 1
+
+    # a unit with wrong ACLs must be checked again on the next run
+    if _worker["checkpoint"] is not None and not mismatches:
+        _worker["checkpoint"].write(checkpoint_key(_worker["tag"], unit) + "\n")
+        _worker["checkpoint"].flush()
+    return (unit, count, mismatches)
+
+
+def _pool_unit(unit):
+    # name the unit in errors, as they are re-raised in the parent without
+    # the worker's traceback
+    try:
+        return _worker_unit(unit)
+    except Exception, e:
+        raise Exception("{0!s}: {1!s}".format(unit[0], e))
+
+
+def run_units(tag, mode, top, acl_map, ctx_args, ctx_kwargs, jobs=1,
+              chown_gid=None, checkpoint=None, logger=None,
+              progress_interval=10):
+    """Set or check the ACLs of the tree below top.
+
+    :param tag: name of this pass in the checkpoint files
+    :param mode: "set" or "check"
+    :param acl_map: a SysvolAclMap
+    :param ctx_args: positional arguments for each worker's NtaclContext
+    :param ctx_kwargs: keyword arguments for each worker's NtaclContext
+    :param jobs: number of worker processes
+    :param chown_gid: group to give each path before setting its ACL
+    :param checkpoint: prefix of the checkpoint files, or None
+    :param logger: logger for progress reports
+    :return: list of (path, expected SDDL, found SDDL or None) mismatches
+    """
+    units = split_tree(os.path.normpath(top), jobs * 4)
+    if checkpoint is not None:
+        done = read_checkpoint(checkpoint)
+        todo = [u for u in units if checkpoint_key(tag, u) not in done]
+        if logger is not None and len(todo) != len(units):
+            logger.info("{0!s}: resuming, {1:d} of {2:d} units already done".format(
+                tag, len(units) - len(todo), len(units)))
+        units = todo
+
+    initargs = (tag, mode, acl_map, ctx_args, ctx_kwargs, chown_gid,
+                checkpoint)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _worker_init, initargs)
+        results = pool.imap_unordered(_pool_unit, units)
+    else:
+        pool = None
+        _worker_init(*initargs)
+        results = (_worker_unit(u) for u in units)
+
+    mismatches = []
+    paths = 0
+    start = time.time()
+    last = start
+    try:
+        for (i, (unit, count, unit_mismatches)) in enumerate(results):
+            paths += count
+            mismatches.extend(unit_mismatches)
+            now = time.time()
+            if logger is not None and (now - last >= progress_interval or
+                                       i + 1 == len(units)):
+                last = now
+                rate = paths / max(now - start, 0.001)
+                logger.info("{0!s}: {1:d}/{2:d} units, {3:d} paths, "
+                            "{4:.0f} paths/s".format(tag, i + 1, len(units),
+                                                     paths, rate))
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is None:
+            _worker_close()
+    if pool is not None:
+        # the workers' databases and checkpoint files close as they exit
+        pool.close()
+        pool.join()
+
+    return mismatches
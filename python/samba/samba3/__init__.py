@@ -76,11 +76,17 @@ class Registry(DbDatabase):
     """
     def __len__(self):
         """Return the number of keys."""
-        return len(self.keys())
+        return sum(1 for k in self.iterkeys())
+
+    def iterkeys(self):
+        """Iterate over all the keys."""
+        for k in self.db.iterkeys():
+            if not k.startswith(REGISTRY_VALUE_PREFIX):
+                yield k.rstrip("\x00")
 
     def keys(self):
         """Return list with all the keys."""
-        return [k.rstrip("\x00") for k in self.db.iterkeys() if not k.startswith(REGISTRY_VALUE_PREFIX)]
+        return list(self.iterkeys())
 
     def subkeys(self, key):
         """Retrieve the subkeys for the specified key.
@@ -98,31 +104,36 @@ class Registry(DbDatabase):
         assert len(keys) == num
         return keys
 
-    def values(self, key):
-        """Return a dictionary with the values set for a specific key.
+    def itervalues(self, key):
+        """Iterate over the values set for a specific key.
+
+        The value records are parsed in place, so this takes time linear
+        in the size of the key's values.
 
         :param key: Key to retrieve values for.
-        :return: Dictionary with value names as key, tuple with type and
-            data as value."""
+        :return: Iterator over tuples of value name and a tuple with type
+            and data."""
         data = self.db.get("{0!s}/{1!s}\x00".format(REGISTRY_VALUE_PREFIX, key))
         if data is None:
-            return {}
-        ret = {}
-        (num, ) = struct.unpack("<L", data[0:4])
-        data = data[4:]
+            return
+        (num, ) = struct.unpack_from("<L", data, 0)
+        offset = 4
         for i in range(num):
             # Value name
-            (name, data) = data.split("\0", 1)
-
-            (type, ) = struct.unpack("<L", data[0:4])
-            data = data[4:]
-            (value_len, ) = struct.unpack("<L", data[0:4])
-            data = data[4:]
+            end = data.index("\0", offset)
+            name = data[offset:end]
+            (type, value_len) = struct.unpack_from("<LL", data, end + 1)
+            offset = end + 9
+            yield (name, (type, data[offset:offset + value_len]))
+            offset += value_len
 
-            ret[name] = (type, data[:value_len])
-            data = data[value_len:]
+    def values(self, key):
+        """Return a dictionary with the values set for a specific key.
 
-        return ret
+        :param key: Key to retrieve values for.
+        :return: Dictionary with value names as key, tuple with type and
+            data as value."""
+        return dict(self.itervalues(key))
 
 
 # High water mark keys
@@ -35,12 +35,30 @@ from samba.common import normalise_int32
 __docformat__ = "restructuredText"
 
 
+def _fold_name(name):
+    """Folds the case of an account name for comparison
+
+    The server compares names with full UTF-8 case folding, so the name
+    is decoded first; str.lower() only folds ASCII.
+    """
+    if isinstance(name, str):
+        try:
+            name = name.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    return name.lower()
+
+
 class SamDB(samba.Ldb):
     """The SAM database."""
 
     hash_oid_name = {}
     hash_well_known = {}
 
+    # how many group members are looked up per search, and changed per
+    # modify, by add_remove_group_members()
+    member_batch_size = 500
+
     def __init__(self, url=None, lp=None, modules_dir=None, session_info=None,
                  credentials=None, flags=0, options=None, global_schema=True,
                  auto_connect=True, am_rodc=None):
@@ -237,10 +255,59 @@ pwdLastSet: 0
         else:
             self.transaction_commit()
 
+    def find_group_members(self, members):
+        """Finds the objects for a list of group member names
+
+        Each name must match the sAMAccountName or the CN of exactly
+        one object.  The names are looked up with one search per
+        member_batch_size names.  A name that none of the results
+        matches once case folded is looked up with a search of its own,
+        so the server decides whether it matches.
+
+        :param members: list of member names
+        :return: list of member DNs, in the order of the names
+        """
+        dns = []
+        for i in range(0, len(members), self.member_batch_size):
+            chunk = members[i:i + self.member_batch_size]
+            expression = "(|{0!s})".format("".join(
+                "(sAMAccountName={0!s})(CN={0!s})".format(ldb.binary_encode(x))
+                for x in chunk))
+            res = self.search(base=self.domain_dn(), scope=ldb.SCOPE_SUBTREE,
+                              expression=expression,
+                              attrs=["sAMAccountName", "cn"])
+            matches = {}
+            for msg in res:
+                names = set()
+                for attr in ("sAMAccountName", "cn"):
+                    if attr in msg:
+                        names.add(_fold_name(str(msg[attr][0])))
+                for name in names:
+                    matches.setdefault(name, []).append(msg.dn)
+
+            for member in chunk:
+                found = matches.get(_fold_name(member), [])
+                if not found:
+                    res = self.search(base=self.domain_dn(), scope=ldb.SCOPE_SUBTREE,
+                                      expression="(|(sAMAccountName={0!s})(CN={0!s}))".format(
+                                          ldb.binary_encode(member)),
+                                      attrs=[])
+                    found = [msg.dn for msg in res]
+                if len(found) != 1:
+                    raise Exception('Unable to find "{0!s}". Operation cancelled.'.format(member))
+                dns.append(found[0])
+        return dns
+
     def add_remove_group_members(self, groupname, members,
                                   add_members_operation=True):
         """Adds or removes group members
 
+        The members are changed with one modify per member_batch_size
+        members, inside a transaction.  Over LDAP transactions are not
+        supported, so if a modify fails the batches before it stay
+        applied; the error names the first and last member of the failed
+        batch.
+
         :param groupname: Name of the target group
         :param members: list of group members
         :param add_members_operation: Defines if its an add or remove
@@ -258,35 +325,40 @@ pwdLastSet: 0
                 raise Exception('Unable to find group "{0!s}"'.format(groupname))
             assert(len(targetgroup) == 1)
 
-            modified = False
-
-            addtargettogroup = """
-dn: {0!s}
-changetype: modify
-""".format((str(targetgroup[0].dn)))
-
-            for member in members:
-                targetmember = self.search(base=self.domain_dn(), scope=ldb.SCOPE_SUBTREE,
-                                    expression="(|(sAMAccountName={0!s})(CN={1!s}))".format(
-                    ldb.binary_encode(member), ldb.binary_encode(member)), attrs=[])
-
-                if len(targetmember) != 1:
-                    raise Exception('Unable to find "{0!s}". Operation cancelled.'.format(member))
-
-                if add_members_operation is True and (targetgroup[0].get('member') is None or str(targetmember[0].dn) not in targetgroup[0]['member']):
-                    modified = True
-                    addtargettogroup += """add: member
-member: {0!s}
-""".format((str(targetmember[0].dn)))
-
-                elif add_members_operation is False and (targetgroup[0].get('member') is not None and str(targetmember[0].dn) in targetgroup[0]['member']):
-                    modified = True
-                    addtargettogroup += """delete: member
-member: {0!s}
-""".format((str(targetmember[0].dn)))
-
-            if modified is True:
-                self.modify_ldif(addtargettogroup)
+            # compare DNs case insensitively, as the directory does
+            current = set()
+            if targetgroup[0].get('member') is not None:
+                current.update(str(x).lower() for x in targetgroup[0]['member'])
+            changes = []
+            for targetmember in self.find_group_members(members):
+                dn = str(targetmember).lower()
+                if add_members_operation is True and dn not in current:
+                    current.add(dn)
+                    changes.append(str(targetmember))
+                elif add_members_operation is False and dn in current:
+                    current.discard(dn)
+                    changes.append(str(targetmember))
+
+            if add_members_operation is True:
+                flag = ldb.FLAG_MOD_ADD
+                operation = "add"
+            else:
+                flag = ldb.FLAG_MOD_DELETE
+                operation = "remove"
+            for i in range(0, len(changes), self.member_batch_size):
+                batch = changes[i:i + self.member_batch_size]
+                m = ldb.Message()
+                m.dn = targetgroup[0].dn
+                m["member"] = ldb.MessageElement(batch, flag, "member")
+                try:
+                    self.modify(m)
+                except ldb.LdbError, (num, msg):
+                    raise Exception('Failed to {0!s} members {1:d} to {2:d} of {3:d} '
+                                    '("{4!s}" to "{5!s}"): {6!s}; without transactions '
+                                    '(over LDAP) the {7:d} members before them remain '
+                                    'changed'.format(operation, i + 1, i + len(batch),
+                                                     len(changes), batch[0], batch[-1],
+                                                     msg, i))
 
         except:
             self.transaction_cancel()
@@ -337,6 +409,54 @@ member: {0!s}
         :param unixhome: RFC2307 Unix home directory of the new user
         """
 
+        (ldbmessage, ldbmessage2) = self.newuser_messages(username,
+            useusernameascn=useusernameascn, userou=userou, surname=surname,
+            givenname=givenname, initials=initials, profilepath=profilepath,
+            scriptpath=scriptpath, homedrive=homedrive,
+            homedirectory=homedirectory, jobtitle=jobtitle,
+            department=department, company=company, description=description,
+            mailaddress=mailaddress, internetaddress=internetaddress,
+            telephonenumber=telephonenumber,
+            physicaldeliveryoffice=physicaldeliveryoffice, sd=sd,
+            uidnumber=uidnumber, gidnumber=gidnumber, gecos=gecos,
+            loginshell=loginshell, uid=uid, nisdomain=nisdomain,
+            unixhome=unixhome)
+
+        self.transaction_start()
+        try:
+            self.add(ldbmessage)
+            if ldbmessage2:
+                self.modify(ldbmessage2)
+
+            # Sets the password for it
+            if setpassword:
+                self.setpassword("(samAccountName={0!s})".format(ldb.binary_encode(username)), password,
+                                 force_password_change_at_next_login_req)
+        except:
+            self.transaction_cancel()
+            raise
+        else:
+            self.transaction_commit()
+
+    def newuser_messages(self, username, password=None,
+            force_password_change_at_next_login_req=False,
+            useusernameascn=False, userou=None, surname=None, givenname=None,
+            initials=None, profilepath=None, scriptpath=None, homedrive=None,
+            homedirectory=None, jobtitle=None, department=None, company=None,
+            description=None, mailaddress=None, internetaddress=None,
+            telephonenumber=None, physicaldeliveryoffice=None, sd=None,
+            uidnumber=None, gidnumber=None, gecos=None, loginshell=None,
+            uid=None, nisdomain=None, unixhome=None):
+        """Build the messages needed to create a new user
+
+        The parameters are as for newuser().  If a password is given it is
+        set in the add itself, together with an enabled userAccountControl,
+        so no further searches or modifies are needed for it.
+
+        :return: tuple of the add message (a dict) and an optional modify
+            message carrying the RFC2307 attributes
+        """
+
         displayname = ""
         if givenname is not None:
             displayname += givenname
@@ -442,22 +562,81 @@ member: {0!s}
                     'ABCD!efgh12345$67890', ldb.FLAG_MOD_REPLACE,
                     'unixUserPassword')
 
-        self.transaction_start()
-        try:
-            self.add(ldbmessage)
-            if ldbmessage2:
-                self.modify(ldbmessage2)
+        if password is not None:
+            pw = unicode('"' + password + '"', 'utf-8').encode('utf-16-le')
+            ldbmessage["unicodePwd"] = pw
+            ldbmessage["userAccountControl"] = str(dsdb.UF_NORMAL_ACCOUNT)
+            if force_password_change_at_next_login_req:
+                ldbmessage["pwdLastSet"] = "0"
 
-            # Sets the password for it
-            if setpassword:
-                self.setpassword("(samAccountName={0!s})".format(ldb.binary_encode(username)), password,
-                                 force_password_change_at_next_login_req)
-        except:
-            self.transaction_cancel()
-            raise
-        else:
-            self.transaction_commit()
+        return (ldbmessage, ldbmessage2)
+
+    def add_users(self, users, batch_size=100):
+        """Add many users, batch_size of them per transaction
 
+        If a batch fails it is cancelled and replayed one user per
+        transaction, so that a bad entry only costs its own row.
+
+        Over LDAP transactions are not supported, so cancelling a batch
+        does not remove the users added before the failure.  When such a
+        user is found to exist on replay, it is counted as created.
+
+        :param users: iterable of (name, add_message, modify_message) tuples,
+            as returned by newuser_messages(); modify_message may be None
+        :param batch_size: number of users to add in each transaction
+        :return: list of (index, name, error) tuples for the failed users
+        """
+        errors = []
+
+        users = iter(users)
+        index = 0
+        while True:
+            batch = []
+            for user in users:
+                batch.append((index, user))
+                index += 1
+                if len(batch) == batch_size:
+                    break
+            if not batch:
+                break
+
+            # the rows of the batch whose add, and whose add and modify,
+            # went through before it failed
+            added = set()
+            completed = set()
+            self.transaction_start()
+            try:
+                for (i, (name, add_msg, modify_msg)) in batch:
+                    self.add(add_msg)
+                    added.add(i)
+                    if modify_msg is not None:
+                        self.modify(modify_msg)
+                    completed.add(i)
+            except Exception, batch_error:
+                self.transaction_cancel()
+            else:
+                self.transaction_commit()
+                continue
+
+            for (i, (name, add_msg, modify_msg)) in batch:
+                self.transaction_start()
+                try:
+                    self.add(add_msg)
+                    if modify_msg is not None:
+                        self.modify(modify_msg)
+                except Exception, e:
+                    self.transaction_cancel()
+                    if (i in added and isinstance(e, ldb.LdbError) and
+                        e.args[0] == ldb.ERR_ENTRY_ALREADY_EXISTS):
+                        # left behind by the cancelled batch
+                        if i not in completed:
+                            errors.append((i, name, batch_error))
+                        continue
+                    errors.append((i, name, e))
+                else:
+                    self.transaction_commit()
+
+        return errors
 
     def deleteuser(self, username):
         """Deletes a user
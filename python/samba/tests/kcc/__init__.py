@@ -78,3 +78,67 @@ class KCCTests(samba.tests.TestCase):
         my_kcc.run("ldap://{0!s}".format(os.environ["SERVER"]),
                    self.lp, self.creds,
                    attempt_live_connections=False)
+
+    def test_load_all_sites(self):
+        """check that loading the whole Sites subtree in one search
+        finds the same DSAs, replicas and connections as loading the
+        sites one by one.
+        """
+        url = "ldap://{0!s}".format(os.environ["SERVER"])
+        bulk_kcc = kcc.KCC(unix_now, readonly=True)
+        bulk_kcc.load_samdb(url, self.lp, self.creds)
+        bulk_kcc.load_all_sites()
+
+        site_kcc = kcc.KCC(unix_now, readonly=True)
+        site_kcc.load_samdb(url, self.lp, self.creds)
+        for site in bulk_kcc.site_table.values():
+            site_kcc.load_site(site.site_dnstr)
+
+        self.assertEqual(sorted(bulk_kcc.site_table),
+                         sorted(site_kcc.site_table))
+        self.assertEqual(sorted(bulk_kcc.dsa_by_dnstr),
+                         sorted(site_kcc.dsa_by_dnstr))
+
+        for dnstr, dsa in bulk_kcc.dsa_by_dnstr.items():
+            other = site_kcc.dsa_by_dnstr[dnstr]
+            self.assertEqual(str(dsa.dsa_guid), str(other.dsa_guid))
+            self.assertEqual(dsa.is_ro(), other.is_ro())
+            self.assertEqual(dsa.default_dnstr, other.default_dnstr)
+            self.assertEqual(sorted(dsa.current_rep_table),
+                             sorted(other.current_rep_table))
+            for nc_dnstr, rep in dsa.current_rep_table.items():
+                other_rep = other.current_rep_table[nc_dnstr]
+                self.assertEqual(rep.nc_type, other_rep.nc_type)
+                self.assertEqual(rep.is_present(), other_rep.is_present())
+            self.assertEqual(sorted(dsa.connect_table),
+                             sorted(other.connect_table))
+            for cn_dnstr, cn in dsa.connect_table.items():
+                other_cn = other.connect_table[cn_dnstr]
+                self.assertEqual(cn.from_dnstr, other_cn.from_dnstr)
+                self.assertEqual(str(cn.transport_guid),
+                                 str(other_cn.transport_guid))
+
+    def test_export_topology(self):
+        """check that a readonly run exports a topology that reads back
+        the same, and differs from itself in nothing.
+        """
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, "topology.json")
+        try:
+            my_kcc = kcc.KCC(unix_now, readonly=True, topology_file=filename)
+            my_kcc.run("ldap://{0!s}".format(os.environ["SERVER"]),
+                       self.lp, self.creds,
+                       attempt_live_connections=False)
+
+            topology = kcc.load_topology(filename)
+            self.assertEqual(topology["dsa"], my_kcc.my_dsa_dnstr)
+            self.assertEqual(kcc.diff_topology(topology, my_kcc.topology), [])
+
+            changes = kcc.diff_topology({}, topology)
+            self.assertEqual(len(changes), len(topology["connections"]) +
+                             len(topology["repsFrom"]))
+            self.assertEqual(set(c[1] for c in changes), set('+'))
+        finally:
+            if os.path.exists(filename):
+                os.unlink(filename)
+            os.rmdir(tmpdir)
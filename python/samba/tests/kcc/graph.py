@@ -22,8 +22,13 @@
 import samba
 import samba.tests
 from samba.kcc.graph import *
+from samba.ndr import ndr_pack
+from samba.dcerpc import misc
 
 import itertools
+import random
+
+IP_TRANSPORT = "IP"
 
 
 def ntdsconn_schedule(times):
@@ -44,6 +49,102 @@ def ntdsconn_schedule(times):
     return schedule
 
 
+class SyntheticSite(object):
+    """Just enough of a kcc_utils.Site for the intersite graph"""
+    def __init__(self, n):
+        self.site_dnstr = ("CN=Site-{0:d},CN=Sites,CN=Configuration,"
+                           "DC=samba,DC=example,DC=com".format(n))
+        self.site_guid = misc.GUID("{0:08x}-0000-0000-0000-000000000000".format(n + 1))
+        self.dsa_table = {}
+
+
+class SyntheticPartition(object):
+    """Just enough of a kcc_utils.Partition for the intersite graph"""
+    nc_dnstr = "DC=samba,DC=example,DC=com"
+
+
+def synthetic_intersite_graph(n_sites, n_red=None, links_per_site=None,
+                              seed=1):
+    """Build an IntersiteGraph of a given size, for testing and
+    benchmarking the spanning tree functions.
+
+    Each site is a vertex, and each site link an edge between two
+    sites with a pseudo-random cost. The graph is a full mesh unless
+    links_per_site is given, in which case it is a ring with extra
+    random chords.
+
+    :param n_sites: the number of sites
+    :param n_red: how many of the sites have full replicas (the
+                  others have none); defaults to all of them
+    :param links_per_site: approximate number of links from each site
+    :param seed: seed for the random costs and chords
+    :return: an IntersiteGraph, with one edge set holding every edge
+    """
+    rng = random.Random(seed)
+    if n_red is None:
+        n_red = n_sites
+    part = SyntheticPartition()
+    graph = IntersiteGraph()
+    vertices = []
+    for i in range(n_sites):
+        site = SyntheticSite(i)
+        v = Vertex(site, part)
+        v.guid = str(site.site_guid)
+        v.ndrpacked_guid = ndr_pack(site.site_guid)
+        if i < n_red:
+            v.color = VertexColor.red
+        else:
+            v.color = VertexColor.white
+        v.accept_red_red.append(IP_TRANSPORT)
+        v.accept_black.append(IP_TRANSPORT)
+        vertices.append(v)
+        graph.vertices.add(v)
+
+    if links_per_site is None:
+        pairs = itertools.combinations(range(n_sites), 2)
+    else:
+        pairs = set((i, (i + 1) % n_sites) for i in range(n_sites))
+        for i in range(n_sites * max(links_per_site - 2, 0) // 2):
+            a, b = rng.sample(range(n_sites), 2)
+            pairs.add((a, b))
+        pairs = sorted(pairs)
+
+    e_set = MultiEdgeSet()
+    for a, b in pairs:
+        e = MultiEdge()
+        e.vertices = [vertices[a], vertices[b]]
+        e.repl_info.cost = rng.randint(1, 1000)
+        e.repl_info.set_repltimes_from_schedule(None)
+        e.con_type = IP_TRANSPORT
+        e.directed = False
+        graph.edges.add(e)
+        e_set.edges.append(e)
+        vertices[a].edges.append(e)
+        vertices[b].edges.append(e)
+
+    graph.edge_set.add(e_set)
+    graph.connected_vertices = set(vertices)
+    return graph
+
+
+def reference_costs(graph):
+    """The cheapest path cost from any red vertex to each vertex, by a
+    simple quadratic Dijkstra's algorithm."""
+    costs = {}
+    for v in graph.vertices:
+        costs[v] = 0 if v.is_red() else MAX_DWORD
+    todo = set(graph.vertices)
+    while todo:
+        v = min(todo, key=costs.get)
+        todo.remove(v)
+        for e in v.edges:
+            for w in e.vertices:
+                c = min(costs[v] + e.repl_info.cost, MAX_DWORD)
+                if c < costs[w]:
+                    costs[w] = c
+    return costs
+
+
 class GraphFunctionTests(samba.tests.TestCase):
 
     def test_total_schedule(self):
@@ -68,3 +169,53 @@ class GraphFunctionTests(samba.tests.TestCase):
             schedule = ntdsconn_schedule(ntdsconn_times)
             self.assertEquals(convert_schedule_to_repltimes(schedule),
                               repltimes)
+
+    def test_dijkstra_synthetic(self):
+        for n_sites, n_red, links in ((10, 10, None),
+                                      (40, 5, None),
+                                      (60, 20, 4),
+                                      (120, 1, 3)):
+            graph = synthetic_intersite_graph(n_sites, n_red, links)
+            expected = reference_costs(graph)
+            dijkstra(graph, IP_TRANSPORT, False)
+            for v in graph.vertices:
+                self.assertEquals(v.repl_info.cost, expected[v])
+                self.assertTrue(v.root is not None and v.root.is_red())
+
+    def test_spanning_tree_synthetic(self):
+        for n_sites, links in ((30, None), (100, 4)):
+            graph = synthetic_intersite_graph(n_sites, None, links)
+            my_site = sorted(graph.vertices,
+                             key=lambda v: v.ndrpacked_guid)[0].site
+            edges, components = get_spanning_tree_edges(graph, my_site)
+            self.assertEquals(components, 1)
+            for e in edges:
+                self.assertTrue(my_site in [v.site for v in e.vertices])
+
+    def test_internal_edge_sort_key(self):
+        rng = random.Random(2)
+        graph = synthetic_intersite_graph(6)
+        vertices = sorted(graph.vertices, key=lambda v: v.ndrpacked_guid)
+        edges = []
+        for i in range(300):
+            v1, v2 = sorted(rng.sample(vertices, 2),
+                            key=lambda v: v.ndrpacked_guid)
+            ri = ReplInfo()
+            ri.cost = rng.choice((1, 2, 3))
+            ri.duration = rng.choice((168, 336))
+            edges.append(InternalEdge(v1, v2, rng.choice((True, False)), ri,
+                                      rng.choice(("IP", "SMTP")), None))
+        by_lt = sorted(edges)
+        by_key = sorted(edges, key=InternalEdge.sort_key)
+        self.assertEquals([e.sort_key() for e in by_lt],
+                          [e.sort_key() for e in by_key])
+
+    def test_kruskal_synthetic(self):
+        for n_sites, links in ((20, None), (80, 3)):
+            graph = synthetic_intersite_graph(n_sites, None, links)
+            setup_vertices(graph)
+            internal_edges = set()
+            process_edge_set(graph, None, internal_edges)
+            output_edges, components = kruskal(graph, internal_edges)
+            self.assertEquals(components, 1)
+            self.assertEquals(len(output_edges), n_sites - 1)
@@ -22,8 +22,12 @@
 import samba
 import samba.tests
 from samba.kcc.graph_utils import *
+from samba.kcc.graph_utils import (
+    _brute_force_connected_under_edge_failures,
+    _brute_force_connected_under_vertex_failures)
 
 import itertools
+import random
 
 
 def make_tree(vertices):
@@ -80,6 +84,12 @@ class UndirectedGraphTests(samba.tests.TestCase):
 
         self.unconnected_graph = ((), vertices, ())
 
+        # two rings sharing the vertex 'a': no edge is critical, but 'a' is
+        bowtie_vertices = tuple('abcde')
+        self.bowtie = [(('a', 'b'), ('b', 'c'), ('c', 'a'),
+                        ('a', 'd'), ('d', 'e'), ('e', 'a')),
+                       bowtie_vertices, bowtie_vertices]
+
     def assertGraphError(self, fn, *args):
         return self.assertRaises(GraphError, fn, *args)
 
@@ -130,16 +140,58 @@ class UndirectedGraphTests(samba.tests.TestCase):
         self.assertIsNone(fn(*self.complete_graph))
 
     def test_graph_connected_under_vertex_failures(self):
-        #XXX no tests to distinguish this from the edge_failures case
         fn = verify_graph_connected_under_vertex_failures
 
         self.assertGraphError(fn, *self.line)
         self.assertGraphError(fn, *self.tree)
         self.assertGraphError(fn, *self.forest)
         self.assertGraphError(fn, *self.disconnected_clusters)
+        self.assertGraphError(fn, *self.bowtie)
 
         self.assertIsNone(fn(*self.ring))
         self.assertIsNone(fn(*self.complete_graph))
+        self.assertIsNone(verify_graph_connected_under_edge_failures(
+            *self.bowtie))
+
+    def test_bridges_and_articulation_points(self):
+        bridges, points = find_bridges_and_articulation_points(
+            *self.line[:2])
+        self.assertEqual(sorted(bridges), sorted(self.line[0]))
+        self.assertEqual(points, set(self.line[1][1:-1]))
+
+        bridges, points = find_bridges_and_articulation_points(
+            *self.bowtie[:2])
+        self.assertEqual(bridges, [])
+        self.assertEqual(points, set('a'))
+
+        # a doubled edge is not a bridge
+        bridges, points = find_bridges_and_articulation_points(
+            [('a', 'b'), ('b', 'a')], 'ab')
+        self.assertEqual(bridges, [])
+
+    def test_failures_match_brute_force(self):
+        rng = random.Random(1)
+
+        def passes(fn, *args):
+            try:
+                fn(*args)
+            except GraphError:
+                return False
+            return True
+
+        for i in range(500):
+            vertices = tuple('abcdefg'[:rng.randint(1, 7)])
+            edges = [(rng.choice(vertices), rng.choice(vertices))
+                     for j in range(rng.randint(1, 12))]
+            args = (edges, vertices, vertices)
+            self.assertEqual(
+                passes(verify_graph_connected_under_edge_failures, *args),
+                passes(_brute_force_connected_under_edge_failures, *args),
+                "edge failures differ for %s" % (edges,))
+            self.assertEqual(
+                passes(verify_graph_connected_under_vertex_failures, *args),
+                passes(_brute_force_connected_under_vertex_failures, *args),
+                "vertex failures differ for %s" % (edges,))
 
     def test_graph_multi_edge_forest(self):
         pass
@@ -18,7 +18,10 @@
 """Tests for samba.netcmd."""
 
 from cStringIO import StringIO
+import json
+import ldb
 from samba.netcmd import Command
+from samba.netcmd.common import netcmd_write_entries
 from samba.netcmd.testparm import cmd_testparm
 from samba.netcmd.main import cmd_sambatool
 import samba.tests
@@ -88,3 +91,43 @@ class CommandTests(NetCmdTestCase):
         self.fail(
             "The following commands do not have a short description set: {0!r}".format(
                 missing))
+
+
+class _RawSchemaFormat(object):
+    """stands in for a SamDB, formatting every value as it is"""
+
+    def schema_format_value(self, attr, value):
+        return value
+
+
+class WriteEntriesTests(samba.tests.TestCase):
+
+    def setUp(self):
+        super(WriteEntriesTests, self).setUp()
+        msg = ldb.Message(ldb.Dn(ldb.Ldb(), "CN=foo,DC=samba,DC=example,DC=com"))
+        msg["cn"] = ["foo"]
+        msg["logonHours"] = ["\xff\xff"]
+        self.entries = [msg]
+
+    def write_entries(self, output_format):
+        outf = StringIO()
+        netcmd_write_entries(_RawSchemaFormat(), outf, self.entries,
+                             ["cn", "logonHours"], output_format=output_format)
+        return outf.getvalue()
+
+    def test_plain(self):
+        self.assertEquals("dn: CN=foo,DC=samba,DC=example,DC=com\n"
+                          "cn: foo\n"
+                          "logonHours:: //8=\n\n",
+                          self.write_entries("plain"))
+
+    def test_json(self):
+        self.assertEquals({"dn": "CN=foo,DC=samba,DC=example,DC=com",
+                           "cn": ["foo"],
+                           "logonHours": [{"base64": "//8="}]},
+                          json.loads(self.write_entries("json")))
+
+    def test_csv(self):
+        self.assertEquals("dn,cn,logonHours\r\n"
+                          "\"CN=foo,DC=samba,DC=example,DC=com\",foo,//8=\r\n",
+                          self.write_entries("csv"))
@@ -18,7 +18,7 @@
 
 """Tests for samba.ntacls."""
 
-from samba.ntacls import setntacl, getntacl, XattrBackendError
+from samba.ntacls import setntacl, getntacl, XattrBackendError, NtaclContext
 from samba.param import LoadParm
 from samba.dcerpc import security
 from samba.tests import TestCaseInTempDir, SkipTest
@@ -55,6 +55,25 @@ class NtaclsTests(TestCaseInTempDir):
         self.assertEquals(facl.as_sddl(domsid),acl)
         os.unlink(os.path.join(self.tempdir,"eadbtest.tdb"))
 
+    def test_ntacl_context(self):
+        lp = LoadParm()
+        acl = "O:S-1-5-21-2212615479-2695158682-2101375467-512G:S-1-5-21-2212615479-2695158682-2101375467-513D:(A;OICI;0x001f01ff;;;S-1-5-21-2212615479-2695158682-2101375467-512)"
+        open(self.tempf, 'w').write("empty")
+        eadb = os.path.join(self.tempdir, "eadbtest.tdb")
+        ctx = NtaclContext(lp, "S-1-5-21-2212615479-2695158682-2101375467",
+                           backend="tdb", eadbfile=eadb)
+        try:
+            ctx.setntacl(self.tempf, acl)
+            self.assertTrue(ctx.descriptor(acl) is ctx.descriptor(acl))
+            facl = ctx.getntacl(self.tempf)
+        finally:
+            ctx.close()
+        domsid = security.dom_sid(security.SID_NT_SELF)
+        self.assertEquals(facl.as_sddl(domsid), acl)
+        facl = getntacl(lp, self.tempf, "tdb", eadb)
+        self.assertEquals(facl.as_sddl(domsid), acl)
+        os.unlink(eadb)
+
     def test_setntacl_invalidbackend(self):
         lp = LoadParm()
         acl = "O:S-1-5-21-2212615479-2695158682-2101375467-512G:S-1-5-21-2212615479-2695158682-2101375467-513D:(A;OICI;0x001f01ff;;;S-1-5-21-2212615479-2695158682-2101375467-512)"
@@ -27,6 +27,11 @@ from samba.provision import (
     setup_secretsdb,
     findnss,
     )
+from samba.provision.sysvol import (
+    SysvolAclMap,
+    split_tree,
+    unit_paths,
+    )
 import samba.tests
 from samba.tests import env_loadparm, TestCase
 
@@ -195,3 +200,44 @@ class DetermineNetbiosNameTests(TestCase):
 
     def test_strips_invalid(self):
         self.assertEquals("BLABLA", determine_netbios_name("bla/bla"))
+
+
+class SysvolWalkTests(samba.tests.TestCaseInTempDir):
+    """Tests for the sysvol tree splitting in samba.provision.sysvol."""
+
+    def setUp(self):
+        super(SysvolWalkTests, self).setUp()
+        self.top = os.path.join(self.tempdir, "sysvol")
+        self.paths = []
+        for d in ["", "a", "a/b", "a/b/c", "d"]:
+            path = os.path.normpath(os.path.join(self.top, d))
+            os.mkdir(path)
+            self.paths.append(path)
+        for f in ["f1", "a/f2", "a/b/c/f3", "d/f4"]:
+            path = os.path.join(self.top, f)
+            open(path, 'w').write("empty")
+            self.paths.append(path)
+
+    def tearDown(self):
+        for path in sorted(self.paths, reverse=True):
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.unlink(path)
+        super(SysvolWalkTests, self).tearDown()
+
+    def test_units_cover_tree_once(self):
+        for min_units in [1, 2, 3, 100]:
+            found = []
+            for unit in split_tree(self.top, min_units):
+                found.extend(unit_paths(*unit))
+            self.assertEquals(sorted(found), sorted(self.paths))
+
+    def test_acl_map(self):
+        acl_map = SysvolAclMap("S", exact={os.path.join(self.top, "a"): "P"},
+                               subtrees={os.path.join(self.top, "a", "b"): "G"})
+        self.assertEquals("S", acl_map.acl_for(self.top))
+        self.assertEquals("P", acl_map.acl_for(os.path.join(self.top, "a")))
+        self.assertEquals("S", acl_map.acl_for(os.path.join(self.top, "a", "f2")))
+        self.assertEquals("G", acl_map.acl_for(os.path.join(self.top, "a", "b")))
+        self.assertEquals("G", acl_map.acl_for(os.path.join(self.top, "a", "b", "c", "f3")))
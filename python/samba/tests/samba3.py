@@ -59,6 +59,15 @@ class RegistryTestCase(TestCase):
                            'ErrorControl': (4L, '\x01\x00\x00\x00')},
                            self.registry.values("HKLM/SYSTEM/CURRENTCONTROLSET/SERVICES/EVENTLOG"))
 
+    def test_itervalues(self):
+        self.assertEquals(self.registry.values("HKLM/SYSTEM/CURRENTCONTROLSET/SERVICES/EVENTLOG"),
+                          dict(self.registry.itervalues("HKLM/SYSTEM/CURRENTCONTROLSET/SERVICES/EVENTLOG")))
+        self.assertEquals([], list(self.registry.itervalues("HKLM/NONEXISTENT")))
+
+    def test_iterkeys(self):
+        self.assertEquals(sorted(self.registry.keys()),
+                          sorted(self.registry.iterkeys()))
+
 
 class PassdbTestCase(TestCaseInTempDir):
 
@@ -16,7 +16,9 @@
 #
 
 import os
+import json
 import time
+import tempfile
 import ldb
 from samba.tests.samba_tool.base import SambaToolCmdTest
 from samba import (
@@ -118,6 +120,47 @@ class GroupCmdTestCase(SambaToolCmdTest):
             found = self.assertMatch(out, name,
                                      "group '{0!s}' not found".format(name))
 
+    def test_list_json(self):
+        (result, out, err) = self.runsubcmd("group", "list",
+                                            "--attributes=sAMAccountName,groupType",
+                                            "--output-format=json",
+                                            "-H", "ldap://{0!s}".format(os.environ["DC_SERVER"]),
+                                            "-U{0!s}%{1!s}".format(os.environ["DC_USERNAME"],
+                                                          os.environ["DC_PASSWORD"]))
+        self.assertCmdSuccess(result, "Error running list")
+
+        grouplist = self.samdb.search(base=self.samdb.domain_dn(),
+                                      scope=ldb.SCOPE_SUBTREE,
+                                      expression="(objectClass=group)",
+                                      attrs=["samaccountname"])
+
+        entries = [json.loads(line) for line in out.splitlines()]
+        self.assertEquals(len(entries), len(grouplist))
+        names = set(e["sAMAccountName"][0] for e in entries)
+        for groupobj in grouplist:
+            name = groupobj.get("samaccountname", idx=0)
+            self.assertTrue(name in names, "group '{0!s}' not found".format(name))
+        for e in entries:
+            self.assertEquals(len(e["groupType"]), 1)
+
+    def test_search_pages(self):
+        pages = list(self.samdb.search_pages(self.samdb.domain_dn(),
+                                             scope=ldb.SCOPE_SUBTREE,
+                                             expression="(objectClass=group)",
+                                             attrs=["samaccountname"],
+                                             page_size=2))
+        self.assertTrue(len(pages) > 1)
+        for page in pages:
+            self.assertTrue(len(page) <= 2)
+
+        grouplist = self.samdb.search(base=self.samdb.domain_dn(),
+                                      scope=ldb.SCOPE_SUBTREE,
+                                      expression="(objectClass=group)",
+                                      attrs=["samaccountname"])
+        paged = [str(msg.dn) for page in pages for msg in page]
+        self.assertEquals(len(paged), len(set(paged)))
+        self.assertEquals(sorted(paged), sorted(str(msg.dn) for msg in grouplist))
+
     def test_listmembers(self):
         (result, out, err) = self.runsubcmd("group", "listmembers", "Domain Users",
                                             "-H", "ldap://{0!s}".format(os.environ["DC_SERVER"]),
@@ -138,6 +181,51 @@ class GroupCmdTestCase(SambaToolCmdTest):
             name = groupobj.get("samAccountName", idx=0)
             found = self.assertMatch(out, name, "group '{0!s}' not found".format(name))
 
+    def test_addmembers_from_file(self):
+        """This tests "group addmembers" with the names read from a file"""
+        (fd, path) = tempfile.mkstemp()
+        try:
+            os.write(fd, "Administrator\n\n{0!s}\n".format(self.groups[1]["name"]))
+            os.close(fd)
+            (result, out, err) = self.runsubcmd("group", "addmembers",
+                                                self.groups[0]["name"],
+                                                "--member-file={0!s}".format(path),
+                                                "-H", "ldap://{0!s}".format(os.environ["DC_SERVER"]),
+                                                "-U{0!s}%{1!s}".format(os.environ["DC_USERNAME"],
+                                                              os.environ["DC_PASSWORD"]))
+        finally:
+            os.unlink(path)
+        self.assertCmdSuccess(result, "Error running addmembers")
+        self.assertIn("Added members to group {0!s}".format(self.groups[0]["name"]), out)
+
+        group = self.samdb.search(base=self._find_group(self.groups[0]["name"]).dn,
+                                  scope=ldb.SCOPE_BASE, attrs=["member"])
+        members = [str(x).lower() for x in group[0]["member"]]
+        self.assertEquals(len(members), 2)
+        self.assertIn(str(self._find_group(self.groups[1]["name"]).dn).lower(), members)
+
+    def test_addmembers_non_ascii(self):
+        """This tests "group addmembers" with a non-ASCII member name in
+        another case than the member's"""
+        member = self._randomGroup({"name": "testgroup\xc3\xa5sa"})
+        self.groups.append(member)
+        (result, out, err) = self._create_group(member)
+        self.assertCmdSuccess(result)
+
+        (result, out, err) = self.runsubcmd("group", "addmembers",
+                                            self.groups[0]["name"],
+                                            "TESTGROUP\xc3\x85SA",
+                                            "-H", "ldap://{0!s}".format(os.environ["DC_SERVER"]),
+                                            "-U{0!s}%{1!s}".format(os.environ["DC_USERNAME"],
+                                                          os.environ["DC_PASSWORD"]))
+        self.assertCmdSuccess(result, "Error running addmembers")
+        self.assertIn("Added members to group {0!s}".format(self.groups[0]["name"]), out)
+
+        group = self.samdb.search(base=self._find_group(self.groups[0]["name"]).dn,
+                                  scope=ldb.SCOPE_BASE, attrs=["member"])
+        members = [str(x).lower() for x in group[0]["member"]]
+        self.assertEquals(members, [str(self._find_group(member["name"]).dn).lower()])
+
     def _randomGroup(self, base=None):
         """create a group with random attribute values, you can specify base attributes"""
         if base is None:
@@ -17,6 +17,7 @@
 
 import os
 import time
+import tempfile
 import ldb
 from samba.tests.samba_tool.base import SambaToolCmdTest
 from samba import (
@@ -196,6 +197,41 @@ class UserCmdTestCase(SambaToolCmdTest):
             name = userobj.get("samaccountname", idx=0)
             found = self.assertMatch(out, name,
                                      "user '{0!s}' not found".format(name))
+
+    def test_import(self):
+        for user in self.users:
+            (result, out, err) = self.runsubcmd("user", "delete", user["name"])
+            self.assertCmdSuccess(result, "Can we delete users")
+
+        columns = ["username", "password", "surname", "given-name",
+                   "job-title", "department", "description", "company"]
+        (fd, path) = tempfile.mkstemp(suffix=".csv")
+        f = os.fdopen(fd, "w")
+        try:
+            f.write(",".join(columns) + "\n")
+            for user in self.users:
+                values = [user["name"]] + [user[c] for c in columns[1:]]
+                f.write(",".join(values) + "\n")
+            # a duplicate row must be reported without failing the others
+            f.write("{0!s},{1!s}\n".format(self.users[0]["name"],
+                                           self.users[0]["password"]))
+            f.close()
+
+            (result, out, err) = self.runsubcmd("user", "import", path,
+                                                "--batch-size=3",
+                                                "-H", "ldap://{0!s}".format(os.environ["DC_SERVER"]),
+                                                "-U{0!s}%{1!s}".format(os.environ["DC_USERNAME"],
+                                                              os.environ["DC_PASSWORD"]))
+        finally:
+            os.unlink(path)
+
+        self.assertCmdFail(result, "Ensure that the duplicate row fails")
+        self.assertIn("Created {0:d} users".format(len(self.users)), out)
+        self.assertIn("line {0:d} ({1!s})".format(len(self.users) + 2,
+                                                  self.users[0]["name"]), err)
+        for user in self.users:
+            self._check_user(user)
+
     def test_getpwent(self):
         try:
             import pwd
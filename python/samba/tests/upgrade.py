@@ -17,8 +17,15 @@
 
 """Tests for samba.upgrade."""
 
-from samba.upgrade import import_wins
-from samba.tests import LdbTestCase
+import logging
+
+from samba.upgrade import (
+    import_wins,
+    get_posix_attrs_from_ldap_backend,
+    PhaseScheduler,
+    )
+from samba.provision import ProvisioningError
+from samba.tests import LdbTestCase, TestCase
 
 
 class WinsUpgradeTests(LdbTestCase):
@@ -38,3 +45,100 @@ class WinsUpgradeTests(LdbTestCase):
         import_wins(self.ldb, {})
         self.assertEquals("VERSION",
                 str(self.ldb.search(expression="(objectClass=winsMaxVersion)")[0]["cn"]))
+
+
+class PosixAttrsTests(LdbTestCase):
+
+    def setUp(self):
+        super(PosixAttrsTests, self).setUp()
+        self.set_modules(["paged_results"])
+        self.logger = logging.getLogger("upgrade-test")
+        self.logger.setLevel(logging.CRITICAL)
+        self.ldb.add({"dn": "dc=example", "dc": "example"})
+        for i in range(5):
+            self.ldb.add({"dn": "uid=user{0:d},dc=example".format(i),
+                          "objectClass": "posixAccount",
+                          "uid": "user{0:d}".format(i),
+                          "homeDirectory": "/home/user{0:d}".format(i),
+                          "loginShell": "/bin/sh",
+                          "gidNumber": str(100 + i)})
+
+    def test_paged(self):
+        attrs = get_posix_attrs_from_ldap_backend(self.logger, self.ldb,
+                                                  "dc=example", page_size=2)
+        self.assertEquals(["user{0:d}".format(i) for i in range(5)],
+                          sorted(attrs.keys()))
+        self.assertEquals({"homeDirectory": "/home/user3",
+                           "loginShell": "/bin/sh",
+                           "gidNumber": "103"},
+                          dict((k, str(v)) for (k, v) in attrs["user3"].items()))
+
+    def test_duplicate_and_missing(self):
+        self.ldb.add({"dn": "cn=other,dc=example",
+                      "objectClass": "posixAccount",
+                      "uid": "user1",
+                      "homeDirectory": "/home/other"})
+        self.ldb.add({"dn": "uid=user5,dc=example",
+                      "objectClass": "posixAccount",
+                      "uid": "user5",
+                      "homeDirectory": "/home/user5"})
+        attrs = get_posix_attrs_from_ldap_backend(self.logger, self.ldb,
+                                                  "dc=example", page_size=2)
+        self.assertFalse("user1" in attrs)
+        self.assertEquals(["homeDirectory"], attrs["user5"].keys())
+
+
+class PhaseSchedulerTests(TestCase):
+
+    def setUp(self):
+        super(PhaseSchedulerTests, self).setUp()
+        self.logger = logging.getLogger("upgrade-test")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def test_order(self):
+        order = []
+        scheduler = PhaseScheduler(self.logger, jobs=4)
+        scheduler.add("a", lambda phase: order.append("a"), resources=["db"])
+        scheduler.add("b", lambda phase: order.append("b"), requires=["c"])
+        scheduler.add("c", lambda phase: order.append("c"), resources=["db"])
+        scheduler.run()
+        self.assertEquals(["a", "c", "b"], order)
+
+    def test_sequential(self):
+        order = []
+        scheduler = PhaseScheduler(self.logger)
+        for name in "abc":
+            scheduler.add(name, lambda phase, name=name: order.append(name))
+        scheduler.run()
+        self.assertEquals(["a", "b", "c"], order)
+
+    def test_error(self):
+        order = []
+        def fail(phase):
+            raise ValueError("failed")
+        scheduler = PhaseScheduler(self.logger, jobs=2)
+        scheduler.add("a", fail)
+        scheduler.add("b", lambda phase: order.append("b"), requires=["a"])
+        self.assertRaises(ValueError, scheduler.run)
+        self.assertEquals([], order)
+
+    def test_progress(self):
+        scheduler = PhaseScheduler(self.logger)
+        phase = scheduler.add("a", lambda phase: phase.step(3), total=6)
+        scheduler.run()
+        self.assertEquals(3, phase.done)
+        self.assertTrue("3/6" in phase.progress())
+
+    def test_separate(self):
+        scheduler = PhaseScheduler(self.logger, jobs=2)
+        phase = scheduler.add("a", lambda phase: phase.step(5), separate=True)
+        scheduler.add("b", lambda phase: phase.step(), requires=["a"])
+        scheduler.run()
+        self.assertEquals(5, phase.done)
+
+    def test_separate_error(self):
+        def fail(phase):
+            raise ValueError("failed")
+        scheduler = PhaseScheduler(self.logger, jobs=2)
+        scheduler.add("a", fail, separate=True)
+        self.assertRaises(ProvisioningError, scheduler.run)
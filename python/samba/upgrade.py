@@ -23,6 +23,8 @@ __docformat__ = "restructuredText"
 import ldb
 import time
 import pwd
+import multiprocessing
+import sys
 
 from samba import Ldb, registry
 from samba.param import LoadParm
@@ -33,8 +35,9 @@ from samba.samba3 import param as s3param
 from samba.dcerpc import lsa, samr, security
 from samba.dcerpc.security import dom_sid
 from samba.credentials import Credentials
+from samba.idmap import IDmapDB
 from samba import dsdb
-from samba.ndr import ndr_pack
+from samba.ndr import ndr_pack, ndr_unpack
 from samba import unix2nttime
 from samba import generate_random_password
 
@@ -295,28 +298,290 @@ def add_group_from_mapping_entry(samdb, groupmap, logger):
             logger.warn('Could not add group name=%s (%s)', groupmap.nt_name, str(e))
 
 
-def add_users_to_group(samdb, group, members, logger):
+def get_group_member_sids(samdb, group):
+    """Get the SIDs of the current members of a group/alias
+
+    param samdb: Samba4 SAM database
+    param group: Groupmap object
+    return: set of member SIDs, as strings
+    """
+    res = samdb.search(base="<SID={0!s}>".format(str(group.sid)),
+                       scope=ldb.SCOPE_BASE, attrs=["member"],
+                       controls=["extended_dn:1:1"])
+    sids = set()
+    for member in res[0].get("member", []):
+        sid = ldb.Dn(samdb, member).get_extended_component("SID")
+        if sid is not None:
+            sids.add(str(ndr_unpack(security.dom_sid, sid)))
+    return sids
+
+
+def add_users_to_group(samdb, group, members, logger, chunk_size=1000):
     """Add user/member to group/alias
 
+    The members not already in the group are added with one multi-valued
+    modify per chunk_size members.  Should a chunk fail, its members are
+    added one at a time so that the failing member can be reported.
+
     param samdb: Samba4 SAM database
     param group: Groupmap object
     param members: List of member SIDs
     param logger: Logger object
+    param chunk_size: Maximum number of members added per modify
+    return: number of members added
     """
+    try:
+        existing = get_group_member_sids(samdb, group)
+    except ldb.LdbError, (ecode, emsg):
+        raise ProvisioningError("Could not add members to group '{0!s}' as the group record doesn't exist: {1!s}".format(group.sid, emsg))
+
+    new_members = []
     for member_sid in members:
+        member_sid = str(member_sid)
+        if member_sid in existing:
+            logger.debug("skipped re-adding member '%s' to group '%s'", member_sid, group.sid)
+            continue
+        existing.add(member_sid)
+        new_members.append(member_sid)
+
+    for i in range(0, len(new_members), chunk_size):
+        chunk = new_members[i:i + chunk_size]
         m = ldb.Message()
         m.dn = ldb.Dn(samdb, "<SID={0!s}>".format(str(group.sid)))
-        m['a01'] = ldb.MessageElement("<SID={0!s}>".format(str(member_sid)), ldb.FLAG_MOD_ADD, 'member')
-
+        m['member'] = ldb.MessageElement(["<SID={0!s}>".format(sid) for sid in chunk],
+                                         ldb.FLAG_MOD_ADD, 'member')
         try:
             samdb.modify(m)
-        except ldb.LdbError, (ecode, emsg):
-            if ecode == ldb.ERR_ENTRY_ALREADY_EXISTS:
-                logger.debug("skipped re-adding member '%s' to group '%s': %s", member_sid, group.sid, emsg)
-            elif ecode == ldb.ERR_NO_SUCH_OBJECT:
-                raise ProvisioningError("Could not add member '{0!s}' to group '{1!s}' as either group or user record doesn't exist: {2!s}".format(member_sid, group.sid, emsg))
-            else:
-                raise ProvisioningError("Could not add member '{0!s}' to group '{1!s}': {2!s}".format(member_sid, group.sid, emsg))
+        except ldb.LdbError:
+            for member_sid in chunk:
+                add_user_to_group(samdb, group, member_sid, logger)
+
+    return len(new_members)
+
+
+def add_user_to_group(samdb, group, member_sid, logger):
+    """Add a single user/member to group/alias
+
+    param samdb: Samba4 SAM database
+    param group: Groupmap object
+    param member_sid: Member SID
+    param logger: Logger object
+    """
+    m = ldb.Message()
+    m.dn = ldb.Dn(samdb, "<SID={0!s}>".format(str(group.sid)))
+    m['a01'] = ldb.MessageElement("<SID={0!s}>".format(str(member_sid)), ldb.FLAG_MOD_ADD, 'member')
+
+    try:
+        samdb.modify(m)
+    except ldb.LdbError, (ecode, emsg):
+        if ecode == ldb.ERR_ENTRY_ALREADY_EXISTS:
+            logger.debug("skipped re-adding member '%s' to group '%s': %s", member_sid, group.sid, emsg)
+        elif ecode == ldb.ERR_NO_SUCH_OBJECT:
+            raise ProvisioningError("Could not add member '{0!s}' to group '{1!s}' as either group or user record doesn't exist: {2!s}".format(member_sid, group.sid, emsg))
+        else:
+            raise ProvisioningError("Could not add member '{0!s}' to group '{1!s}': {2!s}".format(member_sid, group.sid, emsg))
+
+
+def log_phase_rate(logger, phase, start, count, what):
+    """Log the time taken by a phase of the upgrade
+
+    param logger: Logger object
+    param phase: Name of the phase
+    param start: Time the phase started, from time.time()
+    param count: Number of objects handled
+    param what: Name of the objects handled
+    """
+    elapsed = time.time() - start
+    logger.info("%s: %d %s in %.1f seconds (%.1f %s/second)", phase, count,
+                what, elapsed, count / max(elapsed, 0.001), what)
+
+
+class UpgradePhase(object):
+    """A phase of the upgrade, run by a PhaseScheduler
+
+    The phase function is called with the phase, and reports its progress
+    by calling step().  A phase with separate=True is run in a process of
+    its own, so it must open the databases it uses itself.
+    """
+
+    def __init__(self, name, func, requires=(), resources=(), total=None,
+                 what="objects", separate=False):
+        self.name = name
+        self.func = func
+        self.requires = set(requires)
+        self.resources = set(resources)
+        self.total = total
+        self.what = what
+        self.separate = separate
+        # shared with the process running a separate phase
+        self._done = multiprocessing.Value("l", 0, lock=False)
+        self.start = None
+        self.process = None
+        self.scheduler = None
+
+    @property
+    def done(self):
+        return self._done.value
+
+    def step(self, count=1):
+        """Record that count more objects have been handled."""
+        self._done.value += count
+        if self.scheduler is not None and not self.separate:
+            self.scheduler.log_progress()
+
+    def progress(self):
+        """Return a line describing the progress of the running phase."""
+        elapsed = time.time() - self.start
+        done = self.done
+        rate = done / max(elapsed, 0.001)
+        if not self.total:
+            return "{0!s}: {1:d} {2!s} in {3:.0f} seconds ({4:.1f} {2!s}/second)".format(
+                self.name, done, self.what, elapsed, rate)
+        if done:
+            eta = "{0:.0f} seconds".format((self.total - done) / rate)
+        else:
+            eta = "unknown"
+        return "{0!s}: {1:d}/{2:d} {3!s} ({4:.0f}%), {5:.1f} {3!s}/second, ETA {6!s}".format(
+            self.name, done, self.total, self.what,
+            100.0 * done / self.total, rate, eta)
+
+
+class PhaseScheduler(object):
+    """Run the phases of the upgrade, overlapping those that can be
+
+    A phase starts once the phases it requires have finished and no
+    running phase holds any of its resources (the databases it writes
+    to), with at most jobs phases running at once.  Phases are run in
+    this process one at a time; only phases added with separate=True,
+    which are run in processes of their own, overlap with them.  With
+    jobs=1 the phases are run one at a time, in the order they were
+    added.
+
+    The progress of running phases is logged every progress_interval
+    seconds, and the time taken by each phase when it finishes.  If a
+    phase fails, no more phases are started and the error is raised once
+    the running phases have finished.
+    """
+
+    def __init__(self, logger, jobs=1, progress_interval=10):
+        self.logger = logger
+        self.jobs = jobs
+        self.progress_interval = progress_interval
+        self.phases = []
+        self.running = []
+        self.last_progress = None
+
+    def add(self, name, func, requires=(), resources=(), total=None,
+            what="objects", separate=False):
+        """Add a phase
+
+        :param name: Name of the phase
+        :param func: Function run with the UpgradePhase as its argument
+        :param requires: Names of the phases that must finish first
+        :param resources: Names of the databases the phase writes to
+        :param total: Number of objects the phase will handle, if known
+        :param what: Name of the objects handled
+        :param separate: Whether to run the phase in a process of its own
+        """
+        phase = UpgradePhase(name, func, requires, resources, total, what,
+                             separate)
+        phase.scheduler = self
+        self.phases.append(phase)
+        return phase
+
+    def log_progress(self, force=False):
+        """Log the progress of the running phases, if it is time to."""
+        now = time.time()
+        if not force and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        for phase in self.running:
+            self.logger.info(phase.progress())
+
+    def _run_separate(self, phase):
+        try:
+            phase.func(phase)
+        except:
+            self.logger.exception("%s failed", phase.name)
+            sys.exit(1)
+
+    def _start(self, phase):
+        self.logger.info(phase.name)
+        phase.start = time.time()
+        self.running.append(phase)
+        if phase.separate:
+            # anything still buffered would otherwise be written twice
+            sys.stdout.flush()
+            sys.stderr.flush()
+            phase.process = multiprocessing.Process(target=self._run_separate,
+                                                    args=(phase,))
+            phase.process.start()
+
+    def _finish(self, phase, finished):
+        self.running.remove(phase)
+        finished.add(phase.name)
+        log_phase_rate(self.logger, phase.name, phase.start, phase.done,
+                       phase.what)
+
+    def run(self):
+        pending = list(self.phases)
+        finished = set()
+        error = None
+        self.running = []
+        self.last_progress = time.time()
+
+        while True:
+            for phase in [p for p in self.running if not p.process.is_alive()]:
+                phase.process.join()
+                if phase.process.exitcode != 0:
+                    self.running.remove(phase)
+                    if error is None:
+                        error = (ProvisioningError, ProvisioningError(
+                            "{0!s} failed".format(phase.name)), None)
+                else:
+                    self._finish(phase, finished)
+
+            inline = None
+            if error is None:
+                busy = set()
+                for phase in self.running:
+                    busy.update(phase.resources)
+                for phase in list(pending):
+                    if len(self.running) >= self.jobs:
+                        break
+                    if not phase.requires.issubset(finished):
+                        continue
+                    if phase.resources & busy:
+                        continue
+                    pending.remove(phase)
+                    busy.update(phase.resources)
+                    self._start(phase)
+                    if not phase.separate:
+                        inline = phase
+                        break
+
+            if inline is not None:
+                try:
+                    inline.func(inline)
+                except:
+                    self.logger.error("%s failed", inline.name)
+                    self.running.remove(inline)
+                    error = sys.exc_info()
+                else:
+                    self._finish(inline, finished)
+                continue
+
+            if not self.running:
+                break
+
+            self.running[0].process.join(1)
+            self.log_progress()
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if pending:
+            raise ProvisioningError("Could not run phases {0!s}: the phases they require did not run".format(
+                ", ".join(p.name for p in pending)))
 
 
 def import_wins(samba4_winsdb, samba3_winsdb):
@@ -388,42 +653,66 @@ def import_registry(samba4_registry, samba3_regdb):
         keypath = keypath.replace("/", "\\")
         return samba4_registry.create_key(predef_id, keypath)
 
-    for key in samba3_regdb.keys():
+    for key in samba3_regdb.iterkeys():
         key_handle = ensure_key_exists(key)
         for subkey in samba3_regdb.subkeys(key):
             ensure_key_exists(subkey)
-        for (value_name, (value_type, value_data)) in samba3_regdb.values(key).items():
+        for (value_name, (value_type, value_data)) in samba3_regdb.itervalues(key):
             key_handle.set_value(value_name, value_type, value_data)
 
-def get_posix_attr_from_ldap_backend(logger, ldb_object, base_dn, user, attr):
-    """Get posix attributes from a samba3 ldap backend
-    :param ldbs: a list of ldb connection objects
+def get_posix_attrs_from_ldap_backend(logger, ldb_object, base_dn,
+        attrs=("homeDirectory", "loginShell", "gidNumber"), page_size=1000):
+    """Get posix attributes of all users from a samba3 ldap backend
+
+    This reads all posixAccount entries with a single paged search, rather
+    than searching for each user and attribute in turn.
+
+    :param ldb_object: ldb connection object to the backend
     :param base_dn: the base_dn of the connection
-    :param user: the user to get the attribute for
-    :param attr: the attribute to be retrieved
+    :param attrs: the attributes to be retrieved
+    :param page_size: number of entries to ask for per page
+    :return: dict of uid to a dict of attribute name to value, holding only
+        the attributes that are set
     """
+    entries = {}
+    duplicates = set()
     try:
-        msg = ldb_object.search(base_dn, scope=ldb.SCOPE_SUBTREE,
-                        expression=("(&(objectClass=posixAccount)(uid={0!s}))".format((user))), attrs=[attr])
+        for res in ldb_object.search_pages(base_dn, scope=ldb.SCOPE_SUBTREE,
+                expression="(objectClass=posixAccount)",
+                attrs=["uid"] + list(attrs), page_size=page_size):
+            for msg in res:
+                if "uid" not in msg:
+                    continue
+                values = {}
+                for attr in attrs:
+                    if attr in msg:
+                        values[attr] = msg[attr][0]
+                # a posixAccount may carry alternative uids
+                for user in msg["uid"]:
+                    user = str(user)
+                    if user in entries:
+                        duplicates.add(user)
+                    entries[user] = values
     except ldb.LdbError, e:
-        raise ProvisioningError("Failed to retrieve attribute {0!s} for user {1!s}, the error is: {2!s}".format(attr, user, e))
-    else:
-        if msg.count <= 1:
-            # This will raise KeyError (which is what we want) if there isn't a entry for this user
-            return msg[0][attr][0]
-        else:
-            logger.warning("LDAP entry for user %s contains more than one %s", user, attr)
-            raise KeyError
+        raise ProvisioningError("Failed to retrieve posix attributes from {0!s}, the error is: {1!s}".format(base_dn, e))
+
+    for user in sorted(duplicates):
+        logger.warning("More than one LDAP entry for user %s, ignoring its posix attributes", user)
+        del entries[user]
+    return entries
 
 
 def upgrade_from_samba3(samba3, logger, targetdir, session_info=None,
-        useeadb=False, dns_backend=None, use_ntvfs=False):
+        useeadb=False, dns_backend=None, use_ntvfs=False, jobs=1):
     """Upgrade from samba3 database to samba4 AD database
 
     :param samba3: samba3 object
     :param logger: Logger object
     :param targetdir: samba4 database directory
     :param session_info: Session information
+    :param jobs: Number of import phases to run at once (the WINS and idmap
+        imports run in separate processes alongside the samdb phases), and
+        of processes setting the sysvol ACLs
     """
     serverrole = samba3.lp.server_role()
 
@@ -668,39 +957,29 @@ Please fix this account before attempting to upgrade again
             else:
                 break
     logger.info("Exporting posix attributes")
+    if ldap:
+        ldap_attrs = get_posix_attrs_from_ldap_backend(logger, ldb_object, base_dn)
     userlist = s3db.search_users(0)
     for entry in userlist:
         username = entry['account_name']
         if username in uids.keys():
-            try:
-                if ldap:
-                    homes[username] = get_posix_attr_from_ldap_backend(logger, ldb_object, base_dn, username, "homeDirectory")
-                else:
-                    homes[username] = pwd.getpwnam(username).pw_dir
-            except KeyError:
-                pass
-            except IndexError:
-                pass
-
-            try:
-                if ldap:
-                    shells[username] = get_posix_attr_from_ldap_backend(logger, ldb_object, base_dn, username, "loginShell")
-                else:
-                    shells[username] = pwd.getpwnam(username).pw_shell
-            except KeyError:
-                pass
-            except IndexError:
-                pass
+            if ldap:
+                attrs = ldap_attrs.get(username, {})
+                if "homeDirectory" in attrs:
+                    homes[username] = attrs["homeDirectory"]
+                if "loginShell" in attrs:
+                    shells[username] = attrs["loginShell"]
+                if "gidNumber" in attrs:
+                    pgids[username] = attrs["gidNumber"]
+                continue
 
             try:
-                if ldap:
-                    pgids[username] = get_posix_attr_from_ldap_backend(logger, ldb_object, base_dn, username, "gidNumber")
-                else:
-                    pgids[username] = pwd.getpwnam(username).pw_gid
+                pw = pwd.getpwnam(username)
             except KeyError:
-                pass
-            except IndexError:
-                pass
+                continue
+            homes[username] = pw.pw_dir
+            shells[username] = pw.pw_shell
+            pgids[username] = pw.pw_gid
 
     logger.info("Reading WINS database")
     samba3_winsdb = None
@@ -732,19 +1011,36 @@ Please fix this account before attempting to upgrade again
                        use_ntvfs=use_ntvfs, skip_sysvolacl=True)
     result.report_logger(logger)
 
+    # The rest of the upgrade is run as phases.  The WINS and idmap imports
+    # write to databases of their own, so they are run in separate
+    # processes and may overlap with the phases writing to the samdb.
+    scheduler = PhaseScheduler(logger, jobs=jobs)
+
     # Import WINS database
-    logger.info("Importing WINS database")
+    def import_wins_phase(phase):
+        import_wins(Ldb(result.paths.winsdb), samba3_winsdb)
+        phase.step(len(samba3_winsdb))
 
     if samba3_winsdb:
-        import_wins(Ldb(result.paths.winsdb), samba3_winsdb)
+        scheduler.add("Importing WINS database", import_wins_phase,
+                      resources=["winsdb"], total=len(samba3_winsdb),
+                      what="records", separate=True)
 
     # Set Account policy
-    logger.info("Importing Account policy")
-    import_sam_policy(result.samdb, policy, logger)
+    def import_policy_phase(phase):
+        import_sam_policy(result.samdb, policy, logger)
+
+    scheduler.add("Importing Account policy", import_policy_phase,
+                  resources=["samdb"])
 
     # Migrate IDMAP database
-    logger.info("Importing idmap database")
-    import_idmap(result.idmap, samba3, logger)
+    def import_idmap_phase(phase):
+        idmapdb = IDmapDB(result.paths.idmapdb, session_info=session_info,
+                          lp=result.lp)
+        import_idmap(idmapdb, samba3, logger)
+
+    scheduler.add("Importing idmap database", import_idmap_phase,
+                  resources=["idmapdb"], separate=True)
 
     # Set the s3 context for samba4 configuration
     new_lp_ctx = s3param.get_context()
@@ -756,82 +1052,96 @@ Please fix this account before attempting to upgrade again
     # Connect to samba4 backend
     s4_passdb = passdb.PDB(new_lp_ctx.get("passdb backend"))
 
-    # Start a new transaction (should speed this up a little, due to index churn)
-    result.samdb.transaction_start()
-
-    logger.info("Adding groups")
-    try:
-        # Export groups to samba4 backend
-        logger.info("Importing groups")
-        for g in grouplist:
-            # Ignore uninitialized groups (gid = -1)
-            if g.gid != -1:
-                add_group_from_mapping_entry(result.samdb, g, logger)
-                add_ad_posix_idmap_entry(result.samdb, g.sid, g.gid, "ID_TYPE_GID", logger)
-                add_posix_attrs(samdb=result.samdb, sid=g.sid, name=g.nt_name, nisdomain=domainname.lower(), xid_type="ID_TYPE_GID", logger=logger)
-
-    except:
-        # We need this, so that we do not give even more errors due to not cancelling the transaction
-        result.samdb.transaction_cancel()
-        raise
-
-    logger.info("Committing 'add groups' transaction to disk")
-    result.samdb.transaction_commit()
-
-    logger.info("Adding users")
-    # Start a new transaction (should speed this up a little, due to index churn)
-    result.samdb.transaction_start()
-
-    try:
-        # Export users to samba4 backend
-        logger.info("Importing users")
-        for username in userdata:
-            if username.lower() == 'administrator':
-                if userdata[username].user_sid != dom_sid(str(domainsid) + "-500"):
-                    logger.error("User 'Administrator' in your existing directory has SID {0!s}, expected it to be {1!s}".format(userdata[username].user_sid, dom_sid(str(domainsid) + "-500")))
-                    raise ProvisioningError("User 'Administrator' in your existing directory does not have SID ending in -500")
-            if username.lower() == 'root':
-                if userdata[username].user_sid == dom_sid(str(domainsid) + "-500"):
-                    logger.warn('User root has been replaced by Administrator')
-                else:
-                    logger.warn('User root has been kept in the directory, it should be removed in favour of the Administrator user')
-
-            s4_passdb.add_sam_account(userdata[username])
-            if username in uids:
-                add_ad_posix_idmap_entry(result.samdb, userdata[username].user_sid, uids[username], "ID_TYPE_UID", logger)
-                if (username in homes) and (homes[username] is not None) and \
-                   (username in shells) and (shells[username] is not None) and \
-                   (username in pgids) and (pgids[username] is not None):
-                    add_posix_attrs(samdb=result.samdb, sid=userdata[username].user_sid, name=username, nisdomain=domainname.lower(), xid_type="ID_TYPE_UID", home=homes[username], shell=shells[username], pgid=pgids[username], logger=logger)
-
-    except:
-        # We need this, so that we do not give even more errors due to not cancelling the transaction
-        result.samdb.transaction_cancel()
-        raise
-
-    logger.info("Committing 'add users' transaction to disk")
-    result.samdb.transaction_commit()
-
-    logger.info("Adding users to groups")
-    # Start a new transaction (should speed this up a little, due to index churn)
-    result.samdb.transaction_start()
+    def add_groups_phase(phase):
+        # Start a new transaction (should speed this up a little, due to index churn)
+        result.samdb.transaction_start()
+        try:
+            # Export groups to samba4 backend
+            for g in grouplist:
+                # Ignore uninitialized groups (gid = -1)
+                if g.gid != -1:
+                    add_group_from_mapping_entry(result.samdb, g, logger)
+                    add_ad_posix_idmap_entry(result.samdb, g.sid, g.gid, "ID_TYPE_GID", logger)
+                    add_posix_attrs(samdb=result.samdb, sid=g.sid, name=g.nt_name, nisdomain=domainname.lower(), xid_type="ID_TYPE_GID", logger=logger)
+                    phase.step()
+
+        except:
+            # We need this, so that we do not give even more errors due to not cancelling the transaction
+            result.samdb.transaction_cancel()
+            raise
+
+        logger.info("Committing 'add groups' transaction to disk")
+        result.samdb.transaction_commit()
+
+    scheduler.add("Adding groups", add_groups_phase,
+                  requires=["Importing Account policy"], resources=["samdb"],
+                  total=len([g for g in grouplist if g.gid != -1]),
+                  what="groups")
+
+    def add_users_phase(phase):
+        # Start a new transaction (should speed this up a little, due to index churn)
+        result.samdb.transaction_start()
+        try:
+            # Export users to samba4 backend
+            for username in userdata:
+                if username.lower() == 'administrator':
+                    if userdata[username].user_sid != dom_sid(str(domainsid) + "-500"):
+                        logger.error("User 'Administrator' in your existing directory has SID {0!s}, expected it to be {1!s}".format(userdata[username].user_sid, dom_sid(str(domainsid) + "-500")))
+                        raise ProvisioningError("User 'Administrator' in your existing directory does not have SID ending in -500")
+                if username.lower() == 'root':
+                    if userdata[username].user_sid == dom_sid(str(domainsid) + "-500"):
+                        logger.warn('User root has been replaced by Administrator')
+                    else:
+                        logger.warn('User root has been kept in the directory, it should be removed in favour of the Administrator user')
+
+                s4_passdb.add_sam_account(userdata[username])
+                if username in uids:
+                    add_ad_posix_idmap_entry(result.samdb, userdata[username].user_sid, uids[username], "ID_TYPE_UID", logger)
+                    if (username in homes) and (homes[username] is not None) and \
+                       (username in shells) and (shells[username] is not None) and \
+                       (username in pgids) and (pgids[username] is not None):
+                        add_posix_attrs(samdb=result.samdb, sid=userdata[username].user_sid, name=username, nisdomain=domainname.lower(), xid_type="ID_TYPE_UID", home=homes[username], shell=shells[username], pgid=pgids[username], logger=logger)
+                phase.step()
+
+        except:
+            # We need this, so that we do not give even more errors due to not cancelling the transaction
+            result.samdb.transaction_cancel()
+            raise
+
+        logger.info("Committing 'add users' transaction to disk")
+        result.samdb.transaction_commit()
+
+    # new accounts must not be given ids that the idmap import is about
+    # to claim
+    scheduler.add("Adding users", add_users_phase,
+                  requires=["Adding groups", "Importing idmap database"],
+                  resources=["samdb"], total=len(userdata), what="users")
+
+    def add_members_phase(phase):
+        # Start a new transaction (should speed this up a little, due to index churn)
+        result.samdb.transaction_start()
+        try:
+            for g in grouplist:
+                if str(g.sid) in groupmembers:
+                    add_users_to_group(result.samdb, g, groupmembers[str(g.sid)], logger)
+                    phase.step(len(groupmembers[str(g.sid)]))
 
-    try:
-        for g in grouplist:
-            if str(g.sid) in groupmembers:
-                add_users_to_group(result.samdb, g, groupmembers[str(g.sid)], logger)
+        except:
+            # We need this, so that we do not give even more errors due to not cancelling the transaction
+            result.samdb.transaction_cancel()
+            raise
 
-    except:
-        # We need this, so that we do not give even more errors due to not cancelling the transaction
-        result.samdb.transaction_cancel()
-        raise
+        logger.info("Committing 'add users to groups' transaction to disk")
+        result.samdb.transaction_commit()
 
-    logger.info("Committing 'add users to groups' transaction to disk")
-    result.samdb.transaction_commit()
+    scheduler.add("Adding users to groups", add_members_phase,
+                  requires=["Adding users"], resources=["samdb"],
+                  total=sum(len(groupmembers[str(g.sid)]) for g in grouplist
+                            if str(g.sid) in groupmembers),
+                  what="members")
 
     # Set password for administrator
-    if admin_user:
-        logger.info("Setting password for administrator")
+    def set_admin_password_phase(phase):
         admin_userdata = s4_passdb.getsampwnam("administrator")
         admin_userdata.nt_passwd = userdata[admin_user].nt_passwd
         if userdata[admin_user].lanman_passwd:
@@ -842,11 +1152,27 @@ Please fix this account before attempting to upgrade again
         s4_passdb.update_sam_account(admin_userdata)
         logger.info("Administrator password has been set to password of user '%s'", admin_user)
 
-    if result.server_role == "active directory domain controller":
+    if admin_user:
+        scheduler.add("Setting password for administrator",
+                      set_admin_password_phase,
+                      requires=["Adding users to groups"], resources=["samdb"])
+
+    def set_sysvol_acl_phase(phase):
         setsysvolacl(result.samdb, result.paths.netlogon, result.paths.sysvol,
                 result.paths.root_uid, result.paths.root_gid,
                 security.dom_sid(result.domainsid), result.names.dnsdomain,
-                result.names.domaindn, result.lp, use_ntvfs)
+                result.names.domaindn, result.lp, use_ntvfs, jobs=jobs,
+                logger=logger)
+
+    if result.server_role == "active directory domain controller":
+        # this reads the samdb and maps SIDs through the idmap, so it waits
+        # for the phases writing to them
+        scheduler.add("Setting sysvol ACLs", set_sysvol_acl_phase,
+                      requires=[p.name for p in scheduler.phases
+                                if "winsdb" not in p.resources],
+                      resources=["samdb", "sysvol"])
+
+    scheduler.run()
 
     # FIXME: import_registry(registry.Registry(), samba3.get_registry())
     # FIXME: shares
@@ -107,6 +107,9 @@ def run_testsuite_command(name, cmd, subunit_ops, env=None, outf=None):
     subunit_ops.start_testsuite(name)
     subunit_ops.progress(None, subunit.PROGRESS_PUSH)
     subunit_ops.time(now())
+    # the command writes to the file descriptor directly, so what was
+    # written through outf has to be out of the way first
+    outf.flush()
     try:
         exitcode = subprocess.call(cmd, shell=True, stdout=outf)
     except Exception, e:
@@ -18,11 +18,13 @@
 
 import atexit
 from cStringIO import StringIO
+import multiprocessing
 import os
 import sys
 import signal
 import subprocess
 from samba import subunit
+import tempfile
 import traceback
 import warnings
 
@@ -76,6 +78,7 @@ parser.add_option("--srcdir", type=str, default=".", help="source directory")
 parser.add_option("--bindir", type=str, default="./bin", help="binaries directory")
 parser.add_option("--testlist", type=str, action="append", help="file to read available tests from")
 parser.add_option("--ldap", help="back samba onto specified ldap server", choices=["openldap", "fedora-ds"], type="choice")
+parser.add_option("--jobs", "-j", help="number of test environment instances to run testsuites against in parallel (requires socket wrapper)", type=int, default=1)
 
 opts, args = parser.parse_args()
 
@@ -118,24 +121,27 @@ def cleanup_pcap(pcap_file, exit_code):
     os.unlink(pcap_file)
 
 
-def run_testsuite(name, cmd, subunit_ops, env=None):
+def run_testsuite(name, cmd, subunit_ops, env=None, outf=None):
     """Run a single testsuite.
 
     :param env: Environment to run in
     :param name: Name of the testsuite
     :param cmd: Name of the (fully expanded) command to run
+    :param outf: File to write the output to (defaults to sys.stdout)
     :return: exitcode of the command
     """
+    if outf is None:
+        outf = sys.stdout
     pcap_file = setup_pcap(name)
 
-    exitcode = run_testsuite_command(name, cmd, subunit_ops, env)
+    exitcode = run_testsuite_command(name, cmd, subunit_ops, env, outf)
     if exitcode is None:
         sys.exit(1)
 
     cleanup_pcap(pcap_file, exitcode)
 
     if not opts.socket_wrapper_keep_pcap and pcap_file is not None:
-        sys.stdout.write("PCAP FILE: {0!s}\n".format(pcap_file))
+        outf.write("PCAP FILE: {0!s}\n".format(pcap_file))
 
     if exitcode != 0 and opts.one:
         sys.exit(1)
@@ -147,6 +153,10 @@ if opts.list and opts.testenv:
     sys.stderr.write("--list and --testenv are mutually exclusive\n")
     sys.exit(1)
 
+if opts.jobs < 1:
+    sys.stderr.write("--jobs must be at least 1\n")
+    sys.exit(1)
+
 tests = args
 
 # quick hack to disable rpc validation when using valgrind - it is way too slow
@@ -228,6 +238,10 @@ if opts.socket_wrapper:
 elif not opts.list:
     if os.getuid() != 0:
         warnings.warn("not using socket wrapper, but also not running as root. Will not be able to listen on proper ports")
+    if opts.jobs > 1 and not opts.testenv:
+        # each job needs a network of its own for its environments
+        sys.stderr.write("--jobs requires --socket-wrapper\n")
+        sys.exit(1)
 
 testenv_default = "none"
 
@@ -437,6 +451,101 @@ def switch_env(name, prefix):
 
     return env
 
+def run_todo_testsuite(testsuite, subunit_ops, outf=None):
+    """Run a testsuite from todo in its environment.
+
+    :param testsuite: Tuple describing the testsuite
+    :param subunit_ops: Subunit ops to use for reporting results
+    :param outf: File to write the output to (defaults to sys.stdout)
+    """
+    (name, envname, cmd, supports_loadfile, supports_idlist, subtests) = testsuite
+    try:
+        env = switch_env(envname, prefix)
+    except UnsupportedEnvironment:
+        subunit_ops.start_testsuite(name)
+        subunit_ops.end_testsuite(name, "skip",
+            "environment {0!s} is unknown in this test backend - skipping".format(envname))
+        return
+    except Exception, e:
+        subunit_ops.start_testsuite(name)
+        traceback.print_exc()
+        subunit_ops.end_testsuite(name, "error",
+            "unable to set up environment {0!s}: {1!s}".format(envname, e))
+        return
+
+    cmd, tmpf = expand_command_run(cmd, supports_loadfile, supports_idlist,
+        subtests)
+
+    run_testsuite(name, cmd, subunit_ops, env=env, outf=outf)
+
+    if tmpf is not None:
+        os.remove(tmpf)
+
+    if opts.resetup_environment:
+        env_manager.teardown_env(envname)
+
+
+def run_job(jobid, queue, lock):
+    """Run testsuites as one of several parallel jobs.
+
+    Each job sets up its own instances of the environments, in a prefix and
+    socket wrapper directory of its own, and takes the testsuites of one
+    environment at a time from queue.  The output of each testsuite is
+    collected and written to stdout as a whole, so that the subunit streams
+    of the jobs do not interleave.
+
+    :param jobid: Number of the job
+    :param queue: Queue of lists of testsuites, ending with None
+    :param lock: Lock serialising the writes to stdout
+    """
+    global prefix, clientdir, conffile, env_manager
+
+    prefix = os.path.join(prefix_abs, "job{0:d}".format(jobid))
+    tmpdir = os.path.join(prefix, "tmp")
+    for d in (prefix, tmpdir):
+        if not os.path.isdir(d):
+            os.mkdir(d, 0700)
+    os.environ["PREFIX"] = prefix
+    os.environ["PREFIX_ABS"] = prefix
+    os.environ["KRB5CCNAME"] = os.path.join(prefix, "krb5ticket")
+    os.environ["SELFTEST_PREFIX"] = prefix
+    os.environ["SELFTEST_TMPDIR"] = tmpdir
+    os.environ["TEST_DATA_PREFIX"] = tmpdir
+    socket_wrapper.setup_dir(os.path.join(prefix, "w"), opts.socket_wrapper_pcap)
+    dns_host_file = os.path.join(prefix, "dns_host_file")
+    if os.path.exists(dns_host_file):
+        os.unlink(dns_host_file)
+
+    clientdir = os.path.join(prefix, "client")
+    conffile = os.path.join(clientdir, "client.conf")
+    os.environ["SMB_CONF_PATH"] = conffile
+    env_manager = EnvironmentManager(target)
+
+    try:
+        while True:
+            group = queue.get()
+            if group is None:
+                break
+            for testsuite in group:
+                outf = tempfile.TemporaryFile()
+                try:
+                    try:
+                        run_todo_testsuite(testsuite,
+                            subunithelper.SubunitOps(outf), outf)
+                    finally:
+                        outf.seek(0)
+                        lock.acquire()
+                        try:
+                            sys.stdout.write(outf.read())
+                            sys.stdout.flush()
+                        finally:
+                            lock.release()
+                finally:
+                    outf.close()
+    finally:
+        env_manager.teardown_all()
+
+
 # This 'global' file needs to be empty when we start
 dns_host_file_path = os.path.join(prefix_abs, "dns_host_file")
 if os.path.exists(dns_host_file_path):
@@ -482,32 +591,51 @@ elif opts.list:
         if exitcode != 0:
             sys.stderr.write("{0!s} exited with exit code {1!s}\n".format(cmd, exitcode))
             sys.exit(1)
+elif opts.jobs > 1:
+    # Split the testsuites of each environment into several groups, so that
+    # they can be shared between jobs, each job then setting up its own
+    # instance of the environment.  A job keeps the environments it has set
+    # up, for later groups of the same environment.
+    max_size = max(1, len(todo) // (opts.jobs * 4))
+    groups = testlist.group_testsuites_by_env(todo, max_size)
+    queue = multiprocessing.Queue()
+    for group in groups:
+        queue.put(group)
+    jobs = min(opts.jobs, len(groups))
+    for i in range(jobs):
+        queue.put(None)
+    lock = multiprocessing.Lock()
+
+    # anything still buffered would otherwise be written by each job too
+    sys.stdout.flush()
+    workers = []
+    for i in range(jobs):
+        worker = multiprocessing.Process(target=run_job, args=(i, queue, lock))
+        worker.start()
+        workers.append(worker)
+
+    failed = False
+    while workers:
+        for worker in list(workers):
+            worker.join(1)
+            if worker.is_alive():
+                continue
+            workers.remove(worker)
+            if worker.exitcode != 0:
+                sys.stderr.write("Job {0!s} exited with code {1!s}\n".format(
+                    worker.name, worker.exitcode))
+                failed = True
+        if failed and opts.one:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            break
+    if failed:
+        sys.exit(1)
 else:
-    for (name, envname, cmd, supports_loadfile, supports_idlist, subtests) in todo:
-        try:
-            env = switch_env(envname, prefix)
-        except UnsupportedEnvironment:
-            subunit_ops.start_testsuite(name)
-            subunit_ops.end_testsuite(name, "skip",
-                "environment {0!s} is unknown in this test backend - skipping".format(envname))
-            continue
-        except Exception, e:
-            subunit_ops.start_testsuite(name)
-            traceback.print_exc()
-            subunit_ops.end_testsuite(name, "error",
-                "unable to set up environment {0!s}: {1!s}".format(envname, e))
-            continue
-
-        cmd, tmpf = expand_command_run(cmd, supports_loadfile, supports_idlist,
-            subtests)
-
-        run_testsuite(name, cmd, subunit_ops, env=env)
-
-        if tmpf is not None:
-            os.remove(tmpf)
-
-        if opts.resetup_environment:
-            env_manager.teardown_env(envname)
+    for testsuite in todo:
+        run_todo_testsuite(testsuite, subunit_ops)
     env_manager.teardown_all()
 
 sys.stdout.write("\n")
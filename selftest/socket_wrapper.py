@@ -45,12 +45,12 @@ def setup_dir(dir, pcap):
     if pcap_dir is not None:
         os.environ["SOCKET_WRAPPER_PCAP_DIR"] = pcap_dir
     else:
-        del os.environ["SOCKET_WRAPPER_PCAP_DIR"]
+        os.environ.pop("SOCKET_WRAPPER_PCAP_DIR", None)
 
     if dir is not None:
         os.environ["SOCKET_WRAPPER_DIR"] = dir
     else:
-        del os.environ["SOCKET_WRAPPER_DIR"]
+        os.environ.pop("SOCKET_WRAPPER_DIR", None)
 
     return dir
 
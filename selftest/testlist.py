@@ -91,6 +91,36 @@ def read_testlist(inf, outf):
             outf.write(l)
 
 
+def group_testsuites_by_env(testsuites, max_size=None):
+    """Group test suites by the environment they run in.
+
+    :param testsuites: Test suite tuples, with the environment name second
+    :param max_size: Maximum number of test suites in a group; the test
+        suites of an environment are split into several groups if needed
+    :return: List of lists of test suites of a single environment
+        (ignoring any ":option" suffix), largest first.  Test suites keep
+        their order.
+    """
+    groups = {}
+    order = []
+    for testsuite in testsuites:
+        envname = testsuite[1].split(":", 1)[0]
+        if envname not in groups:
+            groups[envname] = []
+            order.append(envname)
+        groups[envname].append(testsuite)
+    ret = []
+    for envname in order:
+        group = groups[envname]
+        if max_size is None:
+            ret.append(group)
+        else:
+            for i in range(0, len(group), max_size):
+                ret.append(group[i:i + max_size])
+    ret.sort(key=len, reverse=True)
+    return ret
+
+
 def read_restricted_test_list(f):
     for l in f.readlines():
         yield l.strip()
@@ -27,6 +27,7 @@ from samba.tests import TestCase
 from selftest.testlist import (
     RestrictedTestManager,
     find_in_list,
+    group_testsuites_by_env,
     open_file_or_pipe,
     read_test_regexes,
     read_testlist,
@@ -80,6 +81,29 @@ class ReadTestlistTests(TestCase):
 
 
 
+class GroupTestsuitesByEnvTests(TestCase):
+
+    def test_empty(self):
+        self.assertEquals([], group_testsuites_by_env([]))
+
+    def test_group(self):
+        self.assertEquals([
+            [("a", "dc", "cmd"), ("c", "dc:local", "cmd"), ("d", "dc", "cmd")],
+            [("b", "none", "cmd")]],
+            group_testsuites_by_env([
+                ("a", "dc", "cmd"), ("b", "none", "cmd"),
+                ("c", "dc:local", "cmd"), ("d", "dc", "cmd")]))
+
+    def test_max_size(self):
+        self.assertEquals([
+            [("a", "dc", "cmd"), ("c", "dc:local", "cmd")],
+            [("d", "dc", "cmd")],
+            [("b", "none", "cmd")]],
+            group_testsuites_by_env([
+                ("a", "dc", "cmd"), ("b", "none", "cmd"),
+                ("c", "dc:local", "cmd"), ("d", "dc", "cmd")], max_size=2))
+
+
 class RestrictedTestManagerTests(TestCase):
 
     def test_unused(self):
@@ -107,6 +107,61 @@ static PyObject *py_wrap_getxattr(PyObject *self, PyObject *args)
 	return ret;
 }
 
+/*
+ * Databases opened by hold_db() stay open until release_db().  While they
+ * are held, the opens in wrap_getxattr() and wrap_setxattr() find the tdb
+ * already open in the tdb_wrap cache, rather than opening it each time.
+ */
+static TALLOC_CTX *held_dbs;
+static unsigned int held_count;
+
+static PyObject *py_hold_db(PyObject *self, PyObject *args)
+{
+	char *tdbname;
+	TALLOC_CTX *mem_ctx;
+	struct tdb_wrap *eadb;
+
+	if (!PyArg_ParseTuple(args, "s", &tdbname))
+		return NULL;
+
+	if (held_dbs == NULL) {
+		held_dbs = talloc_new(NULL);
+		if (held_dbs == NULL) {
+			PyErr_NoMemory();
+			return NULL;
+		}
+	}
+
+	mem_ctx = talloc_new(NULL);
+	eadb = tdb_wrap_open(
+		held_dbs, tdbname, 50000,
+		lpcfg_tdb_flags(py_default_loadparm_context(mem_ctx),
+				TDB_DEFAULT),
+		O_RDWR|O_CREAT, 0600);
+	talloc_free(mem_ctx);
+
+	if (eadb == NULL) {
+		PyErr_SetFromErrno(PyExc_IOError);
+		if (held_count == 0) {
+			TALLOC_FREE(held_dbs);
+		}
+		return NULL;
+	}
+	held_count++;
+	Py_RETURN_NONE;
+}
+
+static PyObject *py_release_db(PyObject *self)
+{
+	if (held_count > 0) {
+		held_count--;
+		if (held_count == 0) {
+			TALLOC_FREE(held_dbs);
+		}
+	}
+	Py_RETURN_NONE;
+}
+
 static PyMethodDef py_posix_eadb_methods[] = {
 	{ "wrap_getxattr", (PyCFunction)py_wrap_getxattr, METH_VARARGS,
 		"wrap_getxattr(filename,attribute) -> blob\n"
@@ -116,6 +171,12 @@ static PyMethodDef py_posix_eadb_methods[] = {
 		"Set the given attribute to the given value on the given file." },
 	{ "is_xattr_supported", (PyCFunction)py_is_xattr_supported, METH_NOARGS,
 		"Return true if xattr are supported on this system\n"},
+	{ "hold_db", (PyCFunction)py_hold_db, METH_VARARGS,
+		"hold_db(tdbname)\n"
+		"Keep the given database open until release_db() is called." },
+	{ "release_db", (PyCFunction)py_release_db, METH_NOARGS,
+		"release_db()\n"
+		"Release a database held open by hold_db()." },
 	{ NULL }
 };
 
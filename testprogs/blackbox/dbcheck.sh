@@ -22,6 +22,11 @@ dbcheck_reset_well_known_acls() {
 	$BINDIR/samba-tool dbcheck --cross-ncs --reset-well-known-acls $@
 }
 
+# The workers must not share the transaction of the parent
+dbcheck_jobs_fix() {
+	$BINDIR/samba-tool dbcheck --cross-ncs --jobs=2 --fix --yes $@
+}
+
 reindex() {
 	$BINDIR/samba-tool dbcheck --reindex
 }
@@ -35,6 +40,7 @@ force_modules() {
 }
 
 testit "dbcheck" dbcheck
+testit "dbcheck_jobs_fix" dbcheck_jobs_fix
 testit "reindex" reindex
 testit "fixed_attrs" fixed_attrs
 testit "force_modules" force_modules